@@ -7,9 +7,69 @@ service ImpressCache {
 		3: string data,
 	),
 
+	/**
+	 * Gets objects' data from the cache, and optionally the stored slots
+	 * (cached with a time limit).  The slots may be limited to those which
+	 * overlap the [start, end) range (unix time, 0 means unbounded) and to
+	 * the latest count slots (0 means unlimited); stored slots are included
+	 * if the range reaches beyond the cached ones.
+	 */
 	string get(
 		1: string site,
 		2: list<string> objkeys,
+		3: bool stored = false,
+		4: i64 start = 0,
+		5: i64 end = 0,
+		6: i32 count = 0,
+	),
+
+	/**
+	 * Lists the keys of an object type (optionally only those which start
+	 * with prefix) in the cached slots, in sorted order.  Returns a JSON
+	 * object with "keys" and "cursor"; pass the cursor to continue the
+	 * listing (it's empty at the end).  Default limit is 1000.
+	 */
+	string scan(
+		1: string site,
+		2: string objtype,
+		3: string prefix = "",
+		4: string cursor = "",
+		5: i32 limit = 0,
+	),
+
+	/**
+	 * Aggregates the data of the listed objects, or the objects whose keys
+	 * start with prefix (if it's not empty), per cached slot.  Operations:
+	 * "sum" (item totals), "top" (limit objects with the largest item value)
+	 * and "group" (per item key count, sum, min and max).  The slots may be
+	 * limited to the [start, end) range like with get.
+	 */
+	string aggregate(
+		1: string site,
+		2: string operation,
+		3: list<string> objkeys,
+		4: string prefix = "",
+		5: string item = "",
+		6: i32 limit = 0,
+		7: i64 start = 0,
+		8: i64 end = 0,
+	),
+
+	/**
+	 * Returns the objects with the largest totals of an item per cached slot
+	 * as JSON [objkey, total, error] lists, largest first.  The totals are
+	 * approximate (over-estimated by at most the error).  Only the object
+	 * types and items configured in the [topk] section are tracked.  Default
+	 * limit is 10; the slots may be limited to the [start, end) range like
+	 * with get.
+	 */
+	string top(
+		1: string site,
+		2: string objtype,
+		3: string item,
+		4: i32 limit = 0,
+		5: i64 start = 0,
+		6: i64 end = 0,
 	),
 
 	/**
@@ -23,7 +83,8 @@ service ImpressCache {
 	i64 getCounter(1: string key),
 
 	/**
-	 * Gets the counters for this service
+	 * Gets the counters for this service: gc and process statistics, and
+	 * the service metrics (see the metrics module)
 	 */
 	map<string, i64> getCounters(),
 
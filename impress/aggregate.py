@@ -0,0 +1,95 @@
+""" Server-side aggregation of objects' data.  The aggregated values of an
+    object are the numeric values returned by its model's aggregate() method.
+"""
+
+from __future__ import absolute_import
+
+import heapq
+
+numeric_types = int, long, float
+
+class Sum(object):
+	""" Item totals over all objects.
+	"""
+	def __init__(self, item, limit):
+		self.totals = {}
+
+	def add(self, objkey, values):
+		totals = self.totals
+
+		for itemkey, value in values.iteritems():
+			if isinstance(value, numeric_types):
+				totals[itemkey] = totals.get(itemkey, 0) + value
+
+	def result(self):
+		return self.totals
+
+class Top(object):
+	""" The objects with the largest value of an item (or total of all items
+	    if item is empty), largest first.
+	"""
+	def __init__(self, item, limit):
+		self.item = item
+		self.limit = limit or 10
+		self.heap = []
+
+	def add(self, objkey, values):
+		if self.item:
+			value = values.get(self.item)
+			if not isinstance(value, numeric_types):
+				return
+		else:
+			value = sum(v for v in values.itervalues() if isinstance(v, numeric_types))
+
+		if len(self.heap) < self.limit:
+			heapq.heappush(self.heap, (value, objkey))
+		elif value > self.heap[0][0]:
+			heapq.heapreplace(self.heap, (value, objkey))
+
+	def result(self):
+		return [[objkey, value] for value, objkey in sorted(self.heap, reverse=True)]
+
+class Group(object):
+	""" Per item statistics: the number of objects which have it, and the
+	    sum, minimum and maximum value.
+	"""
+	def __init__(self, item, limit):
+		self.groups = {}
+
+	def add(self, objkey, values):
+		groups = self.groups
+
+		for itemkey, value in values.iteritems():
+			if not isinstance(value, numeric_types):
+				continue
+
+			group = groups.get(itemkey)
+			if group is None:
+				groups[itemkey] = [1, value, value, value]
+			else:
+				group[0] += 1
+				group[1] += value
+				if value < group[2]:
+					group[2] = value
+				if value > group[3]:
+					group[3] = value
+
+	def result(self):
+		return { itemkey: { "keys": n, "sum": total, "min": low, "max": high } for itemkey, (n, total, low, high) in self.groups.iteritems() }
+
+operations = {
+	"sum":   Sum,
+	"top":   Top,
+	"group": Group,
+}
+
+def make_aggregator(operation, item, limit):
+	""" @type  operation: str
+	    @type  item:      str
+	    @type  limit:     int
+	    @rtype            Sum | Top | Group
+	"""
+	cls = operations.get(operation)
+	if cls is None:
+		raise ValueError("Unknown aggregate operation: " + operation)
+	return cls(item, limit)
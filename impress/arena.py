@@ -0,0 +1,432 @@
+""" Cache data of packed models (see models.packed) in an mmap'ed arena
+    instead of Python objects, so that reading it doesn't dirty memory pages
+    of forked children (refcounts), and so that the active slot can be read
+    from another process.  Enabled by setting the capacity option of the
+    [arena] section.
+
+    The arena is a fixed-size hash table with linear probing.  A record
+    consists of the key length, the model number, the key and the counters.
+    The header contains the table dimensions, the number of records and the
+    model names.  Objects which don't fit (unpacked models, long keys or a
+    full table) are kept in a normal dictionary.
+
+    If the path option is set, the arena of the active slot of a site is
+    kept in that file (it's replaced when the slot rotates), otherwise it's
+    anonymous memory.
+"""
+
+from __future__ import absolute_import
+
+import copy
+import json
+import mmap
+import os
+import struct
+import zlib
+
+from .config import conf, log
+from .registry import load_model
+
+MAGIC = "IMPA\1"
+
+_header = struct.Struct("<5sIIII")  # magic, capacity, key size, counters, count
+_length = struct.Struct("<H")
+_record = struct.Struct("<HH")      # key length, model number
+
+HEADER_SIZE = 4096
+
+EMPTY = 0
+DELETED = 0xffff
+
+class Arena(object):
+
+	max_load = 0.75
+
+	def __init__(self, buf, capacity, key_size, counters, models=None):
+		""" @type buf:      mmap.mmap
+		    @type capacity: int
+		    @type key_size: int
+		    @type counters: int
+		    @type models:   list(str) | NoneType
+		"""
+		self.buf = buf
+		self.capacity = capacity
+		self.key_size = key_size
+		self.counters = counters
+		self.record_size = _record.size + key_size + 8 * counters
+		self.models = models or []
+		self.count = 0
+		self.limit = int(capacity * self.max_load)
+
+	@classmethod
+	def create(cls, capacity, key_size=64, counters=8, path=None):
+		""" @type  capacity: int
+		    @type  key_size: int
+		    @type  counters: int
+		    @type  path:     str | NoneType
+		    @rtype           Arena
+		"""
+		size = HEADER_SIZE + capacity * (_record.size + key_size + 8 * counters)
+
+		if path:
+			# replace the previous file, which stays mapped by its slot
+			tempname = path + ".tmp"
+			fd = os.open(tempname, os.O_RDWR | os.O_CREAT | os.O_TRUNC, 0644)
+			try:
+				os.ftruncate(fd, size)
+				buf = mmap.mmap(fd, size)
+			finally:
+				os.close(fd)
+
+			os.rename(tempname, path)
+		else:
+			buf = mmap.mmap(-1, size)
+
+		arena = cls(buf, capacity, key_size, counters)
+		arena.write_header()
+
+		return arena
+
+	@classmethod
+	def open(cls, path):
+		""" Map an arena file read-only.
+
+		    @type  path: str
+		    @rtype       Arena
+		"""
+		with open(path, "rb") as file:
+			buf = mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ)
+
+		magic, capacity, key_size, counters, count = _header.unpack_from(buf, 0)
+		if magic != MAGIC:
+			raise Exception("unknown arena format: " + path)
+
+		length, = _length.unpack_from(buf, _header.size)
+		offset = _header.size + _length.size
+
+		arena = cls(buf, capacity, key_size, counters, json.loads(buf[offset:offset + length]))
+		arena.count = count
+
+		return arena
+
+	def write_header(self):
+		data = json.dumps(self.models)
+		if _header.size + _length.size + len(data) > HEADER_SIZE:
+			raise ValueError("too many arena models")
+
+		_header.pack_into(self.buf, 0, MAGIC, self.capacity, self.key_size, self.counters, self.count)
+		_length.pack_into(self.buf, _header.size, len(data))
+		self.buf[_header.size + _length.size:_header.size + _length.size + len(data)] = data
+
+	def model_number(self, name):
+		""" @type  name: str
+		    @rtype       int
+		"""
+		try:
+			return self.models.index(name)
+		except ValueError:
+			self.models.append(name)
+			self.write_header()
+			return len(self.models) - 1
+
+	def __probe(self, objkey):
+		""" Offsets of the records where the key may be.
+
+		    @type  objkey: str
+		    @rtype         iterator(int)
+		"""
+		capacity = self.capacity
+		i = (zlib.crc32(objkey) & 0xffffffff) % capacity
+
+		for _ in xrange(capacity):
+			yield HEADER_SIZE + i * self.record_size
+
+			i += 1
+			if i == capacity:
+				i = 0
+
+	def find(self, objkey):
+		""" @type  objkey: str
+		    @rtype         (int, int) | NoneType
+		    @return        record offset and model number
+		"""
+		buf = self.buf
+		length = len(objkey)
+
+		for offset in self.__probe(objkey):
+			key_length, number = _record.unpack_from(buf, offset)
+
+			if key_length == EMPTY:
+				break
+
+			if key_length == length:
+				start = offset + _record.size
+				if buf[start:start + length] == objkey:
+					return offset, number
+
+		return None
+
+	def insert(self, objkey, number):
+		""" Allocate a zeroed record.
+
+		    @type  objkey: str
+		    @type  number: int
+		    @rtype         int | NoneType
+		    @return        record offset, or None if the arena is full or the
+		                   key is too long
+		"""
+		length = len(objkey)
+		if length == 0 or length > self.key_size or self.count >= self.limit:
+			return None
+
+		buf = self.buf
+
+		for offset in self.__probe(objkey):
+			key_length, _ = _record.unpack_from(buf, offset)
+
+			if key_length == EMPTY or key_length == DELETED:
+				start = offset + _record.size
+				buf[start:start + self.record_size - _record.size] = "\0" * (self.record_size - _record.size)
+				buf[start:start + length] = objkey
+				_record.pack_into(buf, offset, length, number)
+
+				self.count += 1
+				_header.pack_into(buf, 0, MAGIC, self.capacity, self.key_size, self.counters, self.count)
+
+				return offset
+
+		return None
+
+	def delete(self, objkey):
+		""" @type objkey: str
+		"""
+		found = self.find(objkey)
+		if found:
+			offset, _ = found
+			_record.pack_into(self.buf, offset, DELETED, 0)
+
+			self.count -= 1
+			_header.pack_into(self.buf, 0, MAGIC, self.capacity, self.key_size, self.counters, self.count)
+
+	def counters_offset(self, offset):
+		""" @type  offset: int
+		    @rtype         int
+		"""
+		return offset + _record.size + self.key_size
+
+	def iterrecords(self):
+		""" @rtype iterator((str, int, int))
+		    @return        keys, model numbers and record offsets
+		"""
+		buf = self.buf
+
+		for i in xrange(self.capacity):
+			offset = HEADER_SIZE + i * self.record_size
+			key_length, number = _record.unpack_from(buf, offset)
+
+			if key_length != EMPTY and key_length != DELETED:
+				start = offset + _record.size
+				yield buf[start:start + key_length], number, offset
+
+	def sync(self):
+		self.buf.flush()
+
+	def copy_from(self, other):
+		""" @type other: Arena
+		"""
+		size = len(other.buf)
+		chunk = 1 << 20
+
+		for start in xrange(0, size, chunk):
+			end = min(start + chunk, size)
+			self.buf[start:end] = other.buf[start:end]
+
+		self.models = list(other.models)
+		self.count = other.count
+
+def encode_key(objkey):
+	""" The arena stores and hashes keys as bytes, but the keys of requests
+	    decoded from JSON are unicode.
+
+	    @type  objkey: str | unicode
+	    @rtype         str
+	"""
+	if isinstance(objkey, unicode):
+		objkey = objkey.encode("utf-8")
+	return objkey
+
+class ArenaCacheData(object):
+	""" Dictionary-like container of model data.  The objects of packed
+	    models are returned as views of their arena records.  Keys are UTF-8
+	    encoded.
+	"""
+	def __init__(self, arena, path=None, data=None):
+		""" @type arena: Arena
+		    @type path:  str | NoneType
+		    @type data:  dict | NoneType
+		"""
+		self.arena = arena
+		self.path = path
+		self.classes = {}
+		self.__data = data or {}
+		self.__full = False
+
+	@classmethod
+	def open(cls, path):
+		""" Read an arena file of another process.
+
+		    @type  path: str
+		    @rtype       ArenaCacheData
+		"""
+		arena = Arena.open(path)
+
+		cachedata = cls(arena, path)
+		cachedata.classes = { number: load_model(name).CacheModel for number, name in enumerate(arena.models) }
+
+		return cachedata
+
+	def __len__(self):
+		return len(self.__data) + self.arena.count
+
+	def __nonzero__(self):
+		return len(self) > 0
+
+	def __contains__(self, objkey):
+		objkey = encode_key(objkey)
+		return objkey in self.__data or self.arena.find(objkey) is not None
+
+	def __iter__(self):
+		return self.iterkeys()
+
+	def __getitem__(self, objkey):
+		modeldata = self.get(objkey)
+		if modeldata is None:
+			raise KeyError(objkey)
+		return modeldata
+
+	def __setitem__(self, objkey, modeldata):
+		objkey = encode_key(objkey)
+		cls = type(modeldata)
+		arena = self.arena
+
+		if getattr(cls, "packed", False) and len(cls.items) <= arena.counters and objkey not in self.__data:
+			number = self.__number(cls)
+			found = arena.find(objkey)
+
+			if found:
+				offset, found_number = found
+				if found_number != number:
+					arena.delete(objkey)
+					found = None
+
+			if found:
+				offset, _ = found
+			else:
+				offset = arena.insert(objkey, number)
+
+			if offset is not None:
+				modeldata.copy_to(arena.buf, arena.counters_offset(offset))
+				return
+
+			if not self.__full:
+				log.warning("arena full or key too long, falling back to objects: %s", objkey)
+				self.__full = True
+		else:
+			arena.delete(objkey)
+
+		self.__data[objkey] = modeldata
+
+	def __number(self, cls):
+		number = self.arena.model_number(cls.model_name)
+		self.classes[number] = cls
+		return number
+
+	def __deepcopy__(self, memo):
+		arena = self.arena
+		clone = Arena.create(arena.capacity, arena.key_size, arena.counters, self.path)
+		clone.copy_from(arena)
+
+		cachedata = type(self)(clone, self.path, copy.deepcopy(self.__data, memo))
+		cachedata.classes = dict(self.classes)
+
+		return cachedata
+
+	def __sizeof__(self):
+		return object.__sizeof__(self) + self.__data.__sizeof__() + len(self.arena.buf)
+
+	def __view(self, number, offset):
+		arena = self.arena
+		return self.classes[number].view(arena.buf, arena.counters_offset(offset))
+
+	def get(self, objkey, default=None):
+		objkey = encode_key(objkey)
+		modeldata = self.__data.get(objkey)
+		if modeldata is None:
+			found = self.arena.find(objkey)
+			if found is None:
+				return default
+
+			offset, number = found
+			modeldata = self.__view(number, offset)
+
+		return modeldata
+
+	def iterkeys(self):
+		for objkey in self.__data.keys():
+			yield objkey
+
+		for objkey, _, _ in self.arena.iterrecords():
+			yield objkey
+
+	def keys(self):
+		return list(self.iterkeys())
+
+	def iteritems(self):
+		for item in self.__data.items():
+			yield item
+
+		for objkey, number, offset in self.arena.iterrecords():
+			yield objkey, self.__view(number, offset)
+
+	def itervalues(self):
+		for objkey, modeldata in self.iteritems():
+			yield modeldata
+
+	def items(self):
+		return list(self.iteritems())
+
+	def values(self):
+		return list(self.itervalues())
+
+	def iterrecords(self):
+		""" @rtype iterator((str, NoneType, CacheModel))
+		"""
+		for objkey, modeldata in self.iteritems():
+			yield objkey, None, modeldata
+
+	def sync(self):
+		""" Write the arena to its file, if any.
+		"""
+		if self.path:
+			self.arena.sync()
+
+def make_cachedata(site):
+	""" Container for the objects of a new slot.
+
+	    @type  site: Site
+	    @rtype       dict | ArenaCacheData
+	"""
+	capacity = int(conf.get("arena", "capacity", "0"))
+	if not capacity:
+		return {}
+
+	path = conf.get("arena", "path", "").format(site=site) or None
+
+	arena = Arena.create(
+		capacity,
+		int(conf.get("arena", "key_size", "64")),
+		int(conf.get("arena", "counters", "8")),
+		path,
+	)
+
+	return ArenaCacheData(arena, path)
@@ -1,22 +1,67 @@
+""" Cache backup formats.  Versions 1-3 are a single pickled dictionary.
+    Versions 4 and 5 are indexed formats: the model data of each object is
+    encoded separately, so that a backup can be memory-mapped and the
+    objects decoded lazily on first access.
+
+	magic
+	header length (uint32), pickled header dictionary
+	for each object: record length (uint32), record
+	marshaled index
+	index offset (uint64)
+
+    A version 4 record is pickled model data, and the index is a dictionary
+    (objkey -> record offset).  A version 5 record consists of a model number
+    (uint8) and model data serialized by the model's own serializer,
+    compressed with a tagged codec.  The version 5 index is a tuple of the
+    model name list and the offset dictionary; model number 0 stands for
+    pickled model data.
+"""
+
+from __future__ import absolute_import
+
+import copy
 import cPickle as pickle
+import marshal
+import mmap
 import os
+import struct
+
+from . import compression
+from .registry import load_model
+
+MAGIC_4 = "\0impress-backup\n"
+MAGIC_5 = "\0impress-backup-5\n"
+
+PICKLE_MODEL = "pickle"
+
+# records shorter than this aren't worth compressing
+compression_minimum = 64
+
+_length = struct.Struct(">I")
+_trailer = struct.Struct(">Q")
 
 class NewBackup(object):
 	""" Dump backup object.
 	"""
-	def __init__(self, obj):
+	def __init__(self, obj, codec="none"):
+		""" @type obj:   dict
+		    @type codec: str
+		"""
 		self.obj = obj
+		self.codec = compression.get_codec(codec)
 		self.data = None
 
 	def dump(self, file):
 		if self.data is not None:
 			file.write(self.data)
 		else:
-			pickle.dump(self.obj, file)
+			dump_indexed(self.obj, file.write, self.codec)
 
 	def dumps(self):
 		if self.data is None:
-			self.data = pickle.dumps(self.obj)
+			chunks = []
+			dump_indexed(self.obj, chunks.append, self.codec)
+			self.data = "".join(chunks)
 			del self.obj
 
 		return self.data
@@ -24,19 +69,280 @@ class NewBackup(object):
 class BackupData(object):
 	""" Load backup from data string.
 	"""
-	def __init__(self, data, time):
+	def __init__(self, data, time, stored_size=None):
 		self.data = data
 		self.time = time
+		self.stored_size = stored_size
 
 	def load(self):
-		return pickle.loads(self.data)
+		if self.data.startswith("\0"):
+			return load_indexed(self.data)
+		else:
+			return pickle.loads(self.data)
 
 class BackupFile(object):
 	""" Load backup from filesystem.
 	"""
 	def __init__(self, filename):
 		self.time = os.stat(filename).st_mtime
-		self.file = open(filename)
+		self.file = open(filename, "rb")
 
 	def load(self):
-		return pickle.load(self.file)
+		first = self.file.read(1)
+		self.file.seek(0)
+
+		if first == "\0":
+			return load_indexed(mmap.mmap(self.file.fileno(), 0, access=mmap.ACCESS_READ))
+		else:
+			return pickle.load(self.file)
+
+def model_name(modeldata):
+	""" Configured model classes have a model_name attribute.
+
+	    @type  modeldata: CacheModel
+	    @rtype            str
+	"""
+	return getattr(modeldata, "model_name", None) or type(modeldata).__module__
+
+def resolve_model(name):
+	""" @type  name: str
+	    @rtype       type
+	"""
+	return load_model(name).CacheModel
+
+def dump_indexed(values, write, codec):
+	""" Write a version 5 backup.
+
+	    @type values: dict
+	    @type write:  callable(str)
+	    @type codec:  compression.Codec
+	"""
+	header = dict(values)
+	cachedata = header.pop("cachedata")
+
+	# records of a lazily loaded version 5 backup can be copied as they are,
+	# if the model numbering is kept
+	models = list(getattr(cachedata, "models", None) or [PICKLE_MODEL])
+
+	if len(models) > 1:
+		records = cachedata.iterrecords()
+	else:
+		records = ((objkey, None, modeldata) for objkey, modeldata in cachedata.iteritems())
+
+	numbers = { name: number for number, name in enumerate(models) }
+
+	def encode(modeldata):
+		name = model_name(modeldata)
+
+		number = numbers.get(name)
+		data = None
+
+		if number != 0 and hasattr(modeldata, "dumps"):
+			try:
+				data = modeldata.dumps()
+			except ValueError:
+				pass
+
+		# the dumps of the CacheModel base class returns None
+		if data is not None and number is None:
+			if len(models) > 255:
+				data = None
+			else:
+				number = len(models)
+				models.append(name)
+				numbers[name] = number
+
+		if data is None:
+			number = 0
+			data = pickle.dumps(modeldata, pickle.HIGHEST_PROTOCOL)
+
+		data = chr(number) + compression.compress(data, codec, compression_minimum)
+
+		return _length.pack(len(data)) + data
+
+	data = pickle.dumps(header, pickle.HIGHEST_PROTOCOL)
+
+	write(MAGIC_5)
+	write(_length.pack(len(data)))
+	write(data)
+
+	offset = len(MAGIC_5) + _length.size + len(data)
+	index = {}
+
+	for objkey, record, modeldata in records:
+		if record is None:
+			record = encode(modeldata)
+
+		write(record)
+
+		index[objkey] = offset
+		offset += len(record)
+
+	write(marshal.dumps((models, index)))
+	write(_trailer.pack(offset))
+
+def load_indexed(buf):
+	""" Load the header immediately and the model data lazily.
+
+	    @type  buf: str | mmap.mmap
+	    @rtype      dict
+	"""
+	if buf[:len(MAGIC_5)] == MAGIC_5:
+		offset = len(MAGIC_5)
+		version = 5
+	elif buf[:len(MAGIC_4)] == MAGIC_4:
+		offset = len(MAGIC_4)
+		version = 4
+	else:
+		raise Exception("unknown cache backup format")
+
+	length, = _length.unpack_from(buf, offset)
+	offset += _length.size
+
+	values = pickle.loads(buf[offset:offset + length])
+
+	end = len(buf) - _trailer.size
+	index_offset, = _trailer.unpack_from(buf, end)
+	index = marshal.loads(buf[index_offset:end])
+
+	if version == 4:
+		models = None
+		decode = pickle.loads
+	else:
+		models, index = index
+		decode = make_decoder(models)
+
+	values["cachedata"] = LazyCacheData(buf, index, decode, models)
+
+	return values
+
+def make_decoder(models):
+	""" @type  models: list(str)
+	    @rtype         callable(str)
+	"""
+	loaders = [pickle.loads] + [resolve_model(name).loads for name in models[1:]]
+
+	def decode(record):
+		return loaders[ord(record[0])](compression.decompress(record[1:]))
+
+	return decode
+
+class LazyCacheData(object):
+	""" Dictionary-like container of model data which is decoded from a
+	    backup buffer when it's first accessed.  Model data is upgraded when
+	    it's decoded.
+	"""
+	def __init__(self, buf, index, decode, models=None, data=None):
+		""" @type buf:    str | mmap.mmap
+		    @type index:  dict(str=int)
+		    @type decode: callable(str)
+		    @type models: list(str) | NoneType
+		    @type data:   dict | NoneType
+		"""
+		self.__buf = buf
+		self.__index = index
+		self.__decode = decode
+		self.models = models
+		self.__data = data or {}
+
+	def __len__(self):
+		return len(self.__data) + len(self.__index)
+
+	def __nonzero__(self):
+		return bool(self.__data) or bool(self.__index)
+
+	def __contains__(self, objkey):
+		return objkey in self.__data or objkey in self.__index
+
+	def __iter__(self):
+		return self.iterkeys()
+
+	def __getitem__(self, objkey):
+		modeldata = self.get(objkey)
+		if modeldata is None:
+			raise KeyError(objkey)
+		return modeldata
+
+	def __setitem__(self, objkey, modeldata):
+		self.__index.pop(objkey, None)
+		self.__data[objkey] = modeldata
+
+	def __deepcopy__(self, memo):
+		# pending records are immutable, so the buffer can be shared
+		return type(self)(self.__buf, dict(self.__index), self.__decode, self.models, copy.deepcopy(self.__data, memo))
+
+	def snapshot(self):
+		""" Shallow copy which shares the objects.
+
+		    @rtype LazyCacheData
+		"""
+		return type(self)(self.__buf, dict(self.__index), self.__decode, self.models, dict(self.__data))
+
+	def get(self, objkey, default=None):
+		modeldata = self.__data.get(objkey)
+		if modeldata is None:
+			offset = self.__index.pop(objkey, None)
+			if offset is None:
+				return default
+
+			modeldata = self.__load(offset)
+			self.__data[objkey] = modeldata
+
+		return modeldata
+
+	def iterkeys(self):
+		for objkey in self.__data.keys():
+			yield objkey
+
+		for objkey in self.__index.keys():
+			yield objkey
+
+	def keys(self):
+		return list(self.iterkeys())
+
+	def iteritems(self):
+		self.materialize()
+		return self.__data.iteritems()
+
+	def itervalues(self):
+		self.materialize()
+		return self.__data.itervalues()
+
+	def items(self):
+		return list(self.iteritems())
+
+	def values(self):
+		return list(self.itervalues())
+
+	def iterrecords(self):
+		""" Iterate through the objects without decoding the pending ones.
+
+		    @rtype iterator((str, str | NoneType, CacheModel | NoneType))
+		"""
+		for objkey, modeldata in self.__data.iteritems():
+			yield objkey, None, modeldata
+
+		for objkey, offset in self.__index.iteritems():
+			yield objkey, self.__record(offset), None
+
+	def materialize(self):
+		""" Decode all pending objects and release the buffer.
+		"""
+		for objkey, offset in self.__index.iteritems():
+			self.__data[objkey] = self.__load(offset)
+
+		self.__index.clear()
+		self.__buf = None
+
+	def __record(self, offset):
+		length, = _length.unpack_from(self.__buf, offset)
+		return self.__buf[offset:offset + _length.size + length]
+
+	def __load(self, offset):
+		length, = _length.unpack_from(self.__buf, offset)
+		start = offset + _length.size
+
+		modeldata = self.__decode(self.__buf[start:start + length])
+		modeldata.upgrade()
+
+		return modeldata
@@ -6,30 +6,58 @@ from __future__ import absolute_import
 import copy
 import datetime
 import gc
+import itertools
 import os
 import sys
+import threading
 import time
 
+from . import arena
+from . import compression
 from . import eventlog
 from . import json
+from . import metrics
 from . import progress
+from . import topk
+from . import transport
 from . import util
-from .backup import BackupFile, NewBackup
+from . import wal
+from .backup import BackupFile, NewBackup, model_name
 from .config import conf, log
-from .registry import interval_type
+from .keyindex import KeyIndex, merge_keys
+from .lru import LRUCache
+from .registry import Registry, convert_model, interval_type, load_model
 from .site import Site
-from .storage import Storage
+from .storage import AVAIL_MARKER_OBJKEY, Storage
+from .timeline import ModelSlot
+
+# new cache objects, for garbage collection tuning (see gctuning)
+new_keys = metrics.registry.counter("cache.new.keys")
 
 class Slot(object):
 	""" The objects' data of a given interval.  The accumulation logic and
 	    internal representation is specified per object with a custom model
-	    module.
+	    module.  A spilled slot continues an interval whose earlier data has
+	    been stored early, and it's merged with the stored data.
 	"""
-	def __init__(self, interval, downtime=None, cachedata=None, add_downtime=None):
+	def __init__(self, interval, downtime=None, cachedata=None, add_downtime=None, trackers=None, spilled=False, index=None):
 		self.interval = interval
 		self.downtime = downtime
-		self.cachedata = cachedata or {}
+		self.cachedata = cachedata if cachedata is not None else {}
+		self.index = index if index is not None else KeyIndex(self.cachedata)
+		self.trackers = trackers
+		self.spilled = spilled
+		self.copied = None  # set while the objects are shared with a snapshot
+
+		# set by load_backup
+		self.snapshot_end = None
+		self.wal_sequence = None
+
+		self.set_add_downtime(add_downtime)
 
+	def set_add_downtime(self, add_downtime):
+		""" @type add_downtime: callable(Site, datetime.datetime) | NoneType
+		"""
 		# wrap callable in a tuple to avoid Python thinking it's a bound method
 		self.__add_downtime = (add_downtime,)
 
@@ -54,7 +82,32 @@ class Slot(object):
 		return self.interval.key
 
 	def clone(self):
-		return type(self)(self.interval, self.downtime, copy.deepcopy(self.cachedata))
+		return type(self)(self.interval, self.downtime, copy.deepcopy(self.cachedata), trackers=copy.deepcopy(self.trackers), spilled=self.spilled, index=copy.deepcopy(self.index))
+
+	def snapshot(self):
+		""" Copy-on-write snapshot of the slot, so that it can be serialized
+		    while adds continue; the objects are copied when they're first
+		    modified (until release is called).  None if the cache data is
+		    modified in place (arenas).
+
+		    @rtype Slot | NoneType
+		"""
+		if isinstance(self.cachedata, dict):
+			cachedata = dict(self.cachedata)
+		elif hasattr(self.cachedata, "snapshot"):
+			cachedata = self.cachedata.snapshot()
+		else:
+			return None
+
+		self.copied = set()
+
+		# the snapshot is only serialized, so it isn't indexed
+		return type(self)(self.interval, self.downtime, cachedata, trackers=copy.deepcopy(self.trackers), spilled=self.spilled, index=KeyIndex())
+
+	def release(self):
+		""" Stop copying the objects shared with a snapshot.
+		"""
+		self.copied = None
 
 	def is_active(self, now):
 		""" Compares the interval against the given time.
@@ -70,52 +123,169 @@ class Slot(object):
 		    @type model:    module
 		    @type now:      datetime.datetime
 		"""
+		copied = self.copied
+
 		for objkey in objkeys:
 			modeldata = self.cachedata.get(objkey)
 
+			if copied is not None and objkey not in copied:
+				copied.add(objkey)
+
+				if modeldata is not None:
+					# shared with a snapshot
+					self.cachedata[objkey] = copy.deepcopy(modeldata)
+					modeldata = self.cachedata[objkey]
+
 			if modeldata is None:
-				modeldata = model.CacheModel()
-				self.cachedata[objkey] = modeldata
-			else:
-				assert isinstance(modeldata, model.CacheModel)
+				self.cachedata[objkey] = model.CacheModel()
+				new_keys.inc()
+
+				# an arena stores a copy
+				modeldata = self.cachedata[objkey]
+
+				self.index.add(objkey)
+			elif not isinstance(modeldata, model.CacheModel):
+				# the type configuration or the model has been reloaded
+				converted = convert_model(modeldata, model)
+				if converted is not modeldata:
+					self.cachedata[objkey] = converted
+					modeldata = self.cachedata[objkey]
 
 			modeldata.add(params, now - self.interval.start)
 
+		if self.trackers:
+			self.trackers.add(objkeys, params)
+
 	def get(self, objkeys, callback):
 		""" @type objkeys:  list(str)
-		    @type callback: callable(slotkey:str, objkey:str, values:dict)
+		    @type callback: callable(slotkey:str, objkey:str, values:dict, modeldata:CacheModel)
 		"""
 		for objkey in objkeys:
 			modeldata = self.cachedata.get(objkey)
 			if modeldata:
-				callback(self.key, objkey, modeldata.get())
+				callback(self.key, objkey, modeldata.get(), modeldata)
+
+	def convert(self, objkeys, model):
+		""" Convert the objects' data to the model if necessary.
+
+		    @type  objkeys: list(str)
+		    @type  model:   module
+		    @rtype          int
+		"""
+		count = 0
+
+		for objkey in objkeys:
+			modeldata = self.cachedata.get(objkey)
+			if modeldata is not None and not isinstance(modeldata, model.CacheModel):
+				converted = convert_model(modeldata, model)
+				if converted is not modeldata:
+					self.cachedata[objkey] = converted
+					count += 1
+
+		return count
+
+	def aggregate(self, objkeys, prefix, aggregator):
+		""" Feed the objects' aggregation values to the aggregator.  The
+		    objects are listed, or selected by key prefix.
+
+		    @type objkeys:    list(str) | NoneType
+		    @type prefix:     str | NoneType
+		    @type aggregator: callable(objkey:str, values:dict)
+		"""
+		if prefix is not None:
+			objkeys = self.find_keys(prefix)
+
+		for objkey in objkeys:
+			modeldata = self.cachedata.get(objkey)
+			if modeldata:
+				aggregator(objkey, modeldata.aggregate())
+
+	def top(self, objtype, item, limit):
+		""" @type  objtype: str
+		    @type  item:    str
+		    @type  limit:   int
+		    @rtype          list((str, int | float, int | float)) | NoneType
+		"""
+		if self.trackers:
+			return self.trackers.top(objtype, item, limit)
+
+	def find_keys(self, prefix):
+		""" @type  prefix: str
+		    @rtype         list(str)
+		"""
+		index = self.index
+
+		if "_" in prefix:
+			return list(index.iterate(Registry.parse_object_type(prefix), prefix))
+		else:
+			return [objkey for objtype in index.types if objtype.startswith(prefix) for objkey in index.iterate(objtype)]
+
+	def scan(self, objtype, prefix, after, limit):
+		""" @type  objtype: str
+		    @type  prefix:  str
+		    @type  after:   str | NoneType
+		    @type  limit:   int
+		    @rtype          list(str)
+		"""
+		return list(itertools.islice(self.index.iterate(objtype, prefix, after), limit))
 
 	def store(self, site, storage):
 		length = len(self.cachedata)
-		errors = 0
 
 		log.debug("storing site %s cache %s with %d keys", site, self.key, length)
 
 		start_time = time.time()
+		raw_size = storage.raw_size
+		stored_size = storage.stored_size
 
-		for objkey, modeldata in self.cachedata.iteritems():
-			try:
-				storage.insert(objkey, self.key, modeldata.get())
-			except:
-				log.exception("site %s object %s slot %s insert failed", site, objkey, self.key)
-				errors += 1
+		failed = []
+		merged = [0]
+
+		def records():
+			for objkey, modeldata in self.cachedata.iteritems():
+				try:
+					values = modeldata.get()
+
+					if self.spilled:
+						# merge with the data stored when the interval was spilled
+						stored = storage.get_slot(objkey, self.key)
+						if stored is not None:
+							values = merge_values(self.interval, model_name(modeldata), stored, values)
+							merged[0] += 1
+				except:
+					log.exception("site %s object %s slot %s insert failed", site, objkey, self.key)
+					failed.append(objkey)
+				else:
+					yield objkey, values
+
+		errors = storage.insert_many(self.key, records()) + len(failed)
 
 		rate = length / (time.time() - start_time)
+		ratio = compression.ratio(storage.raw_size - raw_size, storage.stored_size - stored_size)
 		ok = (errors == 0)
 
+		metrics.registry.observe("history.store.seconds", site.name, start_time)
+		metrics.registry.counter("history.store.items", site.name).inc(length - errors)
+		metrics.registry.counter("history.store.errors", site.name).inc(errors)
+
 		for i in xrange(10):
 			try:
-				storage.insert_avail_marker(self.key, length - errors, errors, self.downtime)
+				count = length - errors
+				marker_errors = errors
+
+				if self.spilled:
+					# include the objects stored when the interval was spilled
+					previous = storage.get_slot(AVAIL_MARKER_OBJKEY, self.key)
+					if previous:
+						count += int(previous.get("count", 0)) - merged[0]
+						marker_errors += int(previous.get("errors", 0))
+
+				storage.insert_avail_marker(self.key, count, marker_errors, self.downtime)
 				break
 			except:
 				if i < 9:
 					log.debug("avail marker", exc_info=True)
-					time.sleep(1)
+					time.sleep(transport.backoff(i, 0.5))
 				else:
 					log.exception("failed to store site %s cache %s avail marker", site, self.key)
 					ok = False
@@ -126,14 +296,14 @@ class Slot(object):
 			downstr = "with %s downtime" % self.downtime
 
 		if errors:
-			log.error("failed to store %d/%d keys of site %s cache %s %s (%f items per second)", errors, length, site, self.key, downstr, rate)
+			log.error("failed to store %d/%d keys of site %s cache %s %s (%f items per second, compression ratio %s)", errors, length, site, self.key, downstr, rate, ratio)
 		else:
-			log.info("stored site %s cache %s %s (%f items per second)", site, self.key, downstr, rate)
+			log.info("stored site %s cache %s %s (%f items per second, compression ratio %s)", site, self.key, downstr, rate, ratio)
 
 		return ok
 
-	backup_version = 3
-	supported_backup_versions = 1, 2, 3
+	backup_version = 5
+	supported_backup_versions = 1, 2, 3, 4, 5
 
 	@classmethod
 	def load_backup(cls, backup):
@@ -141,7 +311,7 @@ class Slot(object):
 
 		version = values["version"]
 		if version not in cls.supported_backup_versions:
-			raise Exception("unsupported cache backup version: " + version)
+			raise Exception("unsupported cache backup version: %r" % version)
 
 		if "interval_start" not in values:
 			date = values["date"]
@@ -151,32 +321,46 @@ class Slot(object):
 
 		cachedata = values["cachedata"]
 
-		for modeldata in cachedata.itervalues():
-			modeldata.upgrade()
+		# indexed versions are decoded (and upgraded) on first access
+		if version < 4:
+			for modeldata in cachedata.itervalues():
+				modeldata.upgrade()
 
 		downtime = values.get("downtime", datetime.timedelta())
 		snapshot_end = values.get("snapshot_end")
 
 		if snapshot_end is not None:
-			def add_downtime(site, now):
-				delta = min(now, interval.end - site.offset) - snapshot_end
-				log.info("site %s cache backup has staled for %s", site, delta)
-				return delta
+			add_downtime = make_add_downtime(interval, snapshot_end)
 		else:
 			add_downtime = None
 
-		return cls(interval, downtime, cachedata, add_downtime)
+		# indexed while loading, so that scans don't stall adds
+		slot = cls(interval, downtime, cachedata, add_downtime, values.get("topk"), values.get("spilled", False), KeyIndex(cachedata))
+		slot.snapshot_end = snapshot_end
+		slot.wal_sequence = values.get("wal_sequence")
+
+		return slot
 
-	def make_backup(self, snapshot_end):
+	def make_backup(self, snapshot_end, wal_sequence=None):
+		""" @type snapshot_end: datetime.datetime
+		    @type wal_sequence: int | NoneType
+		    @param wal_sequence: the first write-ahead log segment which
+		                         isn't included
+		"""
 		values = {
 			"version": self.backup_version,
 			"interval_start": self.interval.start,
 			"cachedata": self.cachedata,
 			"downtime": self.downtime or datetime.timedelta(),
 			"snapshot_end": snapshot_end,
+			"topk": self.trackers,
+			"spilled": self.spilled,
 		}
 
-		return NewBackup(values)
+		if wal_sequence is not None:
+			values["wal_sequence"] = wal_sequence
+
+		return NewBackup(values, conf.get("backup", "compression", "none"))
 
 class Active(object):
 	""" Maintains the current cache.
@@ -185,8 +369,15 @@ class Active(object):
 		self.site = site
 		self.local_backup_name = check_dirname(conf.get("backup", "local_cache_format").format(site=site))
 		self.lock = lock_type()
+		self.topk_spec = topk.get_spec(site)
 		self.slot = self.load_backup(storage)
 		self.modified = False
+		self.wal = wal.open_log(site)
+		self.replayed_slots = []
+
+		if self.wal:
+			self.replayed_slots = self.replay_log()
+			self.wal.start()
 
 	def init(self, now):
 		""" @type now: datetime.datetime
@@ -212,14 +403,88 @@ class Active(object):
 			self.slot.add(objkeys, params, model, now)
 			self.modified = True
 
+			if self.wal:
+				self.wal.append(objkeys, params, model.__name__)
+
 		return rotated_slot
 
-	def get(self, objkeys, callback):
+	def get(self, objkeys, callback, select=None):
 		""" @type objkeys:  list(str)
-		    @type callback: callable(slotkey:str, objkey:str, values:dict)
+		    @type callback: callable(slotkey:str, objkey:str, values:dict, modeldata:CacheModel)
+		    @type select:   callable(Interval) | NoneType
+		"""
+		with self.lock:
+			if select is None or select(self.slot.interval):
+				self.slot.get(objkeys, callback)
+
+	def intervals(self):
+		""" @rtype list(Interval)
+		"""
+		with self.lock:
+			return [self.slot.interval]
+
+	def aggregate(self, objkeys, prefix, get_aggregator, select=None):
+		""" @type objkeys:        list(str) | NoneType
+		    @type prefix:         str | NoneType
+		    @type get_aggregator: callable(slotkey:str)
+		    @type select:         callable(Interval) | NoneType
+		"""
+		with self.lock:
+			aggregate_slots([self.slot], objkeys, prefix, get_aggregator, select)
+
+	def scan(self, *args):
+		""" @rtype list(list(str))
+		"""
+		with self.lock:
+			return [self.slot.scan(*args)]
+
+	def top(self, objtype, item, limit, select=None):
+		""" @rtype list((str, list))
+		"""
+		with self.lock:
+			return top_slots([self.slot], objtype, item, limit, select)
+
+	def migrate(self, objtype, model, after, limit):
+		""" Convert a batch of objects of a type to the model.  Return the
+		    key to continue after (None at the end) and the number of
+		    converted objects.
+
+		    @type  objtype: str
+		    @type  model:   module
+		    @type  after:   str | NoneType
+		    @type  limit:   int
+		    @rtype          str | NoneType, int
+		"""
+		with self.lock:
+			objkeys = self.slot.scan(objtype, "", after, limit)
+			count = self.slot.convert(objkeys, model)
+
+			if count:
+				self.modified = True
+
+		if len(objkeys) < limit:
+			return None, count
+		else:
+			return objkeys[-1], count
+
+	def spill(self):
+		""" Replace the slot with an empty continuation of the same interval
+		    and return it, so that it can be stored early.
+
+		    @rtype Slot
 		"""
 		with self.lock:
-			self.slot.get(objkeys, callback)
+			spilled_slot = self.slot
+
+			self.slot = Slot(spilled_slot.interval, spilled_slot.downtime, arena.make_cachedata(self.site), trackers=spilled_slot.trackers, spilled=True)
+			self.modified = True
+
+			# the continuation tracks the whole interval
+			spilled_slot.trackers = None
+
+		log.warning("site %s cache %s spilled with %d keys", self.site, spilled_slot, len(spilled_slot.cachedata))
+
+		return spilled_slot
 
 	def rotate(self, force=False):
 		""" Return the previous slot if the interval has changed.
@@ -234,17 +499,20 @@ class Active(object):
 		rotated_slot = None
 
 		if not active or force:
+			start_time = time.time()
 			rotated_slot = self.slot
 
 			if active:
 				log.debug("cloning active site %s cache %s", self.site, rotated_slot)
 				self.slot = self.slot.clone()
 			else:
-				self.slot = Slot(interval_type(now))
+				self.slot = Slot(interval_type(now), cachedata=arena.make_cachedata(self.site), trackers=topk.Trackers(self.topk_spec))
 				self.modified = True
 
 			log.debug("rotating site %s cache %s", self.site, rotated_slot)
 
+			metrics.registry.observe("cache.rotate.seconds", self.site.name, start_time)
+
 		return rotated_slot
 
 	def load_backup(self, storage):
@@ -280,13 +548,73 @@ class Active(object):
 				return self.__load_empty()
 
 			slot = Slot.load_backup(choice)
+			slot.trackers = topk.Trackers(self.topk_spec, slot.trackers)
 
 		log.info("site %s cache backup load time %d s", self.site, int(loadtime))
 
 		return slot
 
+	def replay_log(self):
+		""" Replay the adds which were logged after the loaded backup was
+		    snapshotted.  Return the slots which were rotated on the way.
+
+		    @rtype list(Slot)
+		"""
+		slot = self.slot
+
+		if slot.wal_sequence is not None:
+			records = self.wal.replay(sequence=slot.wal_sequence)
+		elif slot.snapshot_end is not None:
+			records = self.wal.replay(after=time.mktime(slot.snapshot_end.timetuple()) + slot.snapshot_end.microsecond / 1000000.0)
+		else:
+			records = self.wal.replay()
+
+		rotated_slots = []
+		count = 0
+		errors = 0
+		last = None
+
+		with util.timing() as replaytime:
+			for timestamp, objkeys, params, name in records:
+				now = self.site.from_timestamp(timestamp)
+
+				try:
+					if not self.slot.is_active(now):
+						if self.slot:
+							if now < self.slot.interval.start:
+								raise Exception("logged add precedes the cache interval")
+
+							rotated_slots.append(self.slot)
+
+						self.slot = Slot(interval_type(now), datetime.timedelta(), arena.make_cachedata(self.site), trackers=topk.Trackers(self.topk_spec))
+
+					self.slot.add(objkeys, params, load_model(name), now)
+					count += 1
+				except:
+					log.debug("site %s logged add not replayed", self.site, exc_info=True)
+					errors += 1
+
+				last = timestamp
+
+		if last is not None:
+			self.slot.set_add_downtime(make_add_downtime(self.slot.interval, datetime.datetime.fromtimestamp(last)))
+			self.modified = True
+
+		metrics.registry.counter("wal.replayed", self.site.name).inc(count)
+
+		if errors:
+			log.error("site %s replayed %d logged adds in %d s, %d failed", self.site, count, int(replaytime), errors)
+		else:
+			log.info("site %s replayed %d logged adds in %d s", self.site, count, int(replaytime))
+
+		return rotated_slots
+
+	def close(self):
+		if self.wal:
+			self.wal.close()
+
 	def __load_empty(self):
-		inteval = interval_type(self.site.current_datetime())
+		interval = interval_type(self.site.current_datetime())
 
 		def add_downtime(site, now):
 			site_now = now + site.offset
@@ -295,7 +623,7 @@ class Active(object):
 			else:
 				return interval.delta
 
-		return Slot(interval, datetime.timedelta(), {}, add_downtime)
+		return Slot(interval, datetime.timedelta(), arena.make_cachedata(self.site), add_downtime, topk.Trackers(self.topk_spec))
 
 	def dump_backup(self, storage, force):
 		if not force:
@@ -307,6 +635,7 @@ class Active(object):
 		log.debug("dumping site %s cache backup", self.site)
 
 		ok = False
+		snapshot_slot = None
 
 		try:
 			with util.timing() as dumptime:
@@ -315,17 +644,27 @@ class Active(object):
 				with self.lock:
 					snapshot_end = datetime.datetime.today()
 
-					with util.Fork() as child:
-						if child:
-							gc.disable()
+					# the adds logged from now on aren't in the snapshot
+					wal_sequence = self.wal.rotate() if self.wal else None
 
-							backup = self.slot.make_backup(snapshot_end)
-							try:
-								storage.insert_cache_backup(backup)
-								result = 0
-							except:
-								self.dump_local_backup(backup)
-								raise
+					if get_flush_engine() == "thread":
+						snapshot = self.slot.snapshot()
+
+						if snapshot is not None:
+							# serialized and written after unlocking
+							backup = snapshot.make_backup(snapshot_end, wal_sequence)
+							snapshot_slot = self.slot
+						else:
+							backup = self.slot.make_backup(snapshot_end, wal_sequence)
+							backup.dumps()
+
+						child = util.Worker(self.insert_backup, (storage, backup), name="backup-%s" % self.site)
+					else:
+						with util.Fork() as child:
+							if child:
+								gc.disable()
+
+								self.insert_backup(storage, self.slot.make_backup(snapshot_end, wal_sequence))
 
 					self.modified = False
 
@@ -333,18 +672,41 @@ class Active(object):
 					child.join()
 					ok = True
 					util.safe(os.unlink, (self.local_backup_name,))
+
+					if self.wal:
+						self.wal.truncate(wal_sequence)
 				except child.Error:
 					log.error("site %s cache backup process failed", self.site)
 		except:
 			log.exception("site %s cache backup failed", self.site)
 
+		if snapshot_slot:
+			with self.lock:
+				snapshot_slot.release()
+
+		if isinstance(self.slot.cachedata, arena.ArenaCacheData):
+			util.safe(self.slot.cachedata.sync, error="arena sync failed")
+
 		if ok:
 			log.info("site %s cache backup dump time %d s", self.site, int(dumptime))
+			metrics.registry.histogram("cache.backup.seconds", self.site.name).observe(float(dumptime))
 		else:
+			metrics.registry.counter("cache.backup.errors", self.site.name).inc()
+
 			# undo state change
 			with self.lock:
 				self.modified = True
 
+	def insert_backup(self, storage, backup):
+		""" @type storage: Storage
+		    @type backup:  NewBackup
+		"""
+		try:
+			storage.insert_cache_backup(backup)
+		except:
+			self.dump_local_backup(backup)
+			raise
+
 	def open_local_backup(self):
 		if os.path.exists(self.local_backup_name):
 			return BackupFile(self.local_backup_name)
@@ -356,7 +718,7 @@ class Active(object):
 
 		evlog_error = eventlog.ERROR_OTHER
 		try:
-			with open(tempname, "w") as file:
+			with open(tempname, "wb") as file:
 				backup.dump(file)
 		except:
 			log.exception("local cache backup dumping failed: %s", tempname)
@@ -377,40 +739,100 @@ class History(object):
 		self.local_backup_format = check_dirname(conf.get("backup", "local_history_format"))
 		self.lock = lock_type()
 		self.slots = []
+		self.keys = 0
+		self.store_rate = 0  # items per second
 
 	def append(self, slot):
 		with self.lock:
 			self.slots.append(slot)
+			self.keys += len(slot.cachedata)
 
-	def get(self, objkeys, callback):
+	def get(self, objkeys, callback, select=None):
 		""" @type objkeys:  list(str)
-		    @type callback: callable(slotkey:str, objkey:str, values:dict)
+		    @type callback: callable(slotkey:str, objkey:str, values:dict, modeldata:CacheModel)
+		    @type select:   callable(Interval) | NoneType
 		"""
 		with self.lock:
 			for slot in self.slots:
-				slot.get(objkeys, callback)
+				if select is None or select(slot.interval):
+					slot.get(objkeys, callback)
+
+	def intervals(self):
+		""" @rtype list(Interval)
+		"""
+		with self.lock:
+			return [slot.interval for slot in self.slots]
+
+	def aggregate(self, objkeys, prefix, get_aggregator, select=None):
+		""" @type objkeys:        list(str) | NoneType
+		    @type prefix:         str | NoneType
+		    @type get_aggregator: callable(slotkey:str)
+		    @type select:         callable(Interval) | NoneType
+		"""
+		with self.lock:
+			aggregate_slots(self.slots, objkeys, prefix, get_aggregator, select)
+
+	def scan(self, *args):
+		""" @rtype list(list(str))
+		"""
+		with self.lock:
+			return [slot.scan(*args) for slot in self.slots]
+
+	def top(self, objtype, item, limit, select=None):
+		""" @rtype list((str, list))
+		"""
+		with self.lock:
+			return top_slots(self.slots, objtype, item, limit, select)
 
 	def store(self, storage):
+		""" Store and forget the held slots.
+
+		    @rtype list(Slot)
+		"""
 		storage.reset()
+		start_time = time.time()
 
 		with self.lock:
 			if not self.slots:
-				return
-
-			with util.Fork() as child:
-				if child:
-					gc.set_debug(0)
+				return []
+
+			if get_flush_engine() == "thread":
+				# the held slots aren't modified by adds, but objects of
+				# loaded backups are decoded (and the buffer released) on
+				# access, so it's done before gets can run concurrently
+				for slot in self.slots:
+					materialize = getattr(slot.cachedata, "materialize", None)
+					if materialize:
+						materialize()
+
+				child = util.Worker(self.store_slots, (self.slots[:], storage), name="store-%s" % self.site)
+			else:
+				with util.Fork() as child:
+					if child:
+						gc.set_debug(0)
 
-					for slot in self.slots:
-						if not slot.store(self.site, storage):
-							util.safe(self.dump_local_backup, (slot,))
+						self.store_slots(self.slots, storage)
 
 			count = len(self.slots)
 
 		child.join()
 
 		with self.lock:
+			stored = self.slots[:count]
 			del self.slots[:count]
+			self.keys = sum(len(slot.cachedata) for slot in self.slots)
+
+		self.store_rate = sum(len(slot.cachedata) for slot in stored) / (time.time() - start_time)
+
+		return stored
+
+	def store_slots(self, slots, storage):
+		""" @type slots:   list(Slot)
+		    @type storage: Storage
+		"""
+		for slot in slots:
+			if not slot.store(self.site, storage):
+				util.safe(self.dump_local_backup, (slot,))
 
 	def dump_local_backup(self, slot):
 		backup = slot.make_backup(slot.interval.end)
@@ -421,7 +843,7 @@ class History(object):
 		evlog_error = eventlog.ERROR_OTHER
 		evlog_path = ""
 		try:
-			with open(partname, "w") as file:
+			with open(partname, "wb") as file:
 				evlog_path = partname
 				backup.dump(file)
 		except:
@@ -435,6 +857,78 @@ class History(object):
 		finally:
 			eventlog.logger.store_local_backup(self.site.name, evlog_error, evlog_path)
 
+class Stored(object):
+	""" Read-through cache of the stored slots of objects.  Rows are
+	    fetched without locking, and a row isn't cached if the slots were
+	    invalidated while it was being fetched, since it may be stale.
+	"""
+	def __init__(self, lock_type, site):
+		self.site = site
+		self.local = threading.local()
+		self.lock = lock_type()
+		self.generation = 0  # incremented by invalidate
+		self.rows = LRUCache(
+			lock_type,
+			int(conf.get("readthrough", "entries", "100000")),
+			int(conf.get("readthrough", "size", "268435456")),
+			float(conf.get("readthrough", "ttl", "300")),
+		)
+
+	def get(self, objkeys):
+		""" @type  objkeys: list(str)
+		    @rtype          list((str, list((str, str))))
+		"""
+		rows = []
+
+		for objkey in objkeys:
+			slots = self.rows.get(objkey)
+			if slots is None:
+				slots = self.__fetch(objkey)
+				if slots is None:
+					continue
+
+			rows.append((objkey, slots))
+
+		return rows
+
+	def __fetch(self, objkey):
+		""" @type  objkey: str
+		    @rtype         list((str, str)) | NoneType
+		"""
+		with self.lock:
+			generation = self.generation
+
+		try:
+			# connection per thread, since the flush resets the main one
+			storage = getattr(self.local, "storage", None)
+			if storage is None:
+				storage = Storage(self.site)
+				self.local.storage = storage
+
+			row = storage._get(objkey)
+		except:
+			log.exception("site %s object %s fetch failed", self.site, objkey)
+			return None
+
+		slots = [(slotkey, json.dumps(values)) for slotkey, values in row]
+		size = len(objkey) + sum(len(slotkey) + len(json_values) for slotkey, json_values in slots)
+
+		with self.lock:
+			if generation == self.generation:
+				self.rows.put(objkey, slots, size)
+
+		return slots
+
+	def invalidate(self, slots):
+		""" Forget the objects which were stored as part of the slots.
+
+		    @type slots: list(Slot)
+		"""
+		with self.lock:
+			self.generation += 1
+
+		self.rows.invalidate(lambda objkey: any(objkey in slot.cachedata for slot in slots))
+
 class SiteCache(object):
 	""" Manages active cache and cache history per Site.
 	"""
@@ -445,63 +939,351 @@ class SiteCache(object):
 		self.active = Active(lock_type, site, self.storage)
 		self.history = History(lock_type, site)
 
+		for slot in self.active.replayed_slots:
+			self.history.append(slot)
+		self.stored = Stored(lock_type, site)
+		self.limits = Limits(site)
+
+		# updated when the cache is flushed
+		self.bytes_per_key = 0
+		self.spill_pending = False
+
+		registry = metrics.registry
+		registry.gauge("limits.keys", self.keys, sitename)
+		registry.gauge("limits.bytes", self.approximate_size, sitename)
+		registry.gauge("cache.keys", lambda: len(self.active.slot.cachedata), sitename)
+		registry.gauge("cache.memory.bytes", self.estimate_size, sitename)
+		registry.gauge("history.slots", lambda: len(self.history.slots), sitename)
+		registry.gauge("history.store.rate", lambda: self.history.store_rate, sitename)
+		registry.gauge("readthrough.entries", lambda: len(self.stored.rows), sitename)
+		registry.gauge("readthrough.hits", lambda: self.stored.rows.hits, sitename)
+		registry.gauge("readthrough.misses", lambda: self.stored.rows.misses, sitename)
+
+	def reject_new(self, objkeys):
+		""" Keys already in the active slot, or in the spilled part of its
+		    interval, are accepted.
+
+		    @type  objkeys: list(str)
+		    @rtype          list(str)
+		"""
+		slot = self.active.slot
+		cachedatas = [slot.cachedata]
+
+		if slot.spilled:
+			with self.history.lock:
+				cachedatas += [spilled.cachedata for spilled in self.history.slots if spilled.key == slot.key]
+
+		accepted = [objkey for objkey in objkeys if any(objkey in cachedata for cachedata in cachedatas)]
+
+		rejected = len(objkeys) - len(accepted)
+		if rejected:
+			metrics.registry.counter("limits.rejected.keys", self.active.site.name).inc(rejected)
+
+			if not self.limits.warned:
+				self.limits.warned = True
+				log.warning("site %s cache limits exceeded: rejecting new keys", self.active.site)
+
+		return accepted
+
+	def estimate_size(self):
+		""" Approximate memory used by the cached slots.
+
+		    @rtype int
+		"""
+		# the metrics thread calls this, so the samples are taken while
+		# the slots are locked
+		with self.history.lock:
+			size = sum(estimate_slot_size(slot) for slot in self.history.slots)
+
+		with self.active.lock:
+			size += estimate_slot_size(self.active.slot)
+
+		return size
+
 	def init(self, now):
 		""" @type now: datetime.datetime
 		"""
 		self.active.init(now)
+		self.update_bytes_per_key()
+
+	def keys(self):
+		""" Number of cached objects in all slots.
+
+		    @rtype int
+		"""
+		return len(self.active.slot.cachedata) + self.history.keys
+
+	def approximate_size(self):
+		""" @rtype int
+		"""
+		return self.keys() * self.bytes_per_key
+
+	def update_bytes_per_key(self):
+		keys = self.keys()
+		if keys:
+			self.bytes_per_key = self.estimate_size() // keys
 
 	def add(self, objkeys, data, model):
 		""" Accumulate objects's data in active cache.  The active
-		    cache is rotated if necessary.
+		    cache is rotated if necessary.  If the cache exceeds its limits,
+		    the active slot is spilled (and new keys are rejected until it
+		    has been stored) or new keys are rejected, depending on
+		    configuration.
 
 		    @type objkeys: list(str)
 		    @type data:    str
 		    @type model:   module
 		"""
+		if self.limits.exceeded(self.keys(), self.approximate_size()):
+			if self.limits.action == "spill" and not self.spill_pending:
+				self.spill_pending = True
+				metrics.registry.counter("limits.spills", self.active.site.name).inc()
+				self.history.append(self.active.spill())
+			else:
+				objkeys = self.reject_new(objkeys)
+				if not objkeys:
+					return
+
 		params = json.loads(data)
 
 		rotated_slot = self.active.add(objkeys, params, model)
 		if rotated_slot:
 			self.history.append(rotated_slot)
 
-	def get(self, objkeys):
-		""" Get objects' data from active cache and cache history.
+	def get(self, objkeys, stored=False, range=None):
+		""" Get objects' data from active cache and cache history, and
+		    optionally stored slots.  Stored slots are also included if the
+		    range reaches beyond the cached ones.
 
 		    @type  objkeys: list(str)
+		    @type  stored:  bool
+		    @type  range:   query.Range | NoneType
 		    @rtype          str
 		"""
 		slots = {}
+		model_names = {}
 
-		def callback(slotkey, objkey, values):
-			""" @type slotkey: str
-			    @type objkey:  str
-			    @type values:  dict
+		def callback(slotkey, objkey, values, modeldata):
+			""" @type slotkey:   str
+			    @type objkey:    str
+			    @type values:    dict
+			    @type modeldata: CacheModel
 			"""
-			objects = slots.get(slotkey)
-			if objects is None:
-				objects = []
-				slots[slotkey] = objects
+			objects = util.dict_get_default(slots, slotkey, dict)
+
+			json_values = objects.get(objkey)
+			if json_values is not None:
+				# the continuation of a spilled slot
+				values = merge_values(interval_type.parse(slotkey), model_name(modeldata), json.loads(json_values), values)
+
+			objects[objkey] = json.dumps(values)
+			model_names[(slotkey, objkey)] = model_name(modeldata)
+
+		def stored_callback(slotkey, objkey, json_values):
+			""" @type slotkey:     str
+			    @type objkey:      str
+			    @type json_values: str
+			"""
+			objects = util.dict_get_default(slots, slotkey, dict)
+
+			cached_values = objects.get(objkey)
+			if cached_values is None:
+				objects[objkey] = json_values
+			elif slotkey in spilled_keys:
+				# the earlier part of a spilled interval has been stored
+				objects[objkey] = json.dumps(merge_values(interval_type.parse(slotkey), model_names[(slotkey, objkey)], json.loads(json_values), json.loads(cached_values)))
+
+			# otherwise cached data is more recent
+
+		select = None
+		rows = []
 
-			objects.append(json.dumps(objkey) + ":" + json.dumps(values))
+		if range:
+			intervals = self.history.intervals() + self.active.intervals()
 
-		self.history.get(objkeys, callback)
-		self.active.get(objkeys, callback)
+			if not stored:
+				stored = range.needs_stored(intervals)
+
+			if stored:
+				rows = self.stored.get(objkeys)
+				intervals += [interval_type.parse(slotkey) for _, row in rows for slotkey, _ in row]
+
+			select = range.selector(intervals)
+
+		elif stored:
+			rows = self.stored.get(objkeys)
+
+		self.history.get(objkeys, callback, select)
+		self.active.get(objkeys, callback, select)
+
+		spilled_keys = set()
+
+		if rows:
+			with self.history.lock:
+				cached_slots = self.history.slots + [self.active.slot]
+
+			first_slots = {}
+			for slot in cached_slots:
+				first_slots.setdefault(slot.key, slot)
+
+			spilled_keys = set(slotkey for slotkey, slot in first_slots.iteritems() if slot.spilled)
 
-		json_slots = (json.dumps(slotkey) + ":{" + ",".join(objects) + "}" for slotkey, objects in slots.iteritems())
+		for objkey, row in rows:
+			for slotkey, json_values in row:
+				if select is None or select(interval_type.parse(slotkey)):
+					stored_callback(slotkey, objkey, json_values)
+
+		json_slots = (json.dumps(slotkey) + ":{" + ",".join(json.dumps(objkey) + ":" + json_values for objkey, json_values in objects.iteritems()) + "}" for slotkey, objects in slots.iteritems())
 
 		return "{" + ",".join(json_slots) + "}"
 
+	def aggregate(self, objkeys, prefix, make_aggregator, range=None):
+		""" Aggregate objects' data per cached slot.
+
+		    @type  objkeys:         list(str) | NoneType
+		    @type  prefix:          str | NoneType
+		    @type  make_aggregator: callable
+		    @type  range:           query.Range | NoneType
+		    @rtype                  str
+		"""
+		select = None
+		if range:
+			select = range.selector(self.history.intervals() + self.active.intervals())
+
+		aggregators = {}
+
+		def get_aggregator(slotkey):
+			# the parts of a spilled interval are aggregated together
+			return util.dict_get_default(aggregators, slotkey, make_aggregator)
+
+		self.history.aggregate(objkeys, prefix, get_aggregator, select)
+		self.active.aggregate(objkeys, prefix, get_aggregator, select)
+
+		return json.dumps({ slotkey: aggregator.result() for slotkey, aggregator in aggregators.iteritems() })
+
+	def scan(self, objtype, prefix="", cursor="", limit=1000):
+		""" List the keys of an object type in the cached slots, in sorted
+		    order.  The returned cursor continues the listing, unless it's
+		    empty.
+
+		    @type  objtype: str
+		    @type  prefix:  str
+		    @type  cursor:  str
+		    @type  limit:   int
+		    @rtype          str
+		"""
+		after = cursor or None
+		args = objtype, prefix, after, limit
+
+		keys = merge_keys(self.history.scan(*args) + self.active.scan(*args), limit)
+		cursor = keys[-1] if len(keys) == limit else ""
+
+		return json.dumps({ "keys": keys, "cursor": cursor })
+
+	def top(self, objtype, item, limit=10, range=None):
+		""" The objects with the largest totals of an item per cached slot,
+		    largest first, as [objkey, total, error] lists.  The totals are
+		    approximate: a total may exceed the true value by at most its
+		    error.  Only object types and items configured in the [topk]
+		    section are tracked.
+
+		    @type  objtype: str
+		    @type  item:    str
+		    @type  limit:   int
+		    @type  range:   query.Range | NoneType
+		    @rtype          str
+		"""
+		if not any(entry[:2] == (objtype, item) for entry in self.active.topk_spec):
+			raise ValueError("Top-k not tracked: %s:%s" % (objtype, item))
+
+		select = None
+		if range:
+			select = range.selector(self.history.intervals() + self.active.intervals())
+
+		results = self.history.top(objtype, item, limit, select)
+		results += self.active.top(objtype, item, limit, select)
+
+		return json.dumps(dict(results))
+
+	def migrate(self, objtype, model, proceed=None):
+		""" Convert the active cache data of an object type to the model in
+		    batches, so that adds aren't blocked for long.  Stops early if
+		    proceed returns false.
+
+		    @type objtype: str
+		    @type model:   module
+		    @type proceed: callable | NoneType
+		"""
+		batch = int(conf.get("registry", "migration_batch", "1000"))
+		after = None
+		total = 0
+
+		with util.timing() as migrationtime:
+			while proceed is None or proceed():
+				after, count = self.active.migrate(objtype, model, after, batch)
+				total += count
+
+				if after is None:
+					break
+
+		log.info("site %s converted %d objects of type %s to %s in %d s", self.active.site, total, objtype, model.__name__, int(migrationtime))
+
 	def flush(self, force_rotate=False, force_backup=False):
 		""" Rotates active cache (if necessary), stores cache history
 		    and backups active cache.
+
+		    @rtype bool
+		    @return whether the cache was rotated
 		"""
 		rotated_slot = self.active.rotate(force_rotate)
 		if rotated_slot:
 			self.history.append(rotated_slot)
 
-		util.safe(self.history.store, (self.storage,), error="history storing failed")
+		stored_slots = util.safe(self.history.store, (self.storage,), error="history storing failed")
+		if stored_slots:
+			self.stored.invalidate(stored_slots)
+
+		if not self.history.slots:
+			self.spill_pending = False
+
+		self.limits.warned = False
+		util.safe(self.update_bytes_per_key, error="cache size estimation failed")
+
 		util.safe(self.active.dump_backup, (self.storage, force_backup), error="backup dumping failed")
 
+		return rotated_slot is not None
+
+class Limits(object):
+	""" Cache size limits of a site, configured in the [limits] section.
+	    The max_keys, max_bytes (approximate) and action (spill or reject)
+	    options may be prefixed with the site name and a dot, to override the
+	    defaults for the site.  Zero means unlimited.
+
+	    Gets merge the parts of a spilled interval.  Once the spilled part
+	    has been stored, it's included only if stored data is requested, and
+	    aggregations include only the cached parts.
+	"""
+	def __init__(self, site):
+		""" @type site: Site
+		"""
+		def get(option, default):
+			return conf.get("limits", site.name + "." + option, conf.get("limits", option, default))
+
+		self.max_keys = int(get("max_keys", "0"))
+		self.max_bytes = int(get("max_bytes", "0"))
+		self.action = get("action", "spill")
+		self.warned = False
+
+		if self.action not in ("spill", "reject"):
+			raise ValueError("Bad limit action: " + self.action)
+
+	def exceeded(self, keys, size):
+		""" @type  keys: int
+		    @type  size: int
+		    @rtype       bool
+		"""
+		return (self.max_keys and keys >= self.max_keys) or (self.max_bytes and size >= self.max_bytes)
+
 class Cache(object):
 	""" Groups all known SiteCaches.
 	"""
@@ -522,16 +1304,171 @@ class Cache(object):
 		"""
 		self.sitecaches[sitename].add(objkeys, data, model)
 
-	def get(self, sitename, objkeys):
+	def get(self, sitename, objkeys, stored=False, range=None):
 		""" @type  sitename: str
 		    @type  objkeys:  list(str)
+		    @type  stored:   bool
+		    @type  range:    query.Range | NoneType
+		    @rtype           str
+		"""
+		return self.sitecaches[sitename].get(objkeys, stored, range)
+
+	def scan(self, sitename, *args, **kwargs):
+		""" @type  sitename: str
+		    @rtype           str
+		"""
+		return self.sitecaches[sitename].scan(*args, **kwargs)
+
+	def aggregate(self, sitename, *args, **kwargs):
+		""" @type  sitename: str
+		    @rtype           str
+		"""
+		return self.sitecaches[sitename].aggregate(*args, **kwargs)
+
+	def top(self, sitename, *args, **kwargs):
+		""" @type  sitename: str
 		    @rtype           str
 		"""
-		return self.sitecaches[sitename].get(objkeys)
+		return self.sitecaches[sitename].top(*args, **kwargs)
+
+	def migrate(self, models, proceed=None):
+		""" @type models:  dict(str, module)
+		    @type proceed: callable | NoneType
+		"""
+		for sitecache in self.sitecaches.itervalues():
+			for objtype, model in sorted(models.iteritems()):
+				sitecache.migrate(objtype, model, proceed)
+
+	def close(self):
+		for sitecache in self.sitecaches.itervalues():
+			util.safe(sitecache.active.close, error="site cache closing failed")
 
 	def flush(self, *args, **kwargs):
+		""" @rtype bool
+		    @return whether any site cache was rotated
+		"""
+		rotated = False
+
 		for sitecache in self.sitecaches.itervalues():
-			sitecache.flush(*args, **kwargs)
+			if sitecache.flush(*args, **kwargs):
+				rotated = True
+
+		return rotated
+
+def aggregate_slots(slots, objkeys, prefix, get_aggregator, select):
+	""" Feed the objects of the selected slots to the aggregators of their
+	    slot keys.
+
+	    @type slots:          list(Slot)
+	    @type objkeys:        list(str) | NoneType
+	    @type prefix:         str | NoneType
+	    @type get_aggregator: callable(slotkey:str)
+	    @type select:         callable(Interval) | NoneType
+	"""
+	for slot in slots:
+		if select is None or select(slot.interval):
+			slot.aggregate(objkeys, prefix, get_aggregator(slot.key).add)
+
+def top_slots(slots, objtype, item, limit, select):
+	""" @type  slots:   list(Slot)
+	    @type  objtype: str
+	    @type  item:    str
+	    @type  limit:   int
+	    @type  select:  callable(Interval) | NoneType
+	    @rtype          list((str, list))
+	"""
+	results = []
+
+	for slot in slots:
+		if select is None or select(slot.interval):
+			entries = slot.top(objtype, item, limit)
+			if entries is not None:
+				results.append((slot.key, entries))
+
+	return results
+
+def make_add_downtime(interval, snapshot_end):
+	""" @type  interval:     Interval
+	    @type  snapshot_end: datetime.datetime
+	    @rtype               callable(Site, datetime.datetime)
+	"""
+	def add_downtime(site, now):
+		delta = min(now, interval.end - site.offset) - snapshot_end
+		log.info("site %s cache backup has staled for %s", site, delta)
+		return delta
+
+	return add_downtime
+
+def get_flush_engine():
+	""" How the cache backups and history slots are written: "fork" runs
+	    the writes in a child process which sees a copy-on-write snapshot of
+	    the cache, "thread" serializes and writes from a thread in the same
+	    process (avoiding the copy-on-write duplication of the heap).  With
+	    the thread engine, a cache backup is serialized from a snapshot of
+	    the active slot whose objects are copied when adds modify them, but
+	    arenas are serialized while locked.
+
+	    @rtype str
+	"""
+	engine = conf.get("backup", "engine", "fork")
+	if engine not in ("fork", "thread"):
+		raise ValueError("Bad flush engine: " + engine)
+	return engine
+
+def merge_values(interval, name, values, later_values):
+	""" Merge the values of an object from two parts of an interval with
+	    the timeline model.  The first values may be modified.
+
+	    @type  interval:     Interval
+	    @type  name:         str
+	    @param name:         model name
+	    @type  values:       dict
+	    @type  later_values: dict
+	    @rtype               dict
+	"""
+	model = load_model(name)
+
+	slot = ModelSlot(interval, model, values)
+	slot.merge(ModelSlot(interval, model, later_values))
+
+	return slot.get()
+
+def estimate_slot_size(slot, samples=100):
+	""" Extrapolate from the sizes of a sample of the objects, so that the
+	    estimate is cheap (it's done while the slot is locked).  Objects
+	    which haven't been decoded from a backup yet are counted by their
+	    encoded size.
+
+	    @type  slot:    Slot
+	    @type  samples: int
+	    @rtype          int
+	"""
+	cachedata = slot.cachedata
+	length = len(cachedata)
+	if not length:
+		return 0
+
+	if isinstance(cachedata, dict):
+		records = ((objkey, None, modeldata) for objkey, modeldata in cachedata.iteritems())
+	else:
+		records = cachedata.iterrecords()
+
+	sample_size = 0
+	sample_length = 0
+
+	for objkey, record, modeldata in itertools.islice(records, samples):
+		sample_size += sys.getsizeof(objkey)
+
+		if modeldata is None:
+			sample_size += len(record)
+		else:
+			sample_size += sys.getsizeof(modeldata)
+			for value in getattr(modeldata, "__dict__", {}).itervalues():
+				sample_size += sys.getsizeof(value)
+
+		sample_length += 1
+
+	return sys.getsizeof(cachedata) + sample_size * length // sample_length
 
 def check_dirname(path):
 	""" Creates all directories in a filename path if they don't exist.
@@ -0,0 +1,88 @@
+""" Compression codecs.  Compressed data is tagged with a leading byte which
+    identifies the codec, so that it can be decompressed without knowing the
+    configuration it was written with.
+"""
+
+from __future__ import absolute_import
+
+import zlib
+
+try:
+	import lz4.block as _lz4
+except ImportError:
+	try:
+		import lz4 as _lz4
+	except ImportError:
+		_lz4 = None
+
+class Codec(object):
+
+	def __init__(self, tag, name, compress, decompress):
+		self.tag = tag
+		self.name = name
+		self.prefix = chr(tag)
+		self.compress = compress
+		self.decompress = decompress
+
+	def __str__(self):
+		return self.name
+
+def _identity(data):
+	return data
+
+codecs = [
+	Codec(0, "none", _identity, _identity),
+	Codec(1, "zlib", lambda data: zlib.compress(data, 1), zlib.decompress),
+]
+
+if _lz4:
+	codecs.append(Codec(2, "lz4", _lz4.compress, _lz4.decompress))
+
+NONE = codecs[0]
+
+_by_tag = { codec.prefix: codec for codec in codecs }
+_by_name = { codec.name: codec for codec in codecs }
+
+def get_codec(name):
+	""" @type  name: str
+	    @rtype       Codec
+	"""
+	codec = _by_name.get(name)
+	if codec is None:
+		raise ValueError("Unsupported compression: " + name)
+	return codec
+
+def compress(data, codec, minimum=0):
+	""" Compress data unless it's shorter than minimum or compression doesn't
+	    make it smaller, in which case it's tagged as uncompressed.
+
+	    @type  data:    str
+	    @type  codec:   Codec
+	    @type  minimum: int
+	    @rtype          str
+	"""
+	if codec.tag and len(data) >= minimum:
+		compressed = codec.compress(data)
+		if len(compressed) < len(data):
+			return codec.prefix + compressed
+
+	return NONE.prefix + data
+
+def decompress(data):
+	""" @type  data: str
+	    @rtype       str
+	"""
+	codec = _by_tag.get(data[:1])
+	if codec is None:
+		raise ValueError("Unknown compression tag: %r" % data[:1])
+	return codec.decompress(data[1:])
+
+def ratio(raw_size, stored_size):
+	""" @type  raw_size:    int
+	    @type  stored_size: int
+	    @rtype              str
+	"""
+	if stored_size:
+		return "%.2f" % (float(raw_size) / stored_size)
+	else:
+		return "n/a"
@@ -1,6 +1,26 @@
-""" Event logging interface.
+""" Event logging interface.  The default logger discards the events; the
+    buffered logger is enabled by configuring a sink in the [eventlog]
+    section:
+
+	file:PATH       append JSON lines to a file
+	udp:HOST:PORT   send JSON lines as datagrams
+
+    Events are appended to a bounded ring buffer, and a background thread
+    aggregates them per second into counters and size histograms, which are
+    written to the sink.
 """
 
+from __future__ import absolute_import
+
+import collections
+import os
+import socket
+import threading
+import time
+
+from . import json
+from .config import conf, log
+
 ERROR_OTHER = 1
 ERROR_NETWORK = 5
 ERROR_DYNAMODB = 6
@@ -31,4 +51,242 @@ class NullLogger(object):
 	def service_error(self, error):
 		pass
 
+	def forked(self):
+		""" Called in a child process after fork.  The child closes the
+		    logger before exiting.
+		"""
+
+	def flush(self):
+		""" Write the buffered events.
+		"""
+
+	def close(self):
+		pass
+
+class BufferedLogger(NullLogger):
+	""" Appends events to a ring buffer; deque appends and pops are atomic,
+	    so no locking is needed in the calling threads.  The oldest events
+	    are dropped if the buffer fills up between flushes.
+	"""
+	def __init__(self, sink, size=65536, interval=1.0):
+		""" @type sink:     FileSink | UDPSink
+		    @type size:     int
+		    @type interval: float
+		"""
+		self.sink = sink
+		self.interval = interval
+		self.buffer = collections.deque(maxlen=size)
+		self.lock = threading.Lock()
+		self.closed = threading.Event()
+		self.thread = None
+
+	def start(self):
+		self.thread = threading.Thread(target=self.run, name="eventlog")
+		self.thread.daemon = True
+		self.thread.start()
+
+	def run(self):
+		while not self.closed.wait(self.interval):
+			try:
+				self.flush()
+			except:
+				log.exception("eventlog flush failed")
+
+	def add(self, site, error, size, count):
+		self.buffer.append((time.time(), "add", site, error, size, count, None))
+
+	def get(self, site, error, size, count):
+		self.buffer.append((time.time(), "get", site, error, size, count, None))
+
+	def store(self, site, error, size, type):
+		self.buffer.append((time.time(), "store", site, error, size, 1, chr(type)))
+
+	def avail_marker(self, site, error):
+		self.buffer.append((time.time(), "avail_marker", site, error, 0, 1, None))
+
+	def mutate(self, site, error, size, type):
+		self.buffer.append((time.time(), "mutate", site, error, size, 1, chr(type)))
+
+	def cache_backup(self, site, error, size, local):
+		self.buffer.append((time.time(), "cache_backup", site, error, size, 1, "local" if local else None))
+
+	def store_local_backup(self, site, error, path):
+		self.buffer.append((time.time(), "store_local_backup", site, error, 0, 1, None))
+
+	def service_error(self, error):
+		self.buffer.append((time.time(), "service_error", None, error, 0, 1, None))
+
+	def forked(self):
+		# the parent process flushes the inherited events, and the child
+		# flushes its own events with a thread of its own, so that a long
+		# task doesn't overflow the buffer
+		self.buffer.clear()
+		self.lock = threading.Lock()
+		self.closed = threading.Event()
+
+		if self.thread:
+			self.start()
+
+	def flush(self):
+		with self.lock:
+			records = aggregate(self.drain())
+			if records:
+				self.sink.write(records)
+
+	def drain(self):
+		""" @rtype list(tuple)
+		"""
+		buffer = self.buffer
+		events = []
+
+		try:
+			for _ in xrange(len(buffer)):
+				events.append(buffer.popleft())
+		except IndexError:
+			pass
+
+		return events
+
+	def close(self):
+		self.closed.set()
+
+		if self.thread:
+			self.thread.join()
+
+		self.flush()
+
+def aggregate(events):
+	""" Count the events per second, type, site, error and tag, and sum and
+	    histogram their sizes in power-of-two buckets.
+
+	    @type  events: list(tuple)
+	    @rtype         list(dict)
+	"""
+	groups = {}
+
+	for timestamp, name, site, error, size, count, tag in events:
+		key = int(timestamp), name, site, error, tag
+		group = groups.get(key)
+		if group is None:
+			group = [0, 0, 0, {}]
+			groups[key] = group
+
+		group[0] += 1
+		group[1] += count
+		group[2] += size
+
+		bucket = 1 << size.bit_length() if size else 0
+		group[3][bucket] = group[3].get(bucket, 0) + 1
+
+	records = []
+
+	for (second, name, site, error, tag), (events, count, size, histogram) in sorted(groups.iteritems()):
+		record = {
+			"time":   second,
+			"event":  name,
+			"error":  error,
+			"events": events,
+			"count":  count,
+			"size":   size,
+			"sizes":  { str(bucket): n for bucket, n in histogram.iteritems() },
+		}
+
+		if site is not None:
+			record["site"] = site
+		if tag is not None:
+			record["tag"] = tag
+
+		records.append(record)
+
+	return records
+
+class FileSink(object):
+
+	def __init__(self, path):
+		self.path = path
+
+	def write(self, records):
+		data = "".join(json.dumps(record) + "\n" for record in records)
+
+		# a single append write, so that forked processes don't interleave
+		fd = os.open(self.path, os.O_WRONLY | os.O_APPEND | os.O_CREAT, 0644)
+		try:
+			os.write(fd, data)
+		finally:
+			os.close(fd)
+
+class UDPSink(object):
+
+	max_datagram = 8192
+
+	def __init__(self, host, port):
+		self.address = host, port
+		self.socket = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+
+	def write(self, records):
+		lines = []
+		length = 0
+
+		for record in records:
+			line = json.dumps(record) + "\n"
+
+			if lines and length + len(line) > self.max_datagram:
+				self.send("".join(lines))
+				lines = []
+				length = 0
+
+			lines.append(line)
+			length += len(line)
+
+		if lines:
+			self.send("".join(lines))
+
+	def send(self, data):
+		try:
+			self.socket.sendto(data, self.address)
+		except socket.error as e:
+			log.debug("eventlog datagram not sent: %s", e)
+
+def make_sink(spec):
+	""" @type  spec: str
+	    @rtype       FileSink | UDPSink
+	"""
+	kind, sep, target = spec.partition(":")
+
+	if kind == "file" and target:
+		return FileSink(target)
+
+	if kind == "udp":
+		host, sep, port = target.rpartition(":")
+		if host and port.isdigit():
+			return UDPSink(host, int(port))
+
+	raise ValueError("Bad eventlog sink: " + spec)
+
 logger = NullLogger()
+
+def configure():
+	""" Replace the logger according to the configuration.
+	"""
+	global logger
+
+	spec = conf.get("eventlog", "sink", "")
+	if not spec:
+		return
+
+	logger = BufferedLogger(
+		make_sink(spec),
+		int(conf.get("eventlog", "buffer", "65536")),
+		float(conf.get("eventlog", "interval", "1")),
+	)
+	logger.start()
+
+	log.info("eventlog sink: %s", spec)
+
+def close():
+	global logger
+
+	try:
+		logger.close()
+	finally:
+		logger = NullLogger()
@@ -0,0 +1,142 @@
+""" Garbage collection management for the long-lived cache heap.  Enabled by
+    setting the mode option of the [gc] section to "managed":
+
+    - Automatic full collections are suppressed with a huge generation 2
+      threshold, since they traverse all the cached model data.  Instead,
+      full collections are run from the main loop after flushing, at most
+      every full_interval seconds.
+
+    - Where the interpreter supports it (gc.freeze), the objects which
+      exist after the cache backup has been loaded or the cache has been
+      rotated are collected and frozen into the permanent generation, so
+      that collections don't traverse them.  Elsewhere they reach the
+      oldest generation through the scheduled full collections.
+
+    - The generation 0 threshold is tuned according to the rate of new
+      cache objects, so that young collections happen at about
+      young_frequency times per second during bursts.
+
+    The pauses of the managed collections are recorded as metrics.
+"""
+
+from __future__ import absolute_import
+
+import gc
+import time
+
+from . import metrics
+from .config import conf, log
+
+# large enough to never trigger automatic full collections
+SUPPRESSED_THRESHOLD = 1 << 30
+
+class Manager(object):
+
+	def __init__(self):
+		self.enabled = False
+		self.last_full = time.time()
+		self.last_tune = time.time()
+		self.last_allocations = metrics.registry.counter("cache.new.keys").value
+		self.default_thresholds = gc.get_threshold()
+
+	def configure(self):
+		""" Apply the current configuration.
+		"""
+		enabled = conf.get("gc", "mode", "default") == "managed"
+
+		self.full_interval = float(conf.get("gc", "full_interval", "600"))
+		self.young_frequency = float(conf.get("gc", "young_frequency", "10"))
+		self.threshold_min = int(conf.get("gc", "threshold0_min", "700"))
+		self.threshold_max = int(conf.get("gc", "threshold0_max", "100000"))
+
+		if enabled:
+			if not self.enabled:
+				self.default_thresholds = gc.get_threshold()
+
+			threshold0, threshold1, _ = gc.get_threshold()
+			gc.set_threshold(threshold0, threshold1, SUPPRESSED_THRESHOLD)
+		elif self.enabled:
+			gc.set_threshold(*self.default_thresholds)
+
+		self.enabled = enabled
+
+		log.info("gc mode: %s", "managed" if enabled else "default")
+
+	def collect(self, reason):
+		""" Full collection, timed.
+
+		    @type  reason: str
+		    @rtype         int
+		"""
+		start_time = time.time()
+		count = gc.collect()
+		elapsed = time.time() - start_time
+
+		metrics.registry.histogram("gc.pause.seconds").observe(elapsed)
+		metrics.registry.counter("gc.collections").inc()
+		metrics.registry.counter("gc.collected").inc(count)
+
+		log.debug("gc %s collection: %d objects in %.3f s", reason, count, elapsed)
+
+		self.last_full = time.time()
+
+		return count
+
+	def freeze(self, reason):
+		""" Move the surviving objects to the permanent generation, if the
+		    interpreter supports it.
+
+		    @type  reason: str
+		    @rtype         bool
+		    @return        whether the objects were collected and frozen
+		"""
+		freeze = getattr(gc, "freeze", None)
+		if not self.enabled or not freeze:
+			return False
+
+		self.collect(reason)
+		freeze()
+
+		return True
+
+	def tune(self):
+		""" Adjust the generation 0 threshold to the rate of new cache
+		    objects since the last call.
+		"""
+		now = time.time()
+		allocations = metrics.registry.counter("cache.new.keys").value
+
+		elapsed = now - self.last_tune
+		rate = (allocations - self.last_allocations) / elapsed if elapsed > 0 else 0
+
+		self.last_tune = now
+		self.last_allocations = allocations
+
+		# a new cache object allocates a few container objects
+		threshold0 = int(rate * 4 / self.young_frequency)
+		threshold0 = max(self.threshold_min, min(self.threshold_max, threshold0))
+
+		_, threshold1, threshold2 = gc.get_threshold()
+		gc.set_threshold(threshold0, threshold1, threshold2)
+
+	def flushed(self, rotated):
+		""" Called by the main loop after the cache has been flushed.
+
+		    @type rotated: bool
+		"""
+		if not self.enabled:
+			return
+
+		self.tune()
+
+		frozen = rotated and self.freeze("rotation")
+
+		if not frozen and time.time() - self.last_full >= self.full_interval:
+			self.collect("scheduled")
+
+manager = Manager()
+
+metrics.registry.gauge("gc.threshold0", lambda: gc.get_threshold()[0])
+metrics.registry.gauge("gc.count0", lambda: gc.get_count()[0])
+metrics.registry.gauge("gc.count1", lambda: gc.get_count()[1])
+metrics.registry.gauge("gc.count2", lambda: gc.get_count()[2])
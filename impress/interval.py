@@ -1,57 +1,94 @@
 from __future__ import absolute_import
 
+import datetime
+
+_epoch = datetime.datetime(1970, 1, 1)
+
+# maximum number of entries in a memoization cache before it's reset
+cache_limit = 100000
+
+def seconds(delta):
+	""" @type  delta: datetime.timedelta
+	    @rtype        int
+	"""
+	return delta.days * 86400 + delta.seconds
+
 class Interval(object):
+	""" Immutable time slot.  Instances are ordered by start time, and longer
+	    intervals sort first when the start time is the same.  The ordering is
+	    kept as a tuple of integers (epoch seconds) which is cheap to compare.
+	"""
+	__slots__ = ["start", "delta", "end", "key", "order"]
+
+	__keys = {}
+	__parsed = {}
 
 	def __init__(self, start, delta=None):
 		""" @type start: datetime.datetime
 		    @type delta: datetime.timedelta
 		"""
+		start = self.floor(start)
+
 		self.start = start
 		self.delta = delta or self.basic_delta
-		self.end = self.start + self.delta
-		self.key = self.make_key(self.start, self.delta)
+		self.end = start + self.delta
+		self.order = seconds(start - _epoch), -seconds(self.delta)
+
+		cachekey = type(self), self.order
+
+		key = self.__keys.get(cachekey)
+		if key is None:
+			if len(self.__keys) >= cache_limit:
+				self.__keys.clear()
+
+			key = self.make_key(start, self.delta)
+			self.__keys[cachekey] = key
+
+		self.key = key
 
 	def __str__(self):
 		return self.key
 
+	def __repr__(self):
+		return "<%s %s>" % (type(self).__module__, self.key)
+
+	def __hash__(self):
+		return hash(self.order)
+
 	def __eq__(self, other):
-		return self.start == other.start and self.delta == other.delta
+		return self.order == other.order
 
 	def __ne__(self, other):
-		return self.start != other.start or self.delta != other.delta
+		return self.order != other.order
 
 	def __lt__(self, other):
-		if self.start < other.start:
-			return True
-
-		if self.start > other.start:
-			return False
-
-		return self.delta > other.delta
+		return self.order < other.order
 
 	def __gt__(self, other):
-		if self.start > other.start:
-			return True
-
-		if self.start < other.start:
-			return False
-
-		return self.delta < other.delta
+		return self.order > other.order
 
 	def __le__(self, other):
-		if self.start < other.start:
-			return True
+		return self.order <= other.order
 
-		if self.start > other.start:
-			return False
+	def __ge__(self, other):
+		return self.order >= other.order
 
-		return self.delta >= other.delta
+	@classmethod
+	def parse(cls, key):
+		""" Get the interval described by a slot key.  The instances are
+		    shared, since they are immutable.
 
-	def __ge__(self, other):
-		if self.start > other.start:
-			return True
+		    @type  key: str
+		    @rtype      Interval
+		"""
+		cachekey = cls, key
+
+		interval = cls.__parsed.get(cachekey)
+		if interval is None:
+			if len(cls.__parsed) >= cache_limit:
+				cls.__parsed.clear()
 
-		if self.start < other.start:
-			return False
+			interval = cls(*cls.parse_key(key))
+			cls.__parsed[cachekey] = interval
 
-		return self.delta <= other.delta
+		return interval
@@ -5,17 +5,26 @@ import datetime
 from .. import interval as interface
 
 class Interval(interface.Interval):
+	__slots__ = []
+
 	basic_delta = datetime.timedelta(days=1)
 
+	@staticmethod
+	def floor(dt):
+		return datetime.datetime(dt.year, dt.month, dt.day)
+
 	@classmethod
 	def make_key(cls, start, delta):
-		key = start.strftime("%Y%m%d")
+		key = "%04d%02d%02d" % (start.year, start.month, start.day)
 		if delta != cls.basic_delta:
 			key += "_%d" % delta.days
 		return key
 
 	@classmethod
-	def parse(cls, key):
+	def parse_key(cls, key):
+		""" @type  key: str
+		    @rtype      datetime.datetime, datetime.timedelta
+		"""
 		if "_" in key:
 			startstr, deltastr = key.split("_", 1)
 
@@ -30,4 +39,4 @@ class Interval(interface.Interval):
 		day   = int(startstr[6:8])
 		start = datetime.datetime(year, month, day)
 
-		return cls(start, delta)
+		return start, delta
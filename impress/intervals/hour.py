@@ -5,17 +5,26 @@ import datetime
 from .. import interval as interface
 
 class Interval(interface.Interval):
+	__slots__ = []
+
 	basic_delta = datetime.timedelta(seconds=3600)
 
+	@staticmethod
+	def floor(dt):
+		return datetime.datetime(dt.year, dt.month, dt.day, dt.hour)
+
 	@classmethod
 	def make_key(cls, start, delta):
-		key = start.strftime("%Y%m%d%H")
+		key = "%04d%02d%02d%02d" % (start.year, start.month, start.day, start.hour)
 		if delta != cls.basic_delta:
-			key += "_%d" % (delta.seconds // 3600)
+			key += "_%d" % (delta.days * 24 + delta.seconds // 3600)
 		return key
 
 	@classmethod
-	def parse(cls, key):
+	def parse_key(cls, key):
+		""" @type  key: str
+		    @rtype      datetime.datetime, datetime.timedelta
+		"""
 		if "_" in key:
 			startstr, deltastr = key.split("_", 1)
 
@@ -31,4 +40,4 @@ class Interval(interface.Interval):
 		hour  = int(startstr[8:10])
 		start = datetime.datetime(year, month, day, hour)
 
-		return cls(start, delta)
+		return start, delta
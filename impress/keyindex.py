@@ -0,0 +1,109 @@
+""" Secondary index of object keys by object type.
+"""
+
+from __future__ import absolute_import
+
+from bisect import bisect_left, bisect_right
+import heapq
+import itertools
+
+from .registry import Registry
+
+class TypeKeys(object):
+	""" Keys of one object type.  New keys are sorted into the list when it's
+	    queried.
+	"""
+	__slots__ = ["sorted", "pending"]
+
+	def __init__(self, keys=None):
+		self.sorted = keys or []
+		self.pending = []
+
+	def __len__(self):
+		return len(self.sorted) + len(self.pending)
+
+	def get_sorted(self):
+		if self.pending:
+			# timsort merges the two runs in linear time
+			self.sorted.extend(self.pending)
+			self.sorted.sort()
+			self.pending = []
+
+		return self.sorted
+
+class KeyIndex(object):
+	""" Groups object keys by object type (see Registry.parse_object_type)
+	    and supports paging through them by key prefix.
+	"""
+	def __init__(self, objkeys=()):
+		""" @type objkeys: iterable(str)
+		"""
+		self.types = {}
+
+		for objkey in objkeys:
+			self.add(objkey)
+
+	def __deepcopy__(self, memo):
+		clone = type(self)()
+		clone.types = { objtype: TypeKeys(entry.get_sorted()[:]) for objtype, entry in self.types.iteritems() }
+		return clone
+
+	def add(self, objkey):
+		""" Add a key which isn't in the index yet.
+
+		    @type objkey: str
+		"""
+		objtype = Registry.parse_object_type(objkey)
+
+		entry = self.types.get(objtype)
+		if entry is None:
+			entry = TypeKeys()
+			self.types[objtype] = entry
+
+		entry.pending.append(objkey)
+
+	def count(self, objtype):
+		""" @type  objtype: str
+		    @rtype          int
+		"""
+		entry = self.types.get(objtype)
+		return len(entry) if entry else 0
+
+	def iterate(self, objtype, prefix="", after=None):
+		""" Iterate through the keys of an object type in sorted order.
+
+		    @type  objtype: str
+		    @type  prefix:  str
+		    @type  after:   str | NoneType
+		    @rtype          iterator(str)
+		"""
+		entry = self.types.get(objtype)
+		if not entry:
+			return iter(())
+
+		keys = entry.get_sorted()
+
+		if after is not None and after >= prefix:
+			i = bisect_right(keys, after)
+		else:
+			i = bisect_left(keys, prefix)
+
+		return itertools.takewhile(lambda objkey: objkey.startswith(prefix), itertools.islice(keys, i, None))
+
+def merge_keys(iterators, limit):
+	""" Merge sorted key iterators, dropping duplicates.
+
+	    @type  iterators: list(iterator(str))
+	    @type  limit:     int
+	    @rtype            list(str)
+	"""
+	keys = []
+
+	for objkey in heapq.merge(*iterators):
+		if not keys or keys[-1] != objkey:
+			if len(keys) == limit:
+				break
+
+			keys.append(objkey)
+
+	return keys
@@ -0,0 +1,84 @@
+""" Bounded least-recently-used cache with expiration.
+"""
+
+from __future__ import absolute_import
+
+import collections
+import time
+
+from .util import Nonexistent
+
+class LRUCache(object):
+	""" Evicts the least recently used entries when the number of entries or
+	    their total size exceeds the limit.  Entries expire after ttl seconds.
+	"""
+	def __init__(self, lock_type, entries, size, ttl):
+		""" @type lock_type: type
+		    @type entries:   int
+		    @type size:      int
+		    @type ttl:       float
+		"""
+		self.lock = lock_type()
+		self.max_entries = entries
+		self.max_size = size
+		self.ttl = ttl
+		self.size = 0
+		self.hits = 0
+		self.misses = 0
+		self.__entries = collections.OrderedDict()
+
+	def __len__(self):
+		return len(self.__entries)
+
+	def get(self, key, default=None):
+		""" @type key: hashable
+		"""
+		with self.lock:
+			entry = self.__entries.pop(key, Nonexistent)
+			if entry is Nonexistent:
+				self.misses += 1
+				return default
+
+			expires, size, value = entry
+
+			if expires < time.time():
+				self.size -= size
+				self.misses += 1
+				return default
+
+			self.__entries[key] = entry
+			self.hits += 1
+			return value
+
+	def put(self, key, value, size):
+		""" @type key:  hashable
+		    @type size: int
+		"""
+		if size > self.max_size:
+			return
+
+		with self.lock:
+			old = self.__entries.pop(key, Nonexistent)
+			if old is not Nonexistent:
+				self.size -= old[1]
+
+			self.__entries[key] = time.time() + self.ttl, size, value
+			self.size += size
+
+			while len(self.__entries) > self.max_entries or self.size > self.max_size:
+				_, (_, size, _) = self.__entries.popitem(last=False)
+				self.size -= size
+
+	def invalidate(self, predicate):
+		""" Remove the entries whose keys match.
+
+		    @type predicate: callable(key)
+		"""
+		with self.lock:
+			for key in [key for key in self.__entries if predicate(key)]:
+				self.size -= self.__entries.pop(key)[1]
+
+	def clear(self):
+		with self.lock:
+			self.__entries.clear()
+			self.size = 0
@@ -0,0 +1,310 @@
+""" Service metrics: counters, latency histograms and gauges, optionally per
+    site.  They are exported as integers for the Thrift getCounters API and
+    in the Prometheus text format over HTTP, if the port option of the
+    [metrics] section is set.
+
+    Updates aren't locked, so concurrent threads may occasionally lose an
+    increment.  Metrics updated in forked processes are sent to the parent
+    when the child exits (see util.Fork).
+"""
+
+from __future__ import absolute_import
+
+import BaseHTTPServer
+from bisect import bisect_left
+import marshal
+import threading
+import time
+
+from .config import conf, log
+
+class Counter(object):
+	__slots__ = ["value"]
+
+	kind = "counter"
+
+	def __init__(self):
+		self.value = 0
+
+	def inc(self, n=1):
+		self.value += n
+
+	def reset(self):
+		self.value = 0
+
+	def state(self):
+		return self.value
+
+	def merge(self, state):
+		self.value += state
+
+	def export(self, name):
+		""" @rtype list((str, int | float))
+		"""
+		return [(name, self.value)]
+
+class Histogram(object):
+	""" Durations in seconds, counted in power-of-two buckets from 100
+	    microseconds up.
+	"""
+	__slots__ = ["buckets", "count", "sum"]
+
+	kind = "histogram"
+
+	bounds = [0.0001 * 2 ** i for i in xrange(18)]
+
+	def __init__(self):
+		self.reset()
+
+	def reset(self):
+		self.buckets = [0] * (len(self.bounds) + 1)
+		self.count = 0
+		self.sum = 0.0
+
+	def observe(self, value):
+		""" @type value: float
+		"""
+		self.buckets[bisect_left(self.bounds, value)] += 1
+		self.count += 1
+		self.sum += value
+
+	def state(self):
+		return self.buckets, self.count, self.sum
+
+	def merge(self, state):
+		buckets, count, total = state
+
+		for i, n in enumerate(buckets):
+			self.buckets[i] += n
+
+		self.count += count
+		self.sum += total
+
+	def quantile(self, q):
+		""" Upper bound of the bucket which contains the quantile.
+
+		    @type  q: float
+		    @rtype    float
+		"""
+		if not self.count:
+			return 0.0
+
+		rank = q * self.count
+		seen = 0
+
+		for bound, n in zip(self.bounds, self.buckets):
+			seen += n
+			if seen >= rank:
+				return bound
+
+		return self.bounds[-1] * 2
+
+	def export(self, name):
+		return [
+			(name + ".count", self.count),
+			(name + ".sum_us", self.sum * 1000000),
+			(name + ".p50_us", self.quantile(0.50) * 1000000),
+			(name + ".p90_us", self.quantile(0.90) * 1000000),
+			(name + ".p99_us", self.quantile(0.99) * 1000000),
+		]
+
+class Gauge(object):
+	__slots__ = ["getter"]
+
+	kind = "gauge"
+
+	def __init__(self, getter):
+		""" @type getter: callable
+		"""
+		self.getter = getter
+
+	def reset(self):
+		pass
+
+	def state(self):
+		return None
+
+	def merge(self, state):
+		pass
+
+	def export(self, name):
+		return [(name, self.getter())]
+
+class Metrics(object):
+	""" Metrics by name and site (None for global ones).
+	"""
+	def __init__(self):
+		self.metrics = {}
+		self.lock = threading.Lock()
+
+	def __get(self, cls, name, site, *args):
+		key = name, site
+		metric = self.metrics.get(key)
+
+		if metric is None:
+			with self.lock:
+				metric = self.metrics.get(key)
+				if metric is None:
+					metric = cls(*args)
+					self.metrics[key] = metric
+
+		return metric
+
+	def counter(self, name, site=None):
+		""" @type  name: str
+		    @type  site: str | NoneType
+		    @rtype       Counter
+		"""
+		return self.__get(Counter, name, site)
+
+	def histogram(self, name, site=None):
+		""" @type  name: str
+		    @type  site: str | NoneType
+		    @rtype       Histogram
+		"""
+		return self.__get(Histogram, name, site)
+
+	def gauge(self, name, getter, site=None):
+		""" @type name:   str
+		    @type getter: callable
+		    @type site:   str | NoneType
+		"""
+		with self.lock:
+			self.metrics[(name, site)] = Gauge(getter)
+
+	def observe(self, name, site, start):
+		""" Record the time elapsed since start.
+
+		    @type name:  str
+		    @type site:  str | NoneType
+		    @type start: float
+		"""
+		self.histogram(name, site).observe(time.time() - start)
+
+	def forked(self):
+		""" Called in a child process after fork: the parent keeps the
+		    values so far.
+		"""
+		self.lock = threading.Lock()
+
+		for metric in self.metrics.itervalues():
+			metric.reset()
+
+	def dumps(self):
+		""" Serialize the counters and histograms.
+
+		    @rtype str
+		"""
+		states = [(metric.kind, key, metric.state()) for key, metric in self.metrics.items() if metric.kind != "gauge"]
+		return marshal.dumps(states)
+
+	def merge(self, data):
+		""" Add serialized counters and histograms.
+
+		    @type data: str
+		"""
+		for kind, (name, site), state in marshal.loads(data):
+			if kind == "counter":
+				self.counter(name, site).merge(state)
+			elif kind == "histogram":
+				self.histogram(name, site).merge(state)
+
+	def items(self):
+		""" @rtype list((str, str | NoneType, Counter | Histogram | Gauge))
+		"""
+		return sorted((name, site, metric) for (name, site), metric in self.metrics.items())
+
+	def counters(self):
+		""" Integer values for getCounters.  Site-specific metric names are
+		    suffixed with the site name.
+
+		    @rtype dict(str, int)
+		"""
+		values = {}
+
+		for name, site, metric in self.items():
+			if site is not None:
+				name += "." + site
+
+			try:
+				exported = metric.export(name)
+			except:
+				log.exception("metric %s", name)
+				continue
+
+			for key, value in exported:
+				values[key] = long(value)
+
+		return values
+
+	def prometheus(self):
+		""" Prometheus text exposition format.
+
+		    @rtype str
+		"""
+		lines = []
+		described = set()
+
+		for name, site, metric in self.items():
+			metric_name = "impress_" + name.replace(".", "_")
+			labels = '{site="%s"}' % site if site is not None else ""
+
+			if metric_name not in described:
+				lines.append("# TYPE %s %s" % (metric_name, metric.kind))
+				described.add(metric_name)
+
+			try:
+				if metric.kind == "histogram":
+					seen = 0
+					for bound, n in zip(metric.bounds + [float("inf")], metric.buckets):
+						seen += n
+						le = "+Inf" if bound == float("inf") else repr(bound)
+						bucket_labels = '{%sle="%s"}' % ('site="%s",' % site if site is not None else "", le)
+						lines.append("%s_bucket%s %d" % (metric_name, bucket_labels, seen))
+
+					lines.append("%s_sum%s %r" % (metric_name, labels, metric.sum))
+					lines.append("%s_count%s %d" % (metric_name, labels, metric.count))
+				else:
+					for _, value in metric.export(name):
+						lines.append("%s%s %r" % (metric_name, labels, value))
+			except:
+				log.exception("metric %s", name)
+
+		return "".join(line + "\n" for line in lines)
+
+registry = Metrics()
+
+class Handler(BaseHTTPServer.BaseHTTPRequestHandler):
+
+	def do_GET(self):
+		if self.path.split("?")[0] != "/metrics":
+			self.send_error(404)
+			return
+
+		data = registry.prometheus()
+
+		self.send_response(200)
+		self.send_header("Content-Type", "text/plain; version=0.0.4")
+		self.send_header("Content-Length", str(len(data)))
+		self.end_headers()
+		self.wfile.write(data)
+
+	def log_message(self, format, *args):
+		log.debug("metrics http: " + format, *args)
+
+def start_server():
+	""" Serve the metrics over HTTP in a background thread, if configured.
+	"""
+	port = conf.get("metrics", "port", "")
+	if not port:
+		return None
+
+	server = BaseHTTPServer.HTTPServer((conf.get("metrics", "address", ""), int(port)), Handler)
+
+	thread = threading.Thread(target=server.serve_forever, name="metrics")
+	thread.daemon = True
+	thread.start()
+
+	log.info("metrics http port: %s", port)
+
+	return server
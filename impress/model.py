@@ -2,10 +2,21 @@
     classes.
 """
 
+import marshal
+
+def warm():
+	""" Optional module-level function which is called when the registry has
+	    (re)loaded the model, for precomputing tables etc.
+	"""
+
 class CacheModel(object):
 	""" Daily cache accumulation logic.
 	"""
 
+	# whether the add parameters are numeric items, and the aggregation
+	# values are their totals (see item_values)
+	itemized = False
+
 	def __init__(self, items=None):
 		""" @type items: dict | None
 		"""
@@ -18,6 +29,54 @@ class CacheModel(object):
 		    @type time:   datetime.time
 		"""
 
+	def aggregate(self):
+		""" Values for server-side aggregation; non-numeric ones are
+		    ignored.  Optional; the values returned by get() are used by
+		    default.
+
+		    @rtype dict
+		"""
+		return self.get()
+
+	def dumps(self):
+		""" Serialize for cache backups.  Optional; models without it are
+		    pickled.  May raise ValueError to fall back to pickling.
+
+		    @rtype str
+		"""
+
+	@classmethod
+	def loads(cls, data):
+		""" Deserialize from a cache backup.
+
+		    @type  data: str
+		    @rtype       CacheModel
+		"""
+
+	@classmethod
+	def convert(cls, modeldata):
+		""" Convert the data of another model when the type configuration
+		    has been changed.  Optional; None means that the data isn't
+		    converted.  (The data of an earlier version of this model is
+		    converted with dumps and loads.)
+
+		    @type  modeldata: CacheModel
+		    @rtype            CacheModel | NoneType
+		"""
+		return None
+
+def item_values(modeldata):
+	""" The numeric item values of itemized model data, for conversions
+	    between such models.
+
+	    @type  modeldata: CacheModel
+	    @rtype            dict | NoneType
+	"""
+	if not getattr(modeldata, "itemized", False):
+		return None
+
+	return { itemkey: value for itemkey, value in modeldata.aggregate().iteritems() if isinstance(value, (int, long, float)) and not isinstance(value, bool) }
+
 class TimelineModel(object):
 	""" Time slot merging logic.
 	"""
@@ -42,6 +101,20 @@ class TimelineModel(object):
 		"""
 		return False
 
+class Model(object):
+	""" Model classes configured with options, returned by the configure
+	    function of a model module.  The name is the model name of the type
+	    configuration.
+	"""
+	def __init__(self, name, cache_model, timeline_model):
+		""" @type name:           str
+		    @type cache_model:    type
+		    @type timeline_model: type
+		"""
+		self.__name__ = name
+		self.CacheModel = cache_model
+		self.TimelineModel = timeline_model
+
 class AbstractMixin(object):
 
 	def __init__(self, items=None):
@@ -56,6 +129,13 @@ class AbstractMixin(object):
 
 class AbstractCacheModel(AbstractMixin, CacheModel):
 
+	def dumps(self):
+		return marshal.dumps(self.items)
+
+	@classmethod
+	def loads(cls, data):
+		return cls(marshal.loads(data))
+
 	def upgrade(self):
 		try:
 			self.items
@@ -6,6 +6,7 @@ from __future__ import absolute_import
 from .. import model as interface
 
 class CacheModel(interface.AbstractCacheModel):
+	itemized = True
 
 	def add(self, params, delta):
 		""" @type params: dict
@@ -14,6 +15,15 @@ class CacheModel(interface.AbstractCacheModel):
 		for itemkey, delta in params.iteritems():
 			self.items[itemkey] = self.items.get(itemkey, 0) + delta
 
+	@classmethod
+	def convert(cls, modeldata):
+		""" @type  modeldata: CacheModel
+		    @rtype            CacheModel | NoneType
+		"""
+		values = interface.item_values(modeldata)
+		if values is not None:
+			return cls(values)
+
 class TimelineModel(interface.AbstractTimelineModel):
 
 	def merge(self, slot, other_slot):
@@ -0,0 +1,199 @@
+""" Non-additive items.  The add parameters are like with counters, but each
+    item is accumulated according to its aggregation rule:
+
+	sum   total of the values
+	min   smallest value
+	max   largest value
+	last  latest value
+	mean  average value; the number of values of such items is included in
+	      the data under "_counts"
+
+    The rules are declared as options of the model in the type
+    configuration, e.g. "impress.models.gauges:cpu=max,load=mean,*=last",
+    where "*" sets the default rule (last if not specified).  Timeline merges
+    apply the same rules, so that e.g. the maximum of a month is the maximum
+    of its days and the mean is weighted by the counts.
+"""
+
+from __future__ import absolute_import
+
+import marshal
+
+from .. import model as interface
+
+numeric_types = int, long, float
+
+COUNTS = "_counts"
+
+rule_names = "sum", "min", "max", "last", "mean"
+
+class Rules(object):
+	""" Item aggregation rules.
+	"""
+	def __init__(self, items=None, default="last"):
+		""" @type items:   dict | NoneType
+		    @type default: str
+		"""
+		self.items = items or {}
+		self.default = default
+
+	def get(self, itemkey):
+		""" @type  itemkey: str
+		    @rtype          str
+		"""
+		return self.items.get(itemkey, self.default)
+
+def parse_rules(options):
+	""" @type  options: str
+	    @rtype          Rules
+	"""
+	rules = Rules()
+
+	for option in options.split(","):
+		if not option:
+			continue
+
+		itemkey, sep, rule = option.partition("=")
+		if not sep or not itemkey or rule not in rule_names:
+			raise ValueError("Bad gauge rule: " + option)
+
+		if itemkey == "*":
+			rules.default = rule
+		else:
+			rules.items[itemkey] = rule
+
+	return rules
+
+def configure(options):
+	""" @type  options: str
+	    @rtype          Model
+	"""
+	rules = parse_rules(options)
+	name = __name__ + ":" + options
+
+	return interface.Model(
+		name,
+		type("CacheModel", (CacheModel,), { "rules": rules, "model_name": name }),
+		type("TimelineModel", (TimelineModel,), { "rules": rules }),
+	)
+
+class Gauges(object):
+	""" The values of mean items are kept as totals while accumulating.
+	"""
+	rules = Rules()
+
+	def __init__(self, items=None):
+		""" @type items: dict | NoneType
+		"""
+		self.items = {}
+		self.counts = {}
+
+		if items:
+			counts = items.get(COUNTS) or {}
+
+			for itemkey, value in items.iteritems():
+				if itemkey == COUNTS:
+					continue
+
+				if itemkey in counts:
+					count = counts[itemkey]
+					self.items[itemkey] = value * count
+					self.counts[itemkey] = count
+				else:
+					self.items[itemkey] = value
+
+	def accumulate(self, itemkey, value, count=1):
+		""" @type itemkey: str
+		    @type value:   int | float
+		    @type count:   int
+		"""
+		rule = self.rules.get(itemkey)
+		items = self.items
+		old = items.get(itemkey)
+
+		if rule == "last" or old is None:
+			items[itemkey] = value
+		elif rule == "sum" or rule == "mean":
+			items[itemkey] = old + value
+		elif rule == "min":
+			if value < old:
+				items[itemkey] = value
+		elif rule == "max":
+			if value > old:
+				items[itemkey] = value
+
+		if rule == "mean":
+			self.counts[itemkey] = self.counts.get(itemkey, 0) + count
+
+	def get(self):
+		""" @rtype dict
+		"""
+		if not self.counts:
+			return self.items
+
+		counts = self.counts
+		values = { itemkey: (float(value) / counts[itemkey] if itemkey in counts else value) for itemkey, value in self.items.iteritems() }
+		values[COUNTS] = counts
+
+		return values
+
+class CacheModel(Gauges, interface.CacheModel):
+	itemized = True
+
+	def add(self, params, delta):
+		""" @type params: dict
+		    @type delta:  datetime.timedelta
+		"""
+		for itemkey, value in params.iteritems():
+			if isinstance(value, numeric_types):
+				self.accumulate(itemkey, value)
+
+	@classmethod
+	def convert(cls, modeldata):
+		""" Each item value is accumulated as a single value.
+
+		    @type  modeldata: CacheModel
+		    @rtype            CacheModel | NoneType
+		"""
+		values = interface.item_values(modeldata)
+		if values is None:
+			return None
+
+		converted = cls()
+		for itemkey, value in values.iteritems():
+			converted.accumulate(itemkey, value)
+
+		return converted
+
+	def dumps(self):
+		return marshal.dumps((self.items, self.counts))
+
+	@classmethod
+	def loads(cls, data):
+		modeldata = cls()
+		modeldata.items, modeldata.counts = marshal.loads(data)
+		return modeldata
+
+class TimelineModel(Gauges, interface.TimelineModel):
+
+	def __init__(self, items=None):
+		Gauges.__init__(self, items)
+		self.times = {}
+
+	def merge(self, slot, other_slot):
+		""" @type slot:       ModelSlot
+		    @type other_slot: ModelSlot
+		"""
+		other = other_slot.modeldata
+		start = other_slot.interval.start
+
+		for itemkey, value in other.items.iteritems():
+			rule = self.rules.get(itemkey)
+
+			if rule == "last":
+				# the merged slots may come in any order
+				if itemkey in self.times and self.times[itemkey] > start:
+					continue
+				self.times[itemkey] = start
+
+			self.accumulate(itemkey, value, other.counts.get(itemkey, 1))
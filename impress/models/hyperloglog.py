@@ -0,0 +1,232 @@
+""" Approximate distinct counts with HyperLogLog sketches.  The add
+    parameters are a list of ids (strings or numbers), and the data consists
+    of the estimated number of distinct ids ("count") and the base64-encoded
+    sketch ("sketch").  Sketches are merged by taking the register-wise
+    maximum, so merged slots are estimated as accurately as if the ids had
+    been added to a single sketch.
+
+    With the default precision the sketch has 2048 one-byte registers and a
+    standard error of about 2.3%.  Small sketches are kept as a dict of the
+    nonzero registers.
+"""
+
+from __future__ import absolute_import
+
+import base64
+import hashlib
+import marshal
+import math
+import struct
+
+from .. import model as interface
+
+precision = 11
+
+inverse_powers = []
+
+def warm():
+	""" Precompute the register weights of the estimate.
+	"""
+	if not inverse_powers:
+		inverse_powers.extend(2.0 ** -rank for rank in xrange(66))
+
+def hash_id(objid):
+	""" @type  objid: str | unicode | int | long
+	    @rtype        int | long
+	"""
+	if isinstance(objid, unicode):
+		objid = objid.encode("utf-8")
+	elif not isinstance(objid, str):
+		objid = str(objid)
+
+	value, = struct.unpack(">Q", hashlib.md5(objid).digest()[:8])
+	return value
+
+def alpha(m):
+	""" Bias correction constant.
+
+	    @type  m: int
+	    @rtype    float
+	"""
+	if m == 16:
+		return 0.673
+	elif m == 32:
+		return 0.697
+	elif m == 64:
+		return 0.709
+	else:
+		return 0.7213 / (1 + 1.079 / m)
+
+class SparseRegisters(dict):
+	""" The nonzero registers.
+	"""
+	def __missing__(self, index):
+		return 0
+
+class Sketch(object):
+
+	def __init__(self, items=None):
+		""" @type items: dict | NoneType
+		"""
+		self.precision = precision
+		self.registers = SparseRegisters()
+
+		if items and items.get("sketch"):
+			self.decode(items["sketch"])
+
+	@property
+	def size(self):
+		return 1 << self.precision
+
+	def add_hash(self, value):
+		""" @type value: int | long
+		"""
+		bits = 64 - self.precision
+		index = int(value >> bits)
+		rank = bits - (value & ((1 << bits) - 1)).bit_length() + 1
+
+		registers = self.registers
+		if rank > registers[index]:
+			registers[index] = rank
+
+	def densify(self):
+		""" Switch to the flat representation when it's smaller.
+		"""
+		registers = self.registers
+		# a dict entry takes tens of bytes, a register one
+		if isinstance(registers, dict) and len(registers) * 64 > self.size:
+			dense = bytearray(self.size)
+			for index, rank in registers.iteritems():
+				dense[index] = rank
+			self.registers = dense
+
+	def set_dense(self, data):
+		""" @type data: str
+		"""
+		size = len(data)
+		p = size.bit_length() - 1
+		if size != 1 << p or not 4 <= p <= 16:
+			raise ValueError("Bad HyperLogLog sketch size: %d" % size)
+
+		self.precision = p
+		self.registers = bytearray(data)
+
+	def decode(self, encoded):
+		""" @type encoded: str | unicode
+		"""
+		self.set_dense(base64.b64decode(encoded))
+
+	def encode(self):
+		""" @rtype str
+		"""
+		registers = self.registers
+		if isinstance(registers, dict):
+			dense = bytearray(self.size)
+			for index, rank in registers.iteritems():
+				dense[index] = rank
+			registers = dense
+
+		return base64.b64encode(str(registers))
+
+	def iterranks(self):
+		""" @rtype iterator((int, int))
+		"""
+		registers = self.registers
+		if isinstance(registers, dict):
+			return registers.iteritems()
+		else:
+			return ((index, rank) for index, rank in enumerate(registers) if rank)
+
+	def merge_sketch(self, other):
+		""" Register-wise maximum.
+
+		    @type other: Sketch
+		"""
+		if other.precision != self.precision:
+			if self.registers:
+				raise ValueError("Incompatible HyperLogLog sketch precisions: %d and %d" % (self.precision, other.precision))
+
+			self.precision = other.precision
+
+		registers = self.registers
+		for index, rank in other.iterranks():
+			if rank > registers[index]:
+				registers[index] = rank
+
+		self.densify()
+
+	def count(self):
+		""" @rtype int
+		"""
+		if not inverse_powers:
+			warm()
+
+		m = self.size
+		registers = self.registers
+		weights = inverse_powers
+
+		if isinstance(registers, dict):
+			zeros = m - len(registers)
+			total = zeros + sum(weights[rank] for rank in registers.itervalues())
+		else:
+			zeros = registers.count("\0")
+			total = sum(weights[rank] for rank in registers)
+
+		estimate = alpha(m) * m * m / total
+
+		if estimate <= 2.5 * m and zeros:
+			estimate = m * math.log(float(m) / zeros)
+
+		return int(round(estimate))
+
+	def get(self):
+		""" @rtype dict
+		"""
+		return {
+			"count":  self.count(),
+			"sketch": self.encode(),
+		}
+
+class CacheModel(Sketch, interface.CacheModel):
+
+	def add(self, params, delta):
+		""" @type params: list
+		    @type delta:  datetime.timedelta
+		"""
+		for objid in params:
+			self.add_hash(hash_id(objid))
+
+		self.densify()
+
+	def aggregate(self):
+		return { "count": self.count() }
+
+	def dumps(self):
+		registers = self.registers
+		if isinstance(registers, dict):
+			registers = dict(registers)
+		else:
+			registers = str(registers)
+
+		return marshal.dumps((self.precision, registers))
+
+	@classmethod
+	def loads(cls, data):
+		p, registers = marshal.loads(data)
+
+		modeldata = cls()
+		if isinstance(registers, dict):
+			modeldata.precision = p
+			modeldata.registers = SparseRegisters(registers)
+		else:
+			modeldata.set_dense(registers)
+
+		return modeldata
+
+class TimelineModel(Sketch, interface.TimelineModel):
+
+	def merge(self, slot, other_slot):
+		""" @type slot:       ModelSlot
+		    @type other_slot: ModelSlot
+		"""
+		self.merge_sketch(other_slot.modeldata)
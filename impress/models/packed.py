@@ -0,0 +1,127 @@
+""" Integer counters with a fixed set of items, declared as options of the
+    model in the type configuration, e.g. "impress.models.packed:clicks,views".
+    The counters are packed in a buffer, so that they can be kept in an
+    arena (see impress.arena).  Other items and non-integer values are
+    ignored.
+"""
+
+from __future__ import absolute_import
+
+import marshal
+import struct
+
+from .. import model as interface
+from . import counters
+
+_counter = struct.Struct("<q")
+
+def configure(options):
+	""" @type  options: str
+	    @rtype          Model
+	"""
+	items = tuple(item for item in options.split(",") if item)
+	if not items or len(set(items)) != len(items):
+		raise ValueError("Bad packed counter items: " + options)
+
+	name = __name__ + ":" + options
+
+	cache_model = type("CacheModel", (CacheModel,), {
+		"items":      items,
+		"positions":  { item: i for i, item in enumerate(items) },
+		"model_name": name,
+	})
+
+	return interface.Model(name, cache_model, TimelineModel)
+
+class CacheModel(interface.CacheModel):
+	""" Standalone instances own their buffer; views refer to an arena
+	    record.
+	"""
+	packed = True
+	itemized = True
+	items = ()
+	positions = {}
+
+	def __init__(self, items=None):
+		""" @type items: dict | NoneType
+		"""
+		self.buf = bytearray(_counter.size * len(self.items))
+		self.offset = 0
+
+		if items:
+			for itemkey, value in items.iteritems():
+				position = self.positions.get(itemkey)
+				if position is not None and isinstance(value, (int, long)):
+					_counter.pack_into(self.buf, _counter.size * position, value)
+
+	@classmethod
+	def view(cls, buf, offset):
+		""" @type  buf:    mmap.mmap
+		    @type  offset: int
+		    @rtype         CacheModel
+		"""
+		modeldata = cls.__new__(cls)
+		modeldata.buf = buf
+		modeldata.offset = offset
+		return modeldata
+
+	def copy_to(self, buf, offset):
+		""" @type buf:    mmap.mmap
+		    @type offset: int
+		"""
+		size = _counter.size * len(self.items)
+		buf[offset:offset + size] = str(self.buf[self.offset:self.offset + size])
+
+	def add(self, params, delta):
+		""" @type params: dict
+		    @type delta:  datetime.timedelta
+		"""
+		buf = self.buf
+
+		for itemkey, value in params.iteritems():
+			position = self.positions.get(itemkey)
+			if position is not None and isinstance(value, (int, long)):
+				offset = self.offset + _counter.size * position
+				old, = _counter.unpack_from(buf, offset)
+				_counter.pack_into(buf, offset, old + value)
+
+	def get(self):
+		""" @rtype dict
+		"""
+		buf = self.buf
+		offset = self.offset
+		values = {}
+
+		for item in self.items:
+			value, = _counter.unpack_from(buf, offset)
+			if value:
+				values[item] = value
+			offset += _counter.size
+
+		return values
+
+	@classmethod
+	def convert(cls, modeldata):
+		""" Integral values are converted.
+
+		    @type  modeldata: CacheModel
+		    @rtype            CacheModel | NoneType
+		"""
+		values = interface.item_values(modeldata)
+		if values is not None:
+			return cls({ itemkey: int(value) for itemkey, value in values.iteritems() if isinstance(value, (int, long)) or value.is_integer() })
+
+	def dumps(self):
+		return marshal.dumps(self.get())
+
+	@classmethod
+	def loads(cls, data):
+		return cls(marshal.loads(data))
+
+	def __getstate__(self):
+		return self.get()
+
+	def __setstate__(self, state):
+		self.__init__(state)
+
+TimelineModel = counters.TimelineModel
@@ -0,0 +1,209 @@
+""" Value distributions with mergeable quantile sketches.  The add parameters
+    are a list of values (e.g. latencies), and the data consists of their
+    count, sum, minimum and maximum, the 50th, 90th and 99th percentiles and
+    the sketch ("buckets" and "zero").
+
+    The sketch is a logarithmically bucketed histogram (like DDSketch):
+    positive values are counted in buckets whose bounds grow by a constant
+    factor, so that the quantiles have at most 1% relative error.  Values
+    which aren't positive are counted in the zero bucket, and values which
+    aren't finite numbers are ignored.  When there are too many buckets,
+    the lowest ones are collapsed, which only affects the accuracy of the
+    lowest quantiles.  Sketches are merged by adding the bucket counts.
+"""
+
+from __future__ import absolute_import
+
+import marshal
+import math
+
+from .. import model as interface
+
+relative_accuracy = 0.01
+max_buckets = 1024
+
+gamma = (1 + relative_accuracy) / (1 - relative_accuracy)
+log_gamma = math.log(gamma)
+
+numeric_types = int, long, float
+
+quantiles = [
+	("p50", 0.50),
+	("p90", 0.90),
+	("p99", 0.99),
+]
+
+def is_number(value):
+	""" JSON allows Infinity and NaN, which can't be bucketed, and booleans
+	    aren't counted as numbers.
+
+	    @type  value: object
+	    @rtype        bool
+	"""
+	if isinstance(value, bool) or not isinstance(value, numeric_types):
+		return False
+
+	return not (isinstance(value, float) and (math.isinf(value) or math.isnan(value)))
+
+def bucket_key(value):
+	""" @type  value: int | float
+	    @rtype        int
+	"""
+	return int(math.ceil(math.log(value) / log_gamma))
+
+def bucket_value(key):
+	""" Representative value of a bucket, with equal relative error to both
+	    bounds.
+
+	    @type  key: int
+	    @rtype      float
+	"""
+	return 2 * gamma ** key / (gamma + 1)
+
+class Sketch(object):
+
+	def __init__(self, items=None):
+		""" @type items: dict | NoneType
+		"""
+		self.count = 0
+		self.sum = 0
+		self.min = None
+		self.max = None
+		self.zero = 0
+		self.buckets = {}
+
+		if items and items.get("count"):
+			self.count = items["count"]
+			self.sum = items["sum"]
+			self.min = items["min"]
+			self.max = items["max"]
+			self.zero = items.get("zero", 0)
+			self.buckets = { int(key): n for key, n in items.get("buckets", ()) }
+
+	def add_value(self, value):
+		""" @type value: int | float
+		"""
+		self.count += 1
+		self.sum += value
+
+		if self.min is None or value < self.min:
+			self.min = value
+		if self.max is None or value > self.max:
+			self.max = value
+
+		if value > 0:
+			key = bucket_key(value)
+			self.buckets[key] = self.buckets.get(key, 0) + 1
+		else:
+			self.zero += 1
+
+	def merge_sketch(self, other):
+		""" @type other: Sketch
+		"""
+		if not other.count:
+			return
+
+		self.count += other.count
+		self.sum += other.sum
+
+		if self.min is None or other.min < self.min:
+			self.min = other.min
+		if self.max is None or other.max > self.max:
+			self.max = other.max
+
+		self.zero += other.zero
+
+		buckets = self.buckets
+		for key, n in other.buckets.iteritems():
+			buckets[key] = buckets.get(key, 0) + n
+
+		self.collapse()
+
+	def collapse(self):
+		""" Merge the lowest buckets when there are too many.
+		"""
+		buckets = self.buckets
+		if len(buckets) > max_buckets:
+			keys = sorted(buckets)
+			excess = len(keys) - max_buckets
+			target = keys[excess]
+
+			for key in keys[:excess]:
+				buckets[target] += buckets.pop(key)
+
+	def quantile(self, q):
+		""" @type  q: float
+		    @rtype    int | float | NoneType
+		"""
+		if not self.count:
+			return None
+
+		rank = q * (self.count - 1)
+		seen = self.zero
+
+		if rank < seen:
+			value = 0
+		else:
+			value = self.max
+
+			for key in sorted(self.buckets):
+				seen += self.buckets[key]
+				if seen > rank:
+					value = bucket_value(key)
+					break
+
+		return min(max(value, self.min), self.max)
+
+	def get(self):
+		""" @rtype dict
+		"""
+		if not self.count:
+			return { "count": 0 }
+
+		values = {
+			"count":   self.count,
+			"sum":     self.sum,
+			"min":     self.min,
+			"max":     self.max,
+			"zero":    self.zero,
+			"buckets": sorted(self.buckets.iteritems()),
+		}
+
+		for name, q in quantiles:
+			values[name] = self.quantile(q)
+
+		return values
+
+class CacheModel(Sketch, interface.CacheModel):
+
+	def add(self, params, delta):
+		""" @type params: list
+		    @type delta:  datetime.timedelta
+		"""
+		for value in params:
+			if is_number(value):
+				self.add_value(value)
+
+		self.collapse()
+
+	def aggregate(self):
+		values = self.get()
+		values.pop("buckets", None)
+		return values
+
+	def dumps(self):
+		return marshal.dumps((self.count, self.sum, self.min, self.max, self.zero, self.buckets))
+
+	@classmethod
+	def loads(cls, data):
+		modeldata = cls()
+		modeldata.count, modeldata.sum, modeldata.min, modeldata.max, modeldata.zero, modeldata.buckets = marshal.loads(data)
+		return modeldata
+
+class TimelineModel(Sketch, interface.TimelineModel):
+
+	def merge(self, slot, other_slot):
+		""" @type slot:       ModelSlot
+		    @type other_slot: ModelSlot
+		"""
+		self.merge_sketch(other_slot.modeldata)
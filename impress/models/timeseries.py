@@ -0,0 +1,213 @@
+""" Items accumulated in fixed-length bins within the slot, using the time
+    offset of the add.  The add parameters are like with counters, and the
+    data consists of the bin length in seconds ("bin") and the nonzero bins
+    of each item as [index, value] pairs ("items"), where the index counts
+    bins from the start of the slot.
+
+    The bin length is configured with the bin_seconds option of the
+    [timeseries] section (5 minutes by default).  The cached bins of an item
+    are a packed array which grows up to the latest bin.  When slots are
+    merged, the bins are shifted by the offset between the slot starts.
+    Merged slots have at most max_bins bins (1000 by default), so the bins
+    of long slots are coarser: multiples of the bin length which line up
+    with hours and days.  For example a month of 5-minute bins is merged into
+    hourly bins.
+"""
+
+from __future__ import absolute_import
+
+import array
+import marshal
+
+from .. import model as interface
+from ..config import conf
+
+numeric_types = int, long, float
+
+def get_bin_seconds():
+	""" @rtype int
+	"""
+	return int(conf.get("timeseries", "bin_seconds", "300"))
+
+def get_max_bins():
+	""" @rtype int
+	"""
+	return int(conf.get("timeseries", "max_bins", "1000"))
+
+def merged_bin_seconds(delta, bin_seconds):
+	""" The shortest bin length for a slot which doesn't exceed max_bins.
+
+	    @type  delta:       datetime.timedelta
+	    @type  bin_seconds: int
+	    @rtype              int
+	"""
+	seconds = total_seconds(delta)
+	max_bins = get_max_bins()
+
+	if seconds <= bin_seconds * max_bins:
+		return bin_seconds
+
+	length = bin_seconds
+
+	while seconds > length * max_bins or not aligned(length):
+		length += bin_seconds
+
+	return length
+
+def aligned(seconds):
+	""" Whether bins of the length line up with hours and days.
+
+	    @type  seconds: int
+	    @rtype          bool
+	"""
+	if seconds < 3600:
+		return 3600 % seconds == 0
+	elif seconds < 86400:
+		return seconds % 3600 == 0 and 86400 % seconds == 0
+	else:
+		return seconds % 86400 == 0
+
+def total_seconds(delta):
+	""" @type  delta: datetime.timedelta
+	    @rtype        int
+	"""
+	return delta.days * 86400 + delta.seconds
+
+def pack(value):
+	""" Integral values are output as integers.
+
+	    @type  value: float
+	    @rtype        int | long | float
+	"""
+	if value.is_integer():
+		return int(value)
+	else:
+		return value
+
+class CacheModel(interface.CacheModel):
+	""" The data of other models isn't converted, since it has no times.
+	"""
+	itemized = True
+
+	def __init__(self, items=None):
+		""" @type items: dict | NoneType
+		"""
+		self.bin_seconds = get_bin_seconds()
+		self.items = {}
+
+		if items:
+			self.bin_seconds = items.get("bin", self.bin_seconds)
+
+			for itemkey, pairs in items.get("items", {}).iteritems():
+				bins = array.array("d")
+				for i, value in pairs:
+					if i >= len(bins):
+						bins.extend([0.0] * (i + 1 - len(bins)))
+					bins[i] += value
+				self.items[itemkey] = bins
+
+	def add(self, params, delta):
+		""" @type params: dict
+		    @type delta:  datetime.timedelta
+		"""
+		index = max(total_seconds(delta) // self.bin_seconds, 0)
+
+		for itemkey, value in params.iteritems():
+			if not isinstance(value, numeric_types):
+				continue
+
+			bins = self.items.get(itemkey)
+			if bins is None:
+				bins = array.array("d")
+				self.items[itemkey] = bins
+
+			if index >= len(bins):
+				bins.extend([0.0] * (index + 1 - len(bins)))
+
+			bins[index] += value
+
+	def get(self):
+		""" @rtype dict
+		"""
+		return {
+			"bin":   self.bin_seconds,
+			"items": { itemkey: [[i, pack(value)] for i, value in enumerate(bins) if value] for itemkey, bins in self.items.iteritems() },
+		}
+
+	def aggregate(self):
+		""" Item totals.
+		"""
+		return { itemkey: pack(sum(bins)) for itemkey, bins in self.items.iteritems() }
+
+	def dumps(self):
+		return marshal.dumps((self.bin_seconds, { itemkey: bins.tostring() for itemkey, bins in self.items.iteritems() }))
+
+	@classmethod
+	def loads(cls, data):
+		bin_seconds, items = marshal.loads(data)
+
+		modeldata = cls()
+		modeldata.bin_seconds = bin_seconds
+
+		for itemkey, packed in items.iteritems():
+			bins = array.array("d")
+			bins.fromstring(packed)
+			modeldata.items[itemkey] = bins
+
+		return modeldata
+
+class TimelineModel(interface.TimelineModel):
+	""" The bins are kept sparse, since merged slots may be long.
+	"""
+	def __init__(self, items=None):
+		""" @type items: dict | NoneType
+		"""
+		self.bin_seconds = get_bin_seconds()
+		self.items = {}
+
+		if items:
+			self.bin_seconds = items.get("bin", self.bin_seconds)
+			self.items = { itemkey: dict(pairs) for itemkey, pairs in items.get("items", {}).iteritems() }
+
+	def merge(self, slot, other_slot):
+		""" @type slot:       ModelSlot
+		    @type other_slot: ModelSlot
+		"""
+		bin_seconds = merged_bin_seconds(slot.interval.delta, self.bin_seconds)
+		if bin_seconds != self.bin_seconds:
+			self.rebin(bin_seconds)
+
+		other = other_slot.modeldata
+		offset = total_seconds(other_slot.interval.start - slot.interval.start)
+
+		for itemkey, other_bins in other.items.iteritems():
+			bins = self.items.get(itemkey)
+			if bins is None:
+				bins = {}
+				self.items[itemkey] = bins
+
+			for i, value in other_bins.iteritems():
+				index = (offset + i * other.bin_seconds) // self.bin_seconds
+				bins[index] = bins.get(index, 0) + value
+
+	def rebin(self, bin_seconds):
+		""" @type bin_seconds: int
+		    @param bin_seconds: a multiple of the current bin length
+		"""
+		factor = bin_seconds // self.bin_seconds
+
+		for itemkey, bins in self.items.items():
+			rebinned = {}
+			for i, value in bins.iteritems():
+				rebinned[i // factor] = rebinned.get(i // factor, 0) + value
+			self.items[itemkey] = rebinned
+
+		self.bin_seconds = bin_seconds
+
+	def get(self):
+		""" @rtype dict
+		"""
+		return {
+			"bin":   self.bin_seconds,
+			"items": { itemkey: sorted([i, value] for i, value in bins.iteritems() if value) for itemkey, bins in self.items.iteritems() },
+		}
@@ -16,10 +16,10 @@ class TimelinePattern(interface.TimelinePattern):
 		month = previous_month(today)
 		begin = previous_month(month)  # skip last month - it might have just ended
 
-		for date in reverse_month_range(begin, timeline.start):
+		for date in reverse_month_range(begin, timeline.start().date()):
 			delta = month_length(date)
 
-			timeline.merge(date, delta)
+			timeline.merge(datetime.datetime(date.year, date.month, date.day), delta)
 			month = date
 
 			date = previous_month(month)
@@ -0,0 +1,160 @@
+""" Merges slots into progressively coarser slots as they get older, according
+    to retention rules configured per object type in the [rollup] section:
+
+	[rollup]
+	default = day 60, month
+	c       = hour 48, day 60, month
+
+    Each rule names a unit and how many of the latest units are kept as they
+    are; older slots are merged into slots of the next unit.  The last unit
+    is kept forever.  Supported units are hour, day, week, month and year.
+"""
+from __future__ import absolute_import
+
+import datetime
+
+from .. import pattern as interface
+from ..config import conf
+from ..registry import Registry
+
+class TimelinePattern(interface.TimelinePattern):
+
+	@staticmethod
+	def merge(timeline):
+		""" @type timeline: Timeline
+		"""
+		rules = get_rules(Registry.parse_object_type(timeline.objkey))
+		if not rules:
+			return
+
+		now = timeline.site.current_datetime()
+
+		# finest level first, so that the coarser levels pick up the merged slots
+		for (unit, keep), (next_unit, _) in zip(rules, rules[1:]):
+			cutoff = next_unit.floor(unit.shift(unit.floor(now), -keep))
+
+			for start in next_unit.reverse_range(cutoff, timeline.start()):
+				delta = next_unit.shift(start, 1) - start
+
+				# skip the units rolled up further by earlier runs
+				if not timeline.covered(start, delta):
+					timeline.merge(start, delta)
+
+class Unit(object):
+	""" Calendar unit with alignment and stepping support.
+	"""
+	def __init__(self, name, floor, shift):
+		self.name = name
+		self.floor = floor
+		self.shift = shift
+
+	def __str__(self):
+		return self.name
+
+	def reverse_range(self, end, earliest):
+		""" Iterate through the starting points of units which end before or
+		    at end, latest first.
+
+		    @type  end:      datetime.datetime
+		    @type  earliest: datetime.datetime
+		    @rtype           iterator(datetime.datetime)
+		"""
+		stop = self.floor(earliest)
+		start = self.shift(end, -1)
+
+		while start >= stop:
+			yield start
+			start = self.shift(start, -1)
+
+def floor_hour(dt):
+	return dt.replace(minute=0, second=0, microsecond=0)
+
+def floor_day(dt):
+	return datetime.datetime(dt.year, dt.month, dt.day)
+
+def floor_week(dt):
+	return floor_day(dt) - datetime.timedelta(days=dt.weekday())
+
+def floor_month(dt):
+	return datetime.datetime(dt.year, dt.month, 1)
+
+def floor_year(dt):
+	return datetime.datetime(dt.year, 1, 1)
+
+def shift_delta(delta):
+	return lambda dt, n: dt + delta * n
+
+def shift_month(dt, n):
+	index = dt.year * 12 + dt.month - 1 + n
+	return dt.replace(year=index // 12, month=index % 12 + 1)
+
+def shift_year(dt, n):
+	return dt.replace(year=dt.year + n)
+
+units = {
+	"hour":  Unit("hour",  floor_hour,  shift_delta(datetime.timedelta(hours=1))),
+	"day":   Unit("day",   floor_day,   shift_delta(datetime.timedelta(days=1))),
+	"week":  Unit("week",  floor_week,  shift_delta(datetime.timedelta(days=7))),
+	"month": Unit("month", floor_month, shift_month),
+	"year":  Unit("year",  floor_year,  shift_year),
+}
+
+unit_order = ["hour", "day", "week", "month", "year"]
+
+# weeks don't line up with months or years
+incompatible = set([("week", "month"), ("week", "year")])
+
+def parse_rules(value):
+	""" Parse a comma-separated list of "UNIT COUNT" rules, the last of which
+	    doesn't have a count.
+
+	    @type  value: str
+	    @rtype        list((Unit, int | NoneType))
+	"""
+	rules = []
+
+	for i, spec in enumerate(value.split(",")):
+		tokens = spec.split()
+		last = (i == value.count(","))
+
+		if len(tokens) != (1 if last else 2) or tokens[0] not in units:
+			raise ValueError("Bad rollup rule: " + spec.strip())
+
+		name = tokens[0]
+
+		if rules:
+			prev = rules[-1][0].name
+
+			if unit_order.index(prev) >= unit_order.index(name):
+				raise ValueError("Rollup units must be in increasing order: " + value)
+
+			if (prev, name) in incompatible:
+				raise ValueError("Rollup unit %s doesn't align with %s" % (prev, name))
+
+		if last:
+			keep = None
+		else:
+			keep = int(tokens[1])
+			if keep < 1:
+				raise ValueError("Bad rollup count: " + spec.strip())
+
+		rules.append((units[name], keep))
+
+	return rules
+
+_parsed = {}
+
+def get_rules(objtype):
+	""" @type  objtype: str
+	    @rtype          list((Unit, int | NoneType))
+	"""
+	value = conf.get("rollup", objtype, None)
+	if value is None:
+		value = conf.get("rollup", "default", "")
+
+	rules = _parsed.get(value)
+	if rules is None:
+		rules = parse_rules(value) if value.strip() else []
+		_parsed[value] = rules
+
+	return rules
@@ -0,0 +1,242 @@
+""" Runtime profiling which can be controlled without restarting the service
+    (see the profile.* options of the Thrift service):
+
+    The sampler records the stacks of all threads (except its own) at an
+    interval, and writes the counts in the collapsed stack format used by
+    flame graph tools when it's stopped.
+
+    The tracer times calls of the hot-path methods, and writes the call
+    counts, total and maximum durations when it's stopped.
+"""
+
+from __future__ import absolute_import
+
+import importlib
+import os
+import sys
+import thread
+import threading
+import time
+
+from .config import conf, log
+
+class Sampler(object):
+
+	def __init__(self, interval):
+		""" @type interval: float
+		"""
+		self.interval = interval
+		self.stacks = {}
+		self.samples = 0
+		self.stopped = threading.Event()
+		self.thread = None
+
+	def start(self):
+		self.thread = threading.Thread(target=self.run, name="profile-sampler")
+		self.thread.daemon = True
+		self.thread.start()
+
+	def stop(self):
+		self.stopped.set()
+		self.thread.join()
+
+	def run(self):
+		own = thread.get_ident()
+
+		while not self.stopped.wait(self.interval):
+			self.sample(own)
+
+	def sample(self, own):
+		""" @type own: int
+		"""
+		names = { t.ident: t.name for t in threading.enumerate() }
+		stacks = self.stacks
+
+		for ident, frame in sys._current_frames().items():
+			if ident == own:
+				continue
+
+			stack = []
+			while frame is not None:
+				code = frame.f_code
+				stack.append("%s (%s:%d)" % (code.co_name, os.path.basename(code.co_filename), code.co_firstlineno))
+				frame = frame.f_back
+
+			stack.append(names.get(ident, "thread-%d" % ident))
+			stack.reverse()
+
+			key = ";".join(stack)
+			stacks[key] = stacks.get(key, 0) + 1
+
+		self.samples += 1
+
+	def write(self, file):
+		for stack, count in sorted(self.stacks.iteritems()):
+			print >>file, stack, count
+
+class Tracer(object):
+	""" Replaces methods with timing wrappers while it's installed.
+	"""
+	targets = [
+		("impress.cache", "Slot", "add"),
+		("impress.cache", "SiteCache", "get"),
+	]
+
+	def __init__(self):
+		self.stats = {}
+		self.originals = []
+
+	def install(self):
+		for module_name, class_name, name in self.targets:
+			cls = getattr(importlib.import_module(module_name), class_name)
+			original = cls.__dict__[name]
+
+			stats = [0, 0.0, 0.0]  # calls, total and maximum seconds
+			self.stats["%s.%s" % (class_name, name)] = stats
+
+			setattr(cls, name, make_wrapper(original, stats))
+			self.originals.append((cls, name, original))
+
+	def uninstall(self):
+		for cls, name, original in self.originals:
+			setattr(cls, name, original)
+
+		self.originals = []
+
+	def write(self, file):
+		for name, (calls, total, maximum) in sorted(self.stats.iteritems()):
+			average = total / calls if calls else 0.0
+			print >>file, "%s calls=%d total=%.6f average=%.9f max=%.6f" % (name, calls, total, average, maximum)
+
+def make_wrapper(func, stats):
+	""" @type  func:  callable
+	    @type  stats: list
+	    @rtype        callable
+	"""
+	def wrapper(*args, **kwargs):
+		start = time.time()
+		try:
+			return func(*args, **kwargs)
+		finally:
+			elapsed = time.time() - start
+
+			stats[0] += 1
+			stats[1] += elapsed
+			if elapsed > stats[2]:
+				stats[2] = elapsed
+
+	wrapper.__name__ = func.__name__
+	wrapper.__doc__ = func.__doc__
+
+	return wrapper
+
+class Profiler(object):
+	""" Controls the sampler and the tracer.  The output filename is
+	    configured with the output option of the [profile] section (it can't
+	    be changed at runtime, since the files are overwritten), and it may
+	    contain a {pid} placeholder; the tracer output goes to a file with a
+	    .trace suffix.
+	"""
+	def __init__(self):
+		self.lock = threading.Lock()
+		self.sampler = None
+		self.tracer = None
+		self.interval = None
+
+	def get_interval(self):
+		""" @rtype float
+		"""
+		if self.interval is None:
+			return float(conf.get("profile", "interval", "0.01"))
+		return self.interval
+
+	def set_interval(self, value):
+		interval = float(value)
+		if interval <= 0:
+			raise ValueError("Bad profile interval: " + value)
+		self.interval = interval
+
+	def get_output(self):
+		""" @rtype str
+		"""
+		return conf.get("profile", "output", "/tmp/impress-profile.{pid}.folded")
+
+	def filename(self, suffix=""):
+		return self.get_output().format(pid=os.getpid()) + suffix
+
+	def set_sampler(self, value):
+		""" @type value: str
+		"""
+		with self.lock:
+			if value == "start":
+				if self.sampler:
+					return
+
+				self.sampler = Sampler(self.get_interval())
+				self.sampler.start()
+
+				log.info("profile sampler started")
+
+			elif value == "stop":
+				if not self.sampler:
+					return
+
+				sampler = self.sampler
+				self.sampler = None
+				sampler.stop()
+
+				filename = self.filename()
+				with open(filename, "w") as file:
+					sampler.write(file)
+
+				log.info("profile sampler stopped after %d samples: %s", sampler.samples, filename)
+
+			else:
+				raise ValueError("Bad profile sampler command: " + value)
+
+	def get_sampler(self):
+		""" @rtype str
+		"""
+		sampler = self.sampler
+		return "running %d" % sampler.samples if sampler else "stopped"
+
+	def set_tracer(self, value):
+		""" @type value: str
+		"""
+		with self.lock:
+			if value == "start":
+				if self.tracer:
+					return
+
+				self.tracer = Tracer()
+				self.tracer.install()
+
+				log.info("profile tracer started")
+
+			elif value == "stop":
+				if not self.tracer:
+					return
+
+				tracer = self.tracer
+				self.tracer = None
+				tracer.uninstall()
+
+				filename = self.filename(".trace")
+				with open(filename, "w") as file:
+					tracer.write(file)
+
+				log.info("profile tracer stopped: %s", filename)
+
+			else:
+				raise ValueError("Bad profile tracer command: " + value)
+
+	def get_tracer(self):
+		""" @rtype str
+		"""
+		tracer = self.tracer
+		if not tracer:
+			return "stopped"
+
+		return " ".join("%s=%d" % (name, stats[0]) for name, stats in sorted(tracer.stats.iteritems()))
+
+profiler = Profiler()
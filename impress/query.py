@@ -0,0 +1,56 @@
+""" Query parameters of the get API.
+"""
+
+from __future__ import absolute_import
+
+class Range(object):
+	""" Selects slots which overlap a time range, and optionally only a
+	    number of the latest ones.
+	"""
+	def __init__(self, start=None, end=None, count=None):
+		""" @type start: datetime.datetime | NoneType
+		    @type end:   datetime.datetime | NoneType
+		    @type count: int | NoneType
+		"""
+		self.start = start
+		self.end = end
+		self.count = count
+
+	def overlaps(self, interval):
+		""" @type  interval: Interval
+		    @rtype           bool
+		"""
+		return (self.start is None or interval.end > self.start) and (self.end is None or interval.start < self.end)
+
+	def needs_stored(self, intervals):
+		""" Check if the range may contain slots which are older than the
+		    given ones.
+
+		    @type  intervals: list(Interval)
+		    @rtype            bool
+		"""
+		# the cached slots are newer than the stored ones
+		if self.count and len([interval for interval in intervals if self.overlaps(interval)]) >= self.count:
+			return False
+
+		if not intervals:
+			return True
+
+		earliest = min(interval.start for interval in intervals)
+
+		return self.start is None or self.start < earliest
+
+	def selector(self, intervals):
+		""" Make a predicate which accepts the matching intervals among the
+		    candidates.
+
+		    @type  intervals: iterable(Interval)
+		    @rtype            callable(Interval)
+		"""
+		if not self.count:
+			return self.overlaps
+
+		orders = sorted(set(interval.order for interval in intervals if self.overlaps(interval)), reverse=True)
+		selected = set(orders[:self.count])
+
+		return lambda interval: interval.order in selected
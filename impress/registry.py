@@ -3,32 +3,62 @@
 
 from __future__ import absolute_import
 
+import cPickle as pickle
 import importlib
+import sys
 
-from .config import conf
+from .config import conf, log
 
 class Registry(object):
 	""" Maps object types to model and pattern modules based on
-	    configuration.
+	    configuration.  The version is incremented when the model of an
+	    object type changes.
 	"""
 
 	def __init__(self):
+		self.types = {}
+		self.version = 0
 		self.reconfigure()
 
 	def reconfigure(self):
-		types = {}
+		""" Reload the configuration, and the model modules if the reload
+		    option of the [registry] section is set.  Return the object
+		    types whose model has changed.
+
+		    @rtype dict(str, module)
+		"""
+		configs = [self.parse_type_config(config) for name, config in conf.items("type")]
 
-		for name, config in conf.items("type"):
-			objtypes, model_name, pattern_name = self.parse_type_config(config)
+		# a reloaded module is the same object, but its classes are new
+		classes = { objtype: model.CacheModel for objtype, (model, pattern) in self.types.iteritems() }
+
+		if conf.getboolean("registry", "reload", False):
+			reload_models(set(model_name for objtypes, model_name, pattern_name in configs))
+
+		types = {}
 
+		for objtypes, model_name, pattern_name in configs:
 			for objtype in objtypes:
-				model = importlib.import_module(model_name)
+				model = load_model(model_name)
 				pattern = importlib.import_module(pattern_name) if pattern_name else None
 
 				types[objtype] = model, pattern
 
+		changed = { objtype: model for objtype, (model, pattern) in types.iteritems() if objtype in classes and classes[objtype] is not model.CacheModel }
+
+		for model in set(model for model, pattern in types.itervalues()):
+			warm = getattr(model, "warm", None)
+			if warm:
+				warm()
+
 		self.types = types
 
+		if changed:
+			self.version += 1
+			log.info("registry version %d: model changed for object types %s", self.version, " ".join(sorted(changed)))
+
+		return changed
+
 	def get_model_and_pattern(self, objkey):
 		""" @type  objkey: str
 		    @rtype         module, module | None
@@ -71,6 +101,91 @@ class Registry(object):
 		tokens = objkey.split("_", 1)
 		return tokens[0]
 
+_configured_models = {}
+
+def load_model(name):
+	""" Import a model module.  The name may be followed by a colon and
+	    options, which are passed to the configure function of the module;
+	    it returns an object with CacheModel and TimelineModel attributes.
+
+	    @type  name: str
+	    @rtype       module | object
+	"""
+	module_name, sep, options = name.partition(":")
+	module = importlib.import_module(module_name)
+
+	if not sep:
+		return module
+
+	model = _configured_models.get(name)
+	if model is None:
+		model = module.configure(options)
+		_configured_models[name] = model
+
+	return model
+
+def reload_models(names):
+	""" Reload the modules of previously imported models.
+
+	    @type names: iterable(str)
+	"""
+	module_names = set(name.partition(":")[0] for name in names)
+
+	for module_name in module_names:
+		module = sys.modules.get(module_name)
+		if module:
+			reload(module)
+
+	for name in _configured_models.keys():
+		if name.partition(":")[0] in module_names:
+			del _configured_models[name]
+
+def convert_model(modeldata, model):
+	""" Convert model data of another (or an earlier version of the same)
+	    model.  Data of a reloaded model is round-tripped through its
+	    serializer, and data of another model is passed to the convert method
+	    of the model.  If the model doesn't support the conversion, or it
+	    fails, the data is kept as it is.
+
+	    @type  modeldata: CacheModel
+	    @type  model:     module
+	    @rtype            CacheModel
+	"""
+	cls = model.CacheModel
+	source = model_class_name(type(modeldata))
+	target = model_class_name(cls)
+
+	try:
+		if source == target:
+			dumps = getattr(modeldata, "dumps", None)
+			data = dumps() if dumps else None
+			if data is not None:
+				return cls.loads(data)
+			else:
+				return pickle.loads(pickle.dumps(modeldata, pickle.HIGHEST_PROTOCOL))
+
+		converted = cls.convert(modeldata)
+		if converted is not None:
+			return converted
+
+		error = "conversion not supported"
+	except Exception as e:
+		error = repr(e)
+
+	if (source, target) not in _conversion_errors:
+		_conversion_errors.add((source, target))
+		log.error("model data of %s not converted to %s: %s", source, target, error)
+
+	return modeldata
+
+_conversion_errors = set()
+
+def model_class_name(cls):
+	""" @type  cls: type
+	    @rtype      str
+	"""
+	return getattr(cls, "model_name", None) or cls.__module__
+
 class IntervalProxy(object):
 	__class = None
 
@@ -84,6 +199,6 @@ class IntervalProxy(object):
 		return self.__get_class()(*args, **kwargs)
 
 	def __getattr__(self, name):
-		return getattr(self.__get_class())
+		return getattr(self.__get_class(), name)
 
 interval_type = IntervalProxy()
@@ -1,32 +1,51 @@
 from __future__ import absolute_import
 
+import threading
+import time
+
+from . import aggregate
 from . import eventlog
+from . import gctuning
+from . import metrics
+from . import query
 from . import util
 from .cache import Cache
 from .config import argument_parser, configure, log, reconfigure
 from .registry import Registry
+from .site import Site
 
 class Service(object):
 
-	def __init__(self, lock_type):
+	def __init__(self, lock_type, threaded=True):
+		""" @type lock_type: type
+		    @type threaded:  bool
+		"""
 		self.registry = Registry()
 		self.cache = Cache(lock_type)
+		self.threaded = threaded
 
 	def __enter__(self):
 		return self
 
 	def __exit__(self, *exc):
-		# force cache backup for current snapshot time
-		self.flush(force_backup=True)
+		try:
+			# force cache backup for current snapshot time
+			self.flush(force_backup=True)
+		finally:
+			self.cache.close()
 
 	def init(self):
 		self.cache.init()
 
+		# the loaded backups stay in memory for the lifetime of the slots
+		gctuning.manager.freeze("load")
+
 	def add(self, site, objkeys, data):
 		""" @type site:    str
 		    @type objkeys: list(str)
 		    @type data:    str
 		"""
+		start_time = time.time()
 		evlog_error = eventlog.ERROR_OTHER
 		evlog_size = 0
 		evlog_count = 0
@@ -41,12 +60,22 @@ class Service(object):
 			evlog_error = 0
 		finally:
 			eventlog.logger.add(site, evlog_error, evlog_size, evlog_count)
+			self.record("add", site, start_time, evlog_error, evlog_count)
 
-	def get(self, site, objkeys):
-		""" @type  site:    str
+	def get(self, site, objkeys, stored=False, start=0, end=0, count=0):
+		""" Get objects' data, optionally limited to the slots which overlap
+		    the [start, end) time range (unix time, 0 means unbounded) and to
+		    the latest count slots (0 means unlimited).
+
+		    @type  site:    str
 		    @type  objkeys: list(str)
+		    @type  stored:  bool
+		    @type  start:   int
+		    @type  end:     int
+		    @type  count:   int
 		    @rtype          str
 		"""
+		start_time = time.time()
 		evlog_error = eventlog.ERROR_OTHER
 		evlog_size = 0
 		evlog_count = 0
@@ -54,11 +83,14 @@ class Service(object):
 		try:
 			evlog_count = len(objkeys)
 
-			data = self.cache.get(site, objkeys)
+			range = make_range(site, start, end, count)
+			data = self.cache.get(site, objkeys, stored, range)
 
 			evlog_size = len(data)
 			evlog_error = 0
 		finally:
+			self.record("get", site, start_time, evlog_error, evlog_count)
+
 			# XXX: quick hack
 			if evlog_count > 255:
 				evlog_count = 255
@@ -67,27 +99,158 @@ class Service(object):
 
 		return data
 
+	def record(self, name, site, start_time, error, count):
+		""" Update the request metrics.
+
+		    @type name:       str
+		    @type site:       str
+		    @type start_time: float
+		    @type error:      int
+		    @type count:      int
+		"""
+		registry = metrics.registry
+		registry.observe("service.%s.seconds" % name, None, start_time)
+
+		# don't create metrics for bogus site names
+		if site in self.cache.sitecaches:
+			registry.counter("service.%s.requests" % name, site).inc()
+			registry.counter("service.%s.keys" % name, site).inc(count)
+
+			if error:
+				registry.counter("service.%s.errors" % name, site).inc()
+
+	def scan(self, site, objtype, prefix="", cursor="", limit=0):
+		""" List the keys of an object type (optionally only those which
+		    start with prefix) in the cached slots.  Returns a JSON object
+		    with the keys and a cursor for continuing the listing (empty at
+		    the end).
+
+		    @type  site:    str
+		    @type  objtype: str
+		    @type  prefix:  str
+		    @type  cursor:  str
+		    @type  limit:   int
+		    @rtype          str
+		"""
+		return self.cache.scan(site, objtype, prefix, cursor, limit or 1000)
+
+	def aggregate(self, site, operation, objkeys, prefix="", item="", limit=0, start=0, end=0):
+		""" Aggregate the data of the listed objects, or the objects whose
+		    keys start with prefix (if it's not empty), per cached slot.  See
+		    the aggregate module for the operations; item and limit are
+		    operation-specific.  The slots may be limited to the [start, end)
+		    time range like with get.
+
+		    @type  site:      str
+		    @type  operation: str
+		    @type  objkeys:   list(str)
+		    @type  prefix:    str
+		    @type  item:      str
+		    @type  limit:     int
+		    @type  start:     int
+		    @type  end:       int
+		    @rtype            str
+		"""
+		def make_aggregator():
+			return aggregate.make_aggregator(operation, item, limit)
+
+		make_aggregator()  # validate parameters
+
+		if prefix:
+			objkeys = None
+		else:
+			prefix = None
+
+		return self.cache.aggregate(site, objkeys, prefix, make_aggregator, make_range(site, start, end))
+
+	def top(self, site, objtype, item, limit=0, start=0, end=0):
+		""" The objects with the largest totals of an item per cached slot,
+		    tracked without going through the cached data.  The slots may be
+		    limited to the [start, end) time range like with get.
+
+		    @type  site:    str
+		    @type  objtype: str
+		    @type  item:    str
+		    @type  limit:   int
+		    @type  start:   int
+		    @type  end:     int
+		    @rtype          str
+		"""
+		return self.cache.top(site, objtype, item, limit or 10, make_range(site, start, end))
+
 	def reconfigure(self):
 		util.safe(reconfigure, error="reconfiguration failed")
-		util.safe(self.registry.reconfigure, error="registry reconfiguration failed")
+		util.safe(gctuning.manager.configure, error="gc reconfiguration failed")
+
+		models = util.safe(self.registry.reconfigure, error="registry reconfiguration failed")
+		if models:
+			self.migrate(models)
+
+	def migrate(self, models):
+		""" Convert the cached data of object types whose model has changed,
+		    in a background thread if the service is threaded.  Adds convert
+		    the data of the objects they touch in the meantime.  The
+		    migration is abandoned if the registry changes again.
+
+		    @type models: dict(str, module)
+		"""
+		version = self.registry.version
+
+		def proceed():
+			return self.registry.version == version
+
+		def migrate():
+			util.safe(self.cache.migrate, (models, proceed), error="model migration failed")
+
+		if self.threaded:
+			thread = threading.Thread(target=migrate, name="migrate-%d" % version)
+			thread.daemon = True
+			thread.start()
+		else:
+			migrate()
 
 	def flush(self, *args, **kwargs):
-		self.cache.flush(*args, **kwargs)
+		rotated = self.cache.flush(*args, **kwargs)
+		gctuning.manager.flushed(rotated)
+
+def make_range(sitename, start=0, end=0, count=0):
+	""" @type  sitename: str
+	    @type  start:    int
+	    @type  end:      int
+	    @type  count:    int
+	    @rtype           query.Range | NoneType
+	"""
+	if not (start or end or count):
+		return None
+
+	site = Site(sitename)
+
+	return query.Range(
+		site.from_timestamp(start) if start else None,
+		site.from_timestamp(end) if end else None,
+		count or None,
+	)
 
 class Main(object):
 
-	def __init__(self, args, lock_type):
+	def __init__(self, args, lock_type, threaded=True):
 		parser = argument_parser()
 		parser.parse_args(args)
 
 		configure("service")
+		eventlog.configure()
+		metrics.start_server()
+		gctuning.manager.configure()
 
-		self.service = Service(lock_type)
+		self.service = Service(lock_type, threaded)
 
 	def __enter__(self):
 		return self.service.__enter__()
 
 	def __exit__(self, *exc):
-		self.service.__exit__(*exc)
+		try:
+			self.service.__exit__(*exc)
+		finally:
+			eventlog.close()
 
 		log.info("exit")
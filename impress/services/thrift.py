@@ -25,7 +25,9 @@ import thrift.transport.TTransport as thrifttransport
 import impress_thrift.ImpressCache as thriftapi
 
 from .. import eventlog
+from .. import metrics
 from .. import util
+from ..profiling import profiler
 from ..config import conf, log
 from ..service import Main
 
@@ -45,10 +47,10 @@ def main(args):
 
 		# threads
 
-		addqueue_thread = threading.Thread(target=addqueue.process)
+		addqueue_thread = threading.Thread(target=addqueue.process, name="addqueue")
 		addqueue_thread.daemon = True
 
-		service_thread = threading.Thread(target=server.serve)
+		service_thread = threading.Thread(target=server.serve, name="thrift")
 		service_thread.daemon = True
 
 		try:
@@ -92,12 +94,14 @@ class AddQueue(object):
 		self.queue = queue.Queue()
 		self.closed = False
 
+		metrics.registry.gauge("addqueue.size", self.queue.qsize)
+
 	def put(self, args):
 		""" Append ImpressCache.add parameter tuple to the queue
 		    (unless the queue is closed).
 		"""
 		if not self.closed:
-			self.queue.put(args)
+			self.queue.put((time.time(), args))
 
 	def close(self):
 		""" Closes the queue and blocks until the pending entries have
@@ -109,8 +113,11 @@ class AddQueue(object):
 	def process(self):
 		""" Process the queue forever.
 		"""
+		wait = metrics.registry.histogram("addqueue.wait.seconds")
+
 		while True:
-			args = self.queue.get()
+			put_time, args = self.queue.get()
+			wait.observe(time.time() - put_time)
 			try:
 				self.service.add(*args)
 			except:
@@ -118,6 +125,9 @@ class AddQueue(object):
 			finally:
 				self.queue.task_done()
 
+def read_only(value):
+	raise ValueError("Read-only option")
+
 class Interface(thriftapi.Iface):
 	""" Implements the ImpressCache Thrift API.
 	"""
@@ -135,6 +145,15 @@ class Interface(thriftapi.Iface):
 	def get(self, *args):
 		return self.service.get(*args)
 
+	def scan(self, *args):
+		return self.service.scan(*args)
+
+	def aggregate(self, *args):
+		return self.service.aggregate(*args)
+
+	def top(self, *args):
+		return self.service.top(*args)
+
 	def aliveSince(self):
 		return long(self.start_time)
 
@@ -147,10 +166,16 @@ class Interface(thriftapi.Iface):
 	}
 
 	def getCounter(self, key):
-		return self.counters[key]()
+		getter = self.counters.get(key)
+		if getter:
+			return getter()
+		else:
+			return metrics.registry.counters()[key]
 
 	def getCounters(self):
-		return { key: getter() for key, getter in self.counters.iteritems() }
+		counters = metrics.registry.counters()
+		counters.update((key, getter()) for key, getter in self.counters.iteritems())
+		return counters
 
 	options = {
 		"log.level": (
@@ -173,6 +198,22 @@ class Interface(thriftapi.Iface):
 			lambda value: gc.set_threshold(*[int(x) for x in value.split()]),
 			lambda: " ".join(str(x) for x in gc.get_threshold()),
 		),
+		"profile.sampler": (
+			profiler.set_sampler,  # start | stop
+			profiler.get_sampler,
+		),
+		"profile.tracer": (
+			profiler.set_tracer,   # start | stop
+			profiler.get_tracer,
+		),
+		"profile.interval": (
+			profiler.set_interval, # seconds
+			lambda: str(profiler.get_interval()),
+		),
+		"profile.output": (
+			read_only,             # configuration only
+			profiler.get_output,
+		),
 		"signal.raise": (
 			lambda value: os.kill(os.getpid(), getattr(signal, value)) if value.startswith("SIG") else (lambda: None)(),
 			lambda: "",
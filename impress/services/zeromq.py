@@ -24,7 +24,7 @@ class NoLock(object):
 def main(args):
 	signal_fd = signalfd.init()
 
-	with Main(args, NoLock) as service:
+	with Main(args, NoLock, threaded=False) as service:
 		try:
 			context = zmq.Context()
 
@@ -33,11 +33,20 @@ def main(args):
 				socket.bind(conf.get("zeromq", "bind"))
 				socket.setsockopt(zmq.SUBSCRIBE, b"")
 
+				get_bind = conf.get("zeromq", "get_bind", None)
+				if get_bind:
+					get_socket = context.socket(zmq.REP)
+					get_socket.bind(get_bind)
+				else:
+					get_socket = None
+
 				service.init()
 
 				poller = zmq.Poller()
 				poller.register(socket, zmq.POLLIN)
 				poller.register(signal_fd, zmq.POLLIN)
+				if get_socket:
+					poller.register(get_socket, zmq.POLLIN)
 
 				try:
 					flush_interval = conf.getint("backup", "interval")
@@ -53,6 +62,8 @@ def main(args):
 								if mask & zmq.POLLIN:
 									if x == socket:
 										handle_add(service, socket)
+									elif x == get_socket:
+										handle_get(service, get_socket)
 									elif x == signal_fd:
 										if handle_signal(service):
 											return
@@ -61,6 +72,8 @@ def main(args):
 							flush_time = time.time()
 				finally:
 					socket.close()
+					if get_socket:
+						get_socket.close()
 			finally:
 				context.term()
 		except:
@@ -74,6 +87,24 @@ def handle_add(service, socket):
 		log.exception("service add")
 		eventlog.logger.service_error(eventlog.ERROR_OTHER)
 
+def handle_get(service, socket):
+	""" Request: SITE OBJKEYS [OPTIONS], where OBJKEYS is a JSON list and
+	    OPTIONS is a JSON object with optional stored, start, end and count
+	    keys (see Service.get).  Reply: JSON object, or an empty string on
+	    error.
+	"""
+	try:
+		tokens = socket.recv().split(None, 2)
+		sitename, objkeys = tokens[:2]
+		options = json.loads(tokens[2]) if len(tokens) > 2 else {}
+		reply = service.get(sitename, json.loads(objkeys), **{ str(k): v for k, v in options.iteritems() })
+	except:
+		log.exception("service get")
+		eventlog.logger.service_error(eventlog.ERROR_OTHER)
+		reply = ""
+
+	socket.send(reply)
+
 def handle_signal(service):
 	num = signalfd.read()
 
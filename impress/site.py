@@ -31,3 +31,11 @@ class Site(object):
 
 	def current_datetime(self):
 		return datetime.datetime.today() + self.offset
+
+	def from_timestamp(self, timestamp):
+		""" Convert unix time to the site's local time.
+
+		    @type  timestamp: int | float
+		    @rtype            datetime.datetime
+		"""
+		return datetime.datetime.fromtimestamp(timestamp) + self.offset
@@ -4,12 +4,18 @@
 from __future__ import absolute_import
 
 import cPickle as pickle
+import os
+import threading
 import time
 
 import boto.dynamodb
+from boto.dynamodb.types import Binary
 
+from . import compression
 from . import eventlog
 from . import json
+from . import metrics
+from . import transport
 from .backup import BackupData
 from .config import conf, log
 from .site import Site
@@ -21,8 +27,98 @@ CACHE_BACKUP_SLOTKEY   = "backup"
 
 AVAIL_MARKER_OBJKEY    = INTERNAL_OBJKEY_PREFIX + "avail"
 
+def connect():
+	""" @rtype boto.dynamodb.layer2.Layer2
+	"""
+	params = {}
+	for key in ["aws_access_key_id", "aws_secret_access_key"]:
+		value = conf.get("dynamodb", key, None)
+		if value is not None:
+			params[key] = value
+
+	return boto.dynamodb.connect_to_region(conf.get("dynamodb", "region"), **params)
+
+class PooledConnection(object):
+	""" Connection of a pool worker thread, with the tables it has
+	    described.
+	"""
+	def __init__(self):
+		self.conn = connect()
+		self.tables = {}
+
+	def get_table(self, name):
+		table = self.tables.get(name)
+		if table is None:
+			table = self.conn.get_table(name=name)
+			self.tables[name] = table
+
+		return table
+
+def is_throttled(error):
+	""" @type  error: Exception
+	    @rtype        bool
+	"""
+	return isinstance(error, boto.dynamodb.exceptions.DynamoDBThroughputExceededError)
+
+_pool = None
+_pool_lock = threading.Lock()
+
+_buckets = {}
+_buckets_pid = None
+
+_transport_warned = False
+
+def get_pool():
+	""" The pool of the current process, shared by all sites.
+
+	    @rtype transport.Pool
+	"""
+	global _pool
+
+	with _pool_lock:
+		if _pool is None or _pool.pid != os.getpid():
+			size = int(conf.get("dynamodb", "connections", "16"))
+
+			limiter = transport.Limiter(
+				int(conf.get("dynamodb", "concurrency", "4")),
+				int(conf.get("dynamodb", "max_concurrency", str(size))),
+			)
+
+			_pool = transport.Pool(size, limiter, PooledConnection, is_throttled, "dynamodb", int(conf.get("dynamodb", "retries", "5")))
+
+			metrics.registry.gauge("dynamodb.concurrency", lambda: int(limiter.limit))
+
+		return _pool
+
+def get_bucket(table_name):
+	""" Write rate limit of a table in the current process.  The
+	    write_rate option of the [dynamodb] section may be prefixed with the
+	    table name and a dot, to override the default for that table.  The
+	    rate learned from throttling persists across flushes only with the
+	    thread flush engine; a forked child starts from the parent's state.
+
+	    @type  table_name: str
+	    @rtype             transport.TokenBucket
+	"""
+	global _buckets_pid
+
+	with _pool_lock:
+		if _buckets_pid != os.getpid():
+			_buckets.clear()
+			_buckets_pid = os.getpid()
+
+		bucket = _buckets.get(table_name)
+		if bucket is None:
+			rate = float(conf.get("dynamodb", table_name + ".write_rate", conf.get("dynamodb", "write_rate", "0")))
+			bucket = transport.TokenBucket(rate)
+			_buckets[table_name] = bucket
+
+		return bucket
+
 class Storage(object):
-	""" DynamoDB abstraction.
+	""" DynamoDB abstraction.  Slots are stored with synchronous requests,
+	    or concurrently with the connection pool if the transport option
+	    of the [dynamodb] section is "pooled".
 	"""
 
 	def __init__(self, site):
@@ -30,15 +126,36 @@ class Storage(object):
 		"""
 		self.site = site
 
-		params = {}
-		for key in ["aws_access_key_id", "aws_secret_access_key"]:
-			value = conf.get("dynamodb", key, None)
-			if value is not None:
-				params[key] = value
-
-		self.__conn = boto.dynamodb.connect_to_region(conf.get("dynamodb", "region"), **params)
+		self.__conn = connect()
 		self.__table = None
 
+		self.transport = conf.get("dynamodb", "transport", "sync")
+		if self.transport not in ("sync", "pooled"):
+			raise ValueError("Bad DynamoDB transport: " + self.transport)
+
+		global _transport_warned
+
+		if self.transport == "pooled" and conf.get("backup", "engine", "fork") != "thread" and not _transport_warned:
+			# the flush children don't inherit the pool's threads
+			log.warning("pooled DynamoDB transport with the fork flush engine recreates the pool and its connections on every flush")
+			_transport_warned = True
+
+		self.retries = int(conf.get("dynamodb", "retries", "5"))
+		self.requeues = int(conf.get("dynamodb", "requeues", "3"))
+
+		self.codec = compression.get_codec(conf.get("dynamodb", "compression", "none"))
+		self.compression_minimum = int(conf.get("dynamodb", "compression_minimum", "1024"))
+
+		# effective write rate of the slot stores so far
+		items = metrics.registry.counter("dynamodb.write.items", site.name)
+		seconds = metrics.registry.counter("dynamodb.write.seconds", site.name)
+		metrics.registry.gauge("dynamodb.write.rate", lambda: items.value / seconds.value if seconds.value else 0.0, site.name)
+
+		# uncompressed and stored sizes of the values written by _insert
+		self.raw_size = 0
+		self.stored_size = 0
+		self.size_lock = threading.Lock()
+
 	@property
 	def table(self):
 		if not self.__table:
@@ -50,56 +167,239 @@ class Storage(object):
 		self.__conn.layer1.close()
 		self.__table = None
 
+	def record(self, operation, start_time, error):
+		""" Update the DynamoDB call metrics.
+
+		    @type operation:  str
+		    @type start_time: float
+		    @type error:      int
+		"""
+		registry = metrics.registry
+		registry.observe("dynamodb.%s.seconds" % operation, self.site.name, start_time)
+		registry.counter("dynamodb.%s.calls" % operation, self.site.name).inc()
+
+		if error:
+			registry.counter("dynamodb.%s.errors" % operation, self.site.name).inc()
+
 	def _get(self, objkey):
-		return self._make_row(
-			objkey,
-			self.table.query(
-				hash_key           = objkey,
-				consistent_read    = False,
-				scan_index_forward = False,
-			),
-		)
-
-	def insert(self, objkey, slotkey, values):
+		start_time = time.time()
+		error = eventlog.ERROR_DYNAMODB
+		try:
+			row = self._make_row(
+				objkey,
+				self.table.query(
+					hash_key           = objkey,
+					consistent_read    = False,
+					scan_index_forward = False,
+				),
+			)
+			error = 0
+		finally:
+			self.record("query", start_time, error)
+
+		return row
+
+	def get_slot(self, objkey, slotkey):
+		""" Get a single column of a single key.
+
+		    @type  objkey:  str
+		    @type  slotkey: str
+		    @rtype          dict | NoneType
+		"""
+		start_time = time.time()
+		error = eventlog.ERROR_DYNAMODB
+		try:
+			try:
+				item = self.table.get_item(
+					hash_key        = objkey,
+					range_key       = slotkey,
+					consistent_read = True,
+				)
+			except boto.dynamodb.exceptions.DynamoDBKeyNotFoundError:
+				item = None
+
+			error = 0
+		finally:
+			self.record("get", start_time, error)
+
+		if item is None:
+			return None
+
+		return self._make_row(objkey, [item]).slots[slotkey]
+
+	def insert(self, objkey, slotkey, values, table=None):
 		""" Insert a single column to single key, encoded as JSON.
 		    Does eventlogging.
 
 		    @type objkey:  str
 		    @type slotkey: str
 		    @type values:  dict
+		    @type table:   boto.dynamodb.table.Table | NoneType
 		"""
+		bucket = get_bucket(self.site.dynamodb_table_name)
+		bucket.acquire()
+
+		start_time = time.time()
 		evlog_error = eventlog.ERROR_DYNAMODB
+		evlog_size = 0
 		try:
-			self._insert(objkey, slotkey, values)
+			evlog_size = self._insert(objkey, slotkey, values, table)
 			evlog_error = 0
+		except boto.dynamodb.exceptions.DynamoDBThroughputExceededError:
+			bucket.throttled()
+			metrics.registry.counter("dynamodb.put.throttled", self.site.name).inc()
+			raise
+		else:
+			bucket.succeeded()
 		finally:
-			evlog_size = 0 # TODO
 			evlog_type = ord(objkey[0])
 			eventlog.logger.store(self.site.name, evlog_error, evlog_size, evlog_type)
+			self.record("put", start_time, evlog_error)
+
+	def insert_many(self, slotkey, records):
+		""" Insert a column to many keys.  Failures are logged.  Inserts
+		    which are still throttled after their retries are requeued after
+		    the others, a few times.  The written items and the elapsed time
+		    are counted for the effective write rate metric.
+
+		    @type  slotkey: str
+		    @type  records: iterable((str, dict))
+		    @rtype          int
+		    @return         the number of failed inserts
+		"""
+		start_time = time.time()
+		count = [0]
 
-	def _insert(self, objkey, slotkey, values):
-		""" Insert columns to a single key.  Values are encoded as
-		    JSON.  This is a low-level interface without eventlogging.
+		def counted(records):
+			for record in records:
+				count[0] += 1
+				yield record
 
-		    @type objkey: str
-		    @type slots:  dict
+		records = counted(records)
+		errors = 0
+
+		for attempt in xrange(self.requeues + 1):
+			if attempt:
+				log.warning("site %s slot %s: requeuing %d throttled inserts", self.site, slotkey, len(records))
+				metrics.registry.counter("dynamodb.put.requeued", self.site.name).inc(len(records))
+				time.sleep(transport.backoff(attempt, 1.0, 30.0))
+
+			if self.transport == "sync":
+				failed, records = self.insert_sync(slotkey, records)
+			else:
+				failed, records = self.insert_pooled(slotkey, records)
+
+			errors += failed
+
+			if not records:
+				break
+		else:
+			log.error("site %s slot %s: %d inserts throttled too many times", self.site, slotkey, len(records))
+			errors += len(records)
+
+		# counters are merged from the flush children (gauges aren't)
+		metrics.registry.counter("dynamodb.write.items", self.site.name).inc(count[0] - errors)
+		metrics.registry.counter("dynamodb.write.seconds", self.site.name).inc(time.time() - start_time)
+
+		return errors
+
+	def insert_sync(self, slotkey, records):
+		""" @type  slotkey: str
+		    @type  records: iterable((str, dict))
+		    @rtype          (int, list((str, dict)))
+		    @return         the number of failed inserts and the throttled
+		                    records
+		"""
+		errors = 0
+		throttled = []
+
+		for objkey, values in records:
+			for attempt in xrange(self.retries):
+				try:
+					self.insert(objkey, slotkey, values)
+					break
+				except boto.dynamodb.exceptions.DynamoDBThroughputExceededError:
+					if attempt == self.retries - 1:
+						throttled.append((objkey, values))
+					else:
+						time.sleep(transport.backoff(attempt))
+				except:
+					log.exception("site %s object %s slot %s insert failed", self.site, objkey, slotkey)
+					errors += 1
+					break
+
+		return errors, throttled
+
+	def insert_pooled(self, slotkey, records):
+		""" @type  slotkey: str
+		    @type  records: iterable((str, dict))
+		    @rtype          (int, list((str, dict)))
+		"""
+		pool = get_pool()
+		batch = transport.Batch()
+
+		for objkey, values in records:
+			error = "site %s object %s slot %s insert failed" % (self.site, objkey, slotkey)
+			pool.submit(batch, self.pooled_insert, (objkey, slotkey, values), error)
+
+		errors = batch.wait()
+
+		return errors, [(objkey, values) for objkey, _, values in batch.requeued]
+
+	def pooled_insert(self, connection, objkey, slotkey, values):
+		""" @type connection: PooledConnection
+		"""
+		self.insert(objkey, slotkey, values, connection.get_table(self.site.dynamodb_table_name))
+
+	def _insert(self, objkey, slotkey, values, table=None):
+		""" Insert columns to a single key.  Values are encoded as
+		    JSON, and large ones are compressed to binary.  This is a
+		    low-level interface without eventlogging.  Returns the
+		    approximate stored size.
+
+		    @type  objkey:  str
+		    @type  slotkey: str
+		    @type  values:  dict
+		    @type  table:   boto.dynamodb.table.Table | NoneType
+		    @rtype          int
 		"""
-		item = self.table.new_item(objkey, slotkey)
+		item = (table or self.table).new_item(objkey, slotkey)
+		raw_size = 0
+		stored_size = 0
 
 		for k, v in values.iteritems():
-			if not isinstance(v, (int, long, float)):
+			if isinstance(v, (int, long, float)):
+				size = 8
+				raw_size += size
+			else:
 				v = json.dumps(v)
+				size = len(v)
+				raw_size += size
+
+				if size >= self.compression_minimum:
+					data = compression.compress(v, self.codec, self.compression_minimum)
+					if not data.startswith(compression.NONE.prefix):
+						v = Binary(data)
+						size = len(data)
 
 			item[k] = v
+			stored_size += len(k) + size
 
 		item.put()
 
+		with self.size_lock:
+			self.raw_size += raw_size
+			self.stored_size += stored_size
+
+		return stored_size
+
 	def insert_avail_marker(self, slotkey, count, errors, downtime):
 		""" @type slotkey:  str
 		    @type count:    int
 		    @type errors:   int
 		    @type downtime: datetime.timedelta | NoneType
 		"""
+		start_time = time.time()
 		evlog_error = eventlog.ERROR_DYNAMODB
 		try:
 			item = self.table.new_item(AVAIL_MARKER_OBJKEY, slotkey)
@@ -113,6 +413,7 @@ class Storage(object):
 			evlog_error = 0
 		finally:
 			eventlog.logger.avail_marker(self.site.name, evlog_error)
+			self.record("put", start_time, evlog_error)
 
 	def _replace(self, objkey, slots):
 		""" Remove all columns of a single key.  This is a low-level
@@ -170,18 +471,28 @@ class Storage(object):
 	def insert_cache_backup(self, backup):
 		""" @type backup: NewBackup
 		"""
-		data = backup.dumps()
+		raw = backup.dumps()
 
+		# the records of a backup may have been compressed already
+		if backup.codec is compression.NONE:
+			data = compression.compress(raw, self.codec)
+		else:
+			data = compression.compress(raw, compression.NONE)
+
+		log.debug("site %s cache backup size %d bytes (compression ratio %s)", self.site, len(data), compression.ratio(len(raw), len(data)))
+
+		start_time = time.time()
 		evlog_error = eventlog.ERROR_DYNAMODB
 		try:
 			item = self.table.new_item(CACHE_BACKUP_OBJKEY, CACHE_BACKUP_SLOTKEY)
-			item["data"] = data
+			item["data"] = Binary(data)
 			item["time"] = time.time()
 			item.put()
 
 			evlog_error = 0
 		finally:
 			eventlog.logger.cache_backup(self.site.name, evlog_error, len(data), False)
+			self.record("put", start_time, evlog_error)
 
 	def get_cache_backup(self):
 		""" @rtype BackupData | NoneType
@@ -192,10 +503,20 @@ class Storage(object):
 				range_key       = CACHE_BACKUP_SLOTKEY,
 				consistent_read = False,
 			)
-			return BackupData(item["data"].encode("ascii"), item["time"])
 		except boto.dynamodb.exceptions.DynamoDBKeyNotFoundError:
 			return None
 
+		data = item["data"]
+		if isinstance(data, Binary):
+			stored_size = len(data.value)
+			data = compression.decompress(data.value)
+		else:
+			# pickled backups (versions 1-3) were stored as strings
+			data = data.encode("ascii")
+			stored_size = len(data)
+
+		return BackupData(data, item["time"], stored_size)
+
 	def _make_row(self, objkey, items):
 		slots = {}
 
@@ -204,7 +525,12 @@ class Storage(object):
 
 			for k, v in item.iteritems():
 				if k not in (item._hash_key_name, item._range_key_name):
-					values[k] = json.loads(v)
+					if isinstance(v, Binary):
+						v = json.loads(compression.decompress(v.value))
+					elif not isinstance(v, (int, long, float)):
+						v = json.loads(v)
+
+					values[k] = v
 
 			slots[item.range_key] = values
 
@@ -8,6 +8,7 @@ from .config import log
 from .registry import interval_type
 
 class ModelSlot(object):
+	__slots__ = ["interval", "modeldata"]
 
 	def __init__(self, interval, model, items=None):
 		""" @type interval: Interval
@@ -20,23 +21,27 @@ class ModelSlot(object):
 	def __str__(self):
 		return str(self.interval)
 
+	@property
+	def key(self):
+		return self.interval.key
+
 	def __eq__(self, other):
-		return self.interval == other.interval
+		return self.interval.order == other.interval.order
 
 	def __ne__(self, other):
-		return self.interval != other.interval
+		return self.interval.order != other.interval.order
 
 	def __lt__(self, other):
-		return self.interval < other.interval
+		return self.interval.order < other.interval.order
 
 	def __gt__(self, other):
-		return self.interval > other.interval
+		return self.interval.order > other.interval.order
 
 	def __le__(self, other):
-		return self.interval <= other.interval
+		return self.interval.order <= other.interval.order
 
 	def __ge__(self, other):
-		return self.interval >= other.interval
+		return self.interval.order >= other.interval.order
 
 	def overlaps(self, other):
 		""" @type  second: Interval
@@ -76,6 +81,7 @@ class Timeline(object):
 		self.objkey = objkey
 		self.model = model
 		self.slots = []
+		self.orders = []  # interval orders of slots, for fast bisection
 		self.updated = []
 		self.removed = []
 
@@ -85,6 +91,9 @@ class Timeline(object):
 	def warning(self, format, *args):
 		log.warning("site %s key %s: " + format, self.site, self.objkey, *args)
 
+	def error(self, format, *args):
+		log.error("site %s key %s: " + format, self.site, self.objkey, *args)
+
 	def modified(self):
 		""" @rtype bool
 		"""
@@ -95,7 +104,7 @@ class Timeline(object):
 		    @type items: dict | list
 		"""
 		slot = ModelSlot(interval_type.parse(key), self.model, items)
-		i = bisect_left(self.slots, slot)
+		i = bisect_left(self.orders, slot.interval.order)
 
 		if i < len(self.slots) and self.slots[i] == slot:
 			self.error("duplicate slot %s", slot)
@@ -125,6 +134,7 @@ class Timeline(object):
 					assert False
 
 		self.slots.insert(i, slot)
+		self.orders.insert(i, slot.interval.order)
 
 	def prepare(self):
 		self.model.TimelineModel.prepare(self.slots)
@@ -132,7 +142,19 @@ class Timeline(object):
 	def start(self):
 		""" @rtype datetime.datetime
 		"""
-		return self.slots[0].start
+		return self.slots[0].interval.start
+
+	def covered(self, start, delta):
+		""" Whether a longer slot contains the interval.
+
+		    @type  start: datetime.datetime
+		    @type  delta: datetime.timedelta
+		    @rtype        bool
+		"""
+		interval = interval_type(start, delta)
+		i = bisect_left(self.orders, interval.order)
+
+		return i > 0 and self.slots[i - 1].interval.end >= interval.end
 
 	def merge(self, start, delta):
 		""" @type start: datetime.datetime
@@ -142,7 +164,7 @@ class Timeline(object):
 
 		merged = []
 
-		i = bisect_left(self.slots, slot)
+		i = bisect_left(self.orders, slot.interval.order)
 
 		if i > 0:
 			left = self.slots[i - 1]
@@ -182,12 +204,18 @@ class Timeline(object):
 			j = i + len(merged)
 			removed = self.slots[i:j]
 			self.slots[i:j] = [slot]
+			self.orders[i:j] = [slot.interval.order]
 
 			if slot in removed:
 				self.warning("updating slot %s", slot)
 				removed.remove(slot)
 				assert removed
 
+			# slots created by an earlier merge are superseded
+			if self.updated:
+				orders = set(s.interval.order for s in removed)
+				self.updated = [s for s in self.updated if s.interval.order not in orders]
+
 			self.updated.append(slot)
 			self.removed.extend(removed)
 
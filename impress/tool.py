@@ -5,6 +5,8 @@ import datetime
 import json
 import sys
 
+from . import arena
+from . import compression
 from . import progress
 from .backup import BackupFile, NewBackup
 from .cache import Slot
@@ -16,12 +18,14 @@ def main(args):
 	parser = argument_parser()
 	subparsers = parser.add_subparsers()
 
+	InfoCommand(subparsers)
 	ExportCommand(subparsers)
 	ExportJsonCommand(subparsers)
 	ExportHistoryCommand(subparsers)
 	ExportObjectHistoryCommand(subparsers)
 	PrintObjectHistoryCommand(subparsers)
 	ConvertToJsonCommand(subparsers)
+	ArenaToJsonCommand(subparsers)
 	RestoreCommand(subparsers)
 	RestoreHistoryCommand(subparsers)
 	ResetCommand(subparsers)
@@ -47,9 +51,17 @@ class Command(object):
 
 class JsonMixin(object):
 
-	def dump_backup_as_json(self, backup):
+	type_arg = dict(name="--type", action="store")
+
+	def dump_backup_as_json(self, backup, objtype=None):
 		slot = Slot.load_backup(backup)
-		values = { slot.key: { objkey: modeldata.get() for objkey, modeldata in slot.cachedata.iteritems() } }
+
+		if objtype:
+			objects = { objkey: slot.cachedata.get(objkey).get() for objkey in slot.index.iterate(objtype) }
+		else:
+			objects = { objkey: modeldata.get() for objkey, modeldata in slot.cachedata.iteritems() }
+
+		values = { slot.key: objects }
 		json.dump(values, sys.stdout, indent=True)
 		print
 
@@ -62,6 +74,28 @@ class ForceMixin(object):
 			print >>sys.stderr, "You must specify --force if your heart is really in it."
 			sys.exit(1)
 
+class InfoCommand(Command):
+
+	name = "info"
+	help = "print information about the backup in DynamoDB"
+	args = [
+		dict(name="sitename", action="store"),
+	]
+
+	def __call__(self, args):
+		backup = Storage(Site(args.sitename)).get_cache_backup()
+		if not backup:
+			sys.exit(1)
+
+		values = backup.load()
+
+		print "Version:\t%s" % values["version"]
+		print "Start:\t%s" % values.get("interval_start", values.get("date"))
+		print "Keys:\t%d" % len(values["cachedata"])
+		print "Size:\t%d" % len(backup.data)
+		print "Stored size:\t%d" % backup.stored_size
+		print "Compression ratio:\t%s" % compression.ratio(len(backup.data), backup.stored_size)
+
 class ExportCommand(Command):
 
 	name = "export"
@@ -82,13 +116,14 @@ class ExportJsonCommand(Command, JsonMixin):
 	name = "export-json"
 	help = "load backup from DynamoDB and print it to stdout as JSON"
 	args = [
+		JsonMixin.type_arg,
 		dict(name="sitename", action="store"),
 	]
 
 	def __call__(self, args):
 		backup = Storage(Site(args.sitename)).get_cache_backup()
 		if backup:
-			self.dump_backup_as_json(backup)
+			self.dump_backup_as_json(backup, args.type)
 		else:
 			sys.exit(1)
 
@@ -165,12 +200,28 @@ class ConvertToJsonCommand(Command, JsonMixin):
 
 	name = "convert-to-json"
 	help = "load backup from FILE and print it to stdout as JSON"
+	args = [
+		JsonMixin.type_arg,
+		dict(name="filename", action="store")
+	]
+
+	def __call__(self, args):
+		self.dump_backup_as_json(BackupFile(args.filename), args.type)
+
+class ArenaToJsonCommand(Command):
+
+	name = "arena-to-json"
+	help = "read the active cache arena from FILE and print it to stdout as JSON"
 	args = [
 		dict(name="filename", action="store")
 	]
 
 	def __call__(self, args):
-		self.dump_backup_as_json(BackupFile(args.filename))
+		cachedata = arena.ArenaCacheData.open(args.filename)
+		objects = { objkey: modeldata.get() for objkey, modeldata in cachedata.iteritems() }
+
+		json.dump(objects, sys.stdout, indent=True)
+		print
 
 class RestoreCommand(Command, ForceMixin):
 
@@ -0,0 +1,191 @@
+""" Streaming heavy-hitter tracking.  The objects with the largest totals of
+    an item are tracked per slot with the Space-Saving algorithm, so that the
+    top objects can be queried without going through the cached data.
+"""
+
+from __future__ import absolute_import
+
+import heapq
+
+from .config import conf
+from .registry import Registry
+
+default_capacity = 1000
+
+numeric_types = int, long, float
+
+class SpaceSaving(object):
+	""" Approximate totals of the most significant keys, using a fixed number
+	    of counters.  A key which isn't tracked replaces the key with the
+	    smallest total, inheriting it as its error bound: the estimated total
+	    of a key is never less than the true total, and exceeds it by at most
+	    the error.
+	"""
+	def __init__(self, capacity):
+		""" @type capacity: int
+		"""
+		self.capacity = capacity
+		self.counters = {}
+		self.heap = None
+
+	def __getstate__(self):
+		return self.capacity, self.counters
+
+	def __setstate__(self, state):
+		self.capacity, self.counters = state
+		self.heap = None
+
+	def __len__(self):
+		return len(self.counters)
+
+	def add(self, key, value):
+		""" @type key:   str
+		    @type value: int | float
+		"""
+		counters = self.counters
+		counter = counters.get(key)
+
+		if counter is not None:
+			counter[0] += value
+		elif len(counters) < self.capacity:
+			counter = [value, 0]
+			counters[key] = counter
+		else:
+			minimum = self.__pop_minimum()
+			counter = [minimum + value, minimum]
+			counters[key] = counter
+
+		if len(counters) == self.capacity:
+			heap = self.heap
+			if heap is None:
+				self.__build_heap()
+			else:
+				heapq.heappush(heap, (counter[0], key))
+
+				# drop the stale entries now and then
+				if len(heap) > self.capacity * 4:
+					self.__build_heap()
+
+	def __build_heap(self):
+		self.heap = [(counter[0], key) for key, counter in self.counters.iteritems()]
+		heapq.heapify(self.heap)
+
+	def __pop_minimum(self):
+		""" Forget the key with the smallest total and return the total.  The
+		    heap may contain outdated entries of keys whose totals have since
+		    grown; they are skipped.
+		"""
+		if self.heap is None:
+			self.__build_heap()
+
+		heap = self.heap
+		counters = self.counters
+
+		while True:
+			total, key = heapq.heappop(heap)
+			counter = counters.get(key)
+			if counter is not None and counter[0] == total:
+				del counters[key]
+				return total
+
+	def top(self, limit):
+		""" @type  limit: int
+		    @rtype        list((str, int | float, int | float))
+		"""
+		items = heapq.nlargest(limit, self.counters.iteritems(), key=lambda item: item[1][0])
+		return [(key, total, error) for key, (total, error) in items]
+
+def parse_spec(spec):
+	""" Parse comma-separated "objtype:item [capacity]" entries.
+
+	    @type  spec: str
+	    @rtype       list((str, str, int))
+	"""
+	entries = []
+
+	for entry in spec.split(","):
+		tokens = entry.split()
+		if not tokens:
+			continue
+
+		if len(tokens) > 2 or tokens[0].count(":") != 1:
+			raise ValueError("Bad top-k entry: " + entry.strip())
+
+		objtype, item = tokens[0].split(":")
+		if not objtype or not item:
+			raise ValueError("Bad top-k entry: " + entry.strip())
+
+		capacity = int(tokens[1]) if len(tokens) > 1 else default_capacity
+		if capacity <= 0:
+			raise ValueError("Bad top-k capacity: " + entry.strip())
+
+		entries.append((objtype, item, capacity))
+
+	return entries
+
+def get_spec(site):
+	""" @type  site: Site
+	    @rtype       list((str, str, int))
+	"""
+	return parse_spec(conf.get("topk", site.name, ""))
+
+class Trackers(object):
+	""" The heavy-hitter trackers of a slot, per object type and item.
+	"""
+	def __init__(self, spec, previous=None):
+		""" Trackers of the previous instance are reused if their
+		    configuration hasn't changed.
+
+		    @type spec:     list((str, str, int))
+		    @type previous: Trackers | NoneType
+		"""
+		self.types = {}
+
+		for objtype, item, capacity in spec:
+			tracker = previous.get(objtype, item) if previous else None
+			if tracker is None or tracker.capacity != capacity:
+				tracker = SpaceSaving(capacity)
+
+			self.types.setdefault(objtype, {})[item] = tracker
+
+	def __nonzero__(self):
+		return bool(self.types)
+
+	def get(self, objtype, item):
+		""" @type  objtype: str
+		    @type  item:    str
+		    @rtype          SpaceSaving | NoneType
+		"""
+		items = self.types.get(objtype)
+		return items.get(item) if items else None
+
+	def add(self, objkeys, params):
+		""" Track the positive numeric items of the parameters.
+
+		    @type objkeys: list(str)
+		    @type params:  list | dict
+		"""
+		if not isinstance(params, dict):
+			return
+
+		for objkey in objkeys:
+			items = self.types.get(Registry.parse_object_type(objkey))
+			if not items:
+				continue
+
+			for item, tracker in items.iteritems():
+				value = params.get(item)
+				if isinstance(value, numeric_types) and value > 0:
+					tracker.add(objkey, value)
+
+	def top(self, objtype, item, limit):
+		""" @type  objtype: str
+		    @type  item:    str
+		    @type  limit:   int
+		    @rtype          list((str, int | float, int | float)) | NoneType
+		"""
+		tracker = self.get(objtype, item)
+		if tracker is None:
+			return None
+
+		return tracker.top(limit)
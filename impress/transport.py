@@ -0,0 +1,237 @@
+""" Concurrent request execution for the storage layer.  A pool of worker
+    threads, each with its own keep-alive connection, executes requests with
+    many of them in flight.  The number of requests in flight is adapted to
+    throttling: it grows by one per window of successful requests, and it's
+    halved when a request is throttled (additive increase, multiplicative
+    decrease).
+
+    Writes are also paced by per-table token buckets, and throttled
+    requests are retried with exponential backoff and jitter.  Requests
+    which are still throttled after the retries are handed back to the
+    caller, so that they can be requeued.
+
+    Threads don't survive fork, so each process has its own pool (see
+    storage.get_pool).
+"""
+
+from __future__ import absolute_import
+
+import os
+import Queue as queue
+import random
+import threading
+import time
+
+from . import metrics
+from .config import log
+
+def backoff(attempt, base=0.05, cap=5.0):
+	""" Exponential backoff with full jitter.
+
+	    @type  attempt: int
+	    @type  base:    float
+	    @type  cap:     float
+	    @rtype          float
+	"""
+	return random.uniform(0, min(cap, base * 2 ** attempt))
+
+class TokenBucket(object):
+	""" Request rate limit.  The rate is halved when a request is
+	    throttled, and it recovers linearly to the configured maximum in
+	    about ten seconds.  A zero rate means unlimited.
+	"""
+	def __init__(self, rate, burst=None):
+		""" @type rate:  float
+		    @type burst: float | NoneType
+		"""
+		self.maximum = float(rate)
+		self.rate = float(rate)
+		self.burst = burst or max(1.0, self.rate)
+		self.tokens = self.burst
+		self.time = time.time()
+		self.lock = threading.Lock()
+
+	def acquire(self):
+		if not self.maximum:
+			return
+
+		while True:
+			with self.lock:
+				now = time.time()
+				self.tokens = min(self.burst, self.tokens + (now - self.time) * self.rate)
+				self.time = now
+
+				if self.tokens >= 1:
+					self.tokens -= 1
+					return
+
+				delay = (1 - self.tokens) / self.rate
+
+			time.sleep(delay)
+
+	def succeeded(self):
+		if self.maximum:
+			with self.lock:
+				self.rate = min(self.maximum, self.rate + self.maximum / (10 * self.rate))
+
+	def throttled(self):
+		if self.maximum:
+			with self.lock:
+				self.rate = max(self.maximum / 100, self.rate / 2)
+
+class Limiter(object):
+	""" Adaptive limit of requests in flight.
+	"""
+	def __init__(self, initial, maximum, minimum=1):
+		""" @type initial: int
+		    @type maximum: int
+		    @type minimum: int
+		"""
+		self.limit = float(initial)
+		self.maximum = maximum
+		self.minimum = minimum
+		self.inflight = 0
+		self.condition = threading.Condition()
+
+	def acquire(self):
+		with self.condition:
+			while self.inflight >= int(self.limit):
+				self.condition.wait()
+
+			self.inflight += 1
+
+	def release(self):
+		with self.condition:
+			self.inflight -= 1
+			self.condition.notify()
+
+	def succeeded(self):
+		with self.condition:
+			self.limit = min(self.maximum, self.limit + 1 / self.limit)
+			self.condition.notify()
+
+	def throttled(self):
+		with self.condition:
+			self.limit = max(self.minimum, self.limit / 2)
+
+class Batch(object):
+	""" Completion tracking of a group of requests.
+	"""
+	def __init__(self):
+		self.pending = 0
+		self.errors = 0
+		self.requeued = []
+		self.condition = threading.Condition()
+
+	def add(self):
+		with self.condition:
+			self.pending += 1
+
+	def done(self, error):
+		with self.condition:
+			self.pending -= 1
+			if error:
+				self.errors += 1
+			self.condition.notify_all()
+
+	def requeue(self, args):
+		""" @type args: tuple
+		"""
+		with self.condition:
+			self.requeued.append(args)
+
+	def wait(self):
+		""" @rtype int
+		    @return the number of failed requests (excluding the requeued
+		            ones)
+		"""
+		with self.condition:
+			while self.pending:
+				self.condition.wait()
+
+			return self.errors
+
+class Pool(object):
+
+	def __init__(self, size, limiter, connect, is_throttled, name="pool", retries=5):
+		""" @type size:         int
+		    @type limiter:      Limiter
+		    @type connect:      callable
+		    @type is_throttled: callable(Exception)
+		    @type name:         str
+		    @type retries:      int
+		"""
+		self.pid = os.getpid()
+		self.size = size
+		self.limiter = limiter
+		self.connect = connect
+		self.is_throttled = is_throttled
+		self.name = name
+		self.retries = retries
+		self.tasks = queue.Queue()
+		self.threads = []
+		self.lock = threading.Lock()
+
+	def submit(self, batch, func, args=(), error=None):
+		""" Execute func(connection, *args) in a worker thread.  Blocks
+		    while the limit of requests in flight has been reached.
+
+		    @type batch: Batch
+		    @type func:  callable
+		    @type args:  tuple
+		    @type error: str | NoneType
+		    @param error: log message if the request fails
+		"""
+		self.limiter.acquire()
+		batch.add()
+
+		self.start_thread()
+		self.tasks.put((batch, func, args, error))
+
+	def start_thread(self):
+		if len(self.threads) < self.size:
+			with self.lock:
+				if len(self.threads) < self.size:
+					thread = threading.Thread(target=self.run, name="%s-%d" % (self.name, len(self.threads)))
+					thread.daemon = True
+					thread.start()
+					self.threads.append(thread)
+
+	def run(self):
+		connection = None
+
+		while True:
+			batch, func, args, error = self.tasks.get()
+			failed = True
+
+			try:
+				if connection is None:
+					connection = self.connect()
+
+				self.execute(connection, func, args)
+				failed = False
+			except Exception as e:
+				if self.is_throttled(e):
+					batch.requeue(args)
+					failed = False
+				elif error:
+					log.exception(error)
+			finally:
+				self.limiter.release()
+				batch.done(failed)
+
+	def execute(self, connection, func, args):
+		for attempt in xrange(self.retries):
+			try:
+				func(connection, *args)
+				break
+			except Exception as e:
+				if not self.is_throttled(e) or attempt == self.retries - 1:
+					raise
+
+				self.limiter.throttled()
+				metrics.registry.counter(self.name + ".throttled").inc()
+
+				time.sleep(backoff(attempt))
+
+		self.limiter.succeeded()
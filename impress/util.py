@@ -2,8 +2,11 @@ from __future__ import absolute_import
 
 import os
 import sys
+import threading
 import time
 
+from . import eventlog
+from . import metrics
 from .config import log
 
 def safe(func, args=(), kwargs={}, default=None, error=None):
@@ -41,14 +44,25 @@ class timing(object):
 
 class Fork(object):
 	""" Context manager for forking a child process which terminates at the
-	    end of the context.
+	    end of the context.  The metrics updated by the child are merged
+	    when it's joined.
 	"""
 	def __init__(self):
 		sys.stderr.flush()
 		sys.stdout.flush()
 
+		self.metrics_fd, write_fd = os.pipe()
 		self.pid = os.fork()
 
+		if self.pid == 0:
+			os.close(self.metrics_fd)
+			self.metrics_fd = write_fd
+
+			eventlog.logger.forked()
+			metrics.registry.forked()
+		else:
+			os.close(write_fd)
+
 	def __enter__(self):
 		return self
 
@@ -68,6 +82,18 @@ class Fork(object):
 			else:
 				code = 0
 		finally:
+			try:
+				eventlog.logger.close()
+			except:
+				pass
+
+			try:
+				data = metrics.registry.dumps()
+				while data:
+					data = data[os.write(self.metrics_fd, data):]
+			except:
+				pass
+
 			try:
 				sys.stderr.flush()
 				sys.stdout.flush()
@@ -82,7 +108,21 @@ class Fork(object):
 	def join(self):
 		assert self.pid > 0
 
+		chunks = []
+		try:
+			while True:
+				chunk = os.read(self.metrics_fd, 65536)
+				if not chunk:
+					break
+				chunks.append(chunk)
+		finally:
+			os.close(self.metrics_fd)
+
 		pid, status = os.waitpid(self.pid, 0)
+
+		if chunks:
+			safe(metrics.registry.merge, ("".join(chunks),), error="child metrics")
+
 		if status:
 			raise self.Error(status)
 
@@ -90,6 +130,34 @@ class Fork(object):
 		def __init__(self, status):
 			super(Fork.Error, self).__init__(status)
 
+class Worker(object):
+	""" Runs a function in a background thread, as an alternative to Fork
+	    when the data it reads isn't modified concurrently.
+	"""
+	def __init__(self, func, args=(), name=None):
+		self.exc_info = None
+
+		self.thread = threading.Thread(target=self.run, args=(func, args), name=name)
+		self.thread.daemon = True
+		self.thread.start()
+
+	def run(self, func, args):
+		try:
+			func(*args)
+		except:
+			self.exc_info = sys.exc_info()
+			log.error("error in worker thread", exc_info=self.exc_info)
+
+	def join(self):
+		self.thread.join()
+
+		if self.exc_info:
+			raise self.Error(self.exc_info[1])
+
+	class Error(Exception):
+		def __init__(self, error):
+			super(Worker.Error, self).__init__(error)
+
 class Enum(object):
 
 	def __init__(self, **kwargs):
@@ -0,0 +1,272 @@
+""" Write-ahead log of the adds to the active cache, enabled by setting the
+    path option of the [wal] section.  A crash loses only the adds which
+    hadn't been written yet, instead of everything since the last backup.
+
+    Records are appended to an in-memory queue while the cache is locked,
+    and a writer thread writes them in batches (group commit).  Adds don't
+    wait for the writer, since the services have acknowledged them already.
+    The sync option selects when the file is fsync'ed:
+
+	always     after each batch; the adds which arrive during a sync are
+	           written and synced together as the next batch
+	interval   at most every sync_interval seconds
+	never      leave it to the operating system
+
+    The log is split into numbered segments.  A new segment is started when
+    the active cache is snapshotted for a backup, and the backup records
+    its number; the earlier segments are deleted when the backup has been
+    written.  On start, the segments from the number recorded in the loaded
+    backup on are replayed.
+"""
+
+from __future__ import absolute_import
+
+import glob
+import marshal
+import os
+import struct
+import threading
+import time
+import zlib
+
+from . import metrics
+from .config import conf, log
+
+_header = struct.Struct("<II")  # length, crc32
+
+sync_policies = "always", "interval", "never"
+
+class WriteAheadLog(object):
+
+	def __init__(self, path, sync="interval", sync_interval=1.0, site=None):
+		""" @type path:          str
+		    @type sync:          str
+		    @type sync_interval: float
+		    @type site:          str | NoneType
+		"""
+		if sync not in sync_policies:
+			raise ValueError("Bad write-ahead log sync policy: " + sync)
+
+		self.path = path
+		self.sync = sync
+		self.sync_interval = sync_interval
+		self.site = site
+
+		self.condition = threading.Condition()
+		self.pending = []  # records and segment numbers
+		self.closed = False
+		self.thread = None
+
+		segments = self.segments()
+		self.sequence = segments[-1][0] + 1 if segments else 1
+
+		self.fd = None
+		self.dirty = False
+		self.last_sync = time.time()
+
+	def segment_name(self, sequence):
+		return "%s.%016d" % (self.path, sequence)
+
+	def segments(self):
+		""" @rtype list((int, str))
+		"""
+		segments = []
+
+		for filename in glob.glob(self.path + ".*"):
+			suffix = filename[len(self.path) + 1:]
+			if suffix.isdigit():
+				segments.append((int(suffix), filename))
+
+		segments.sort()
+
+		return segments
+
+	def start(self):
+		self.open_segment(self.sequence)
+
+		self.thread = threading.Thread(target=self.run, name="wal")
+		self.thread.daemon = True
+		self.thread.start()
+
+	def append(self, objkeys, params, model_name):
+		""" @type objkeys:    list(str)
+		    @type params:     list | dict
+		    @type model_name: str
+		"""
+		data = marshal.dumps((time.time(), objkeys, params, model_name))
+		record = _header.pack(len(data), zlib.crc32(data) & 0xffffffff) + data
+
+		with self.condition:
+			self.pending.append(record)
+			self.condition.notify_all()
+
+	def rotate(self):
+		""" Start a new segment after the records appended so far.
+
+		    @rtype int
+		    @return the number of the new segment
+		"""
+		with self.condition:
+			self.sequence += 1
+			self.pending.append(self.sequence)
+			self.condition.notify_all()
+
+			return self.sequence
+
+	def truncate(self, sequence):
+		""" Delete the segments before the given one.
+
+		    @type sequence: int
+		"""
+		for number, filename in self.segments():
+			if number < sequence:
+				try:
+					os.unlink(filename)
+				except OSError as e:
+					log.warning("write-ahead log segment not deleted: %s", e)
+
+	def run(self):
+		while True:
+			with self.condition:
+				if not self.pending and not self.closed:
+					self.condition.wait(self.sync_interval if self.dirty else None)
+
+				batch = self.pending
+				self.pending = []
+				closed = self.closed
+
+			try:
+				self.write(batch)
+			except:
+				log.exception("write-ahead log writing failed")
+				metrics.registry.counter("wal.errors", self.site).inc()
+
+			if closed and not batch:
+				break
+
+	def write(self, batch):
+		""" @type batch: list(str | int)
+		"""
+		count = 0
+		chunks = []
+
+		for item in batch:
+			if isinstance(item, int):
+				self.write_chunks(chunks)
+				chunks = []
+
+				self.sync_segment()
+				os.close(self.fd)
+				self.open_segment(item)
+			else:
+				chunks.append(item)
+				count += 1
+
+		self.write_chunks(chunks)
+
+		if self.dirty:
+			if self.sync == "always" or (self.sync == "interval" and time.time() - self.last_sync >= self.sync_interval):
+				self.sync_segment()
+
+		if count:
+			metrics.registry.counter("wal.records", self.site).inc(count)
+			metrics.registry.counter("wal.batches", self.site).inc()
+
+	def write_chunks(self, chunks):
+		if not chunks:
+			return
+
+		data = "".join(chunks)
+		while data:
+			data = data[os.write(self.fd, data):]
+
+		self.dirty = True
+
+	def sync_segment(self):
+		if not self.dirty or self.sync == "never":
+			return
+
+		start_time = time.time()
+		os.fsync(self.fd)
+		metrics.registry.observe("wal.sync.seconds", self.site, start_time)
+
+		self.dirty = False
+		self.last_sync = time.time()
+
+	def open_segment(self, sequence):
+		self.fd = os.open(self.segment_name(sequence), os.O_WRONLY | os.O_APPEND | os.O_CREAT, 0644)
+
+	def close(self):
+		with self.condition:
+			self.closed = True
+			self.condition.notify_all()
+
+		if self.thread:
+			self.thread.join()
+			self.thread = None
+
+		if self.fd is not None:
+			self.sync_segment()
+			os.close(self.fd)
+			self.fd = None
+
+	def replay(self, sequence=None, after=None):
+		""" Iterate through the logged adds, from the given segment on, or
+		    newer than the given time.
+
+		    @type  sequence: int | NoneType
+		    @type  after:    float | NoneType
+		    @rtype           iterator((float, list(str), list | dict, str))
+		"""
+		for number, filename in self.segments():
+			if sequence is not None and number < sequence:
+				continue
+
+			for record in read_segment(filename):
+				if after is None or record[0] > after:
+					yield record
+
+def read_segment(filename):
+	""" Parse the records of a segment.  A torn record at the end (after a
+	    crash) ends the segment.
+
+	    @type  filename: str
+	    @rtype           iterator((float, list(str), list | dict, str))
+	"""
+	with open(filename, "rb") as file:
+		data = file.read()
+
+	offset = 0
+	end = len(data)
+
+	while offset < end:
+		if offset + _header.size > end:
+			log.warning("write-ahead log %s truncated at %d", filename, offset)
+			break
+
+		length, crc = _header.unpack_from(data, offset)
+		start = offset + _header.size
+		record = data[start:start + length]
+
+		if len(record) < length or zlib.crc32(record) & 0xffffffff != crc:
+			log.warning("write-ahead log %s corrupted at %d", filename, offset)
+			break
+
+		yield marshal.loads(record)
+
+		offset = start + length
+
+def open_log(site):
+	""" @type  site: Site
+	    @rtype       WriteAheadLog | NoneType
+	"""
+	path = conf.get("wal", "path", "")
+	if not path:
+		return None
+
+	return WriteAheadLog(
+		path.format(site=site),
+		conf.get("wal", "sync", "interval"),
+		float(conf.get("wal", "sync_interval", "1")),
+		site.name,
+	)
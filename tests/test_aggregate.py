@@ -0,0 +1,34 @@
+import unittest
+
+import impress.aggregate as impl
+
+data = [
+	("a_1", {"x": 1, "y": 10}),
+	("a_2", {"x": 5, "z": "text"}),
+	("a_3", {"x": 3, "y": 2}),
+]
+
+def run(operation, item="", limit=0):
+	aggregator = impl.make_aggregator(operation, item, limit)
+	for objkey, values in data:
+		aggregator.add(objkey, values)
+	return aggregator.result()
+
+class aggregate(unittest.TestCase):
+
+	def test_sum(self):
+		assert run("sum") == {"x": 9, "y": 12}
+
+	def test_top(self):
+		assert run("top", "x", 2) == [["a_2", 5], ["a_3", 3]]
+		assert run("top", "y") == [["a_1", 10], ["a_3", 2]]
+		assert run("top", "", 1) == [["a_1", 11]]
+
+	def test_group(self):
+		assert run("group") == {
+			"x": {"keys": 3, "sum": 9, "min": 1, "max": 5},
+			"y": {"keys": 2, "sum": 12, "min": 2, "max": 10},
+		}
+
+	def test_bad(self):
+		self.assertRaises(ValueError, impl.make_aggregator, "median", "", 0)
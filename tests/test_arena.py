@@ -0,0 +1,113 @@
+import copy
+import datetime
+import logging
+import os
+import shutil
+import tempfile
+import unittest
+
+import impress.arena as impl
+import impress.backup as backup
+import impress.config as config
+import impress.models.counters as counters
+import impress.registry as registry
+
+class Arena(unittest.TestCase):
+
+	def setUp(self):
+		config.log._impl = logging.getLogger("test")
+		self.model = registry.load_model("impress.models.packed:a,b")
+
+	def make(self, capacity=16, path=None):
+		return impl.ArenaCacheData(impl.Arena.create(capacity, 8, 4, path), path)
+
+	def test_add(self):
+		cachedata = self.make()
+
+		cachedata["x_1"] = self.model.CacheModel()
+		cachedata["x_1"].add({ "a": 1, "c": 5 }, datetime.timedelta())
+		cachedata["x_1"].add({ "a": 2, "b": 1 }, datetime.timedelta())
+
+		cachedata["x_2"] = self.model.CacheModel({ "b": 7 })
+
+		assert len(cachedata) == 2
+		assert "x_1" in cachedata
+		assert "x_3" not in cachedata
+		assert cachedata.get("x_3") is None
+		assert cachedata["x_1"].get() == { "a": 3, "b": 1 }
+		assert dict((k, v.get()) for k, v in cachedata.iteritems()) == { "x_1": { "a": 3, "b": 1 }, "x_2": { "b": 7 } }
+
+	def test_fallback(self):
+		cachedata = self.make(capacity=4)
+
+		# unpacked model
+		cachedata["x_1"] = counters.CacheModel({ "a": 1 })
+		# too long key
+		cachedata["x_123456789"] = self.model.CacheModel({ "a": 2 })
+
+		for i in xrange(4):
+			cachedata["y_%d" % i] = self.model.CacheModel({ "a": i })
+
+		assert cachedata.arena.count == 3
+		assert len(cachedata) == 6
+		assert isinstance(cachedata["x_1"], counters.CacheModel)
+		assert cachedata["x_123456789"].get() == { "a": 2 }
+		assert sorted(cachedata.keys()) == ["x_1", "x_123456789", "y_0", "y_1", "y_2", "y_3"]
+
+	def test_unicode_key(self):
+		cachedata = self.make()
+
+		cachedata[u"x_1"] = self.model.CacheModel({ "a": 1 })
+		cachedata[u"\xe4_1"] = self.model.CacheModel({ "a": 2 })
+		cachedata[u"\xe4_1"].add({ "a": 1 }, datetime.timedelta())
+
+		assert cachedata.arena.count == 2
+		assert "x_1" in cachedata
+		assert u"\xe4_1" in cachedata
+		assert cachedata["x_1"].get() == { "a": 1 }
+		assert cachedata["\xc3\xa4_1"].get() == { "a": 3 }
+		assert sorted(cachedata.keys()) == ["x_1", "\xc3\xa4_1"]
+
+	def test_replace(self):
+		cachedata = self.make()
+
+		cachedata["x_1"] = self.model.CacheModel({ "a": 1 })
+		cachedata["x_1"] = counters.CacheModel({ "a": 2 })
+
+		assert cachedata.arena.count == 0
+		assert cachedata["x_1"].get() == { "a": 2 }
+
+	def test_deepcopy(self):
+		cachedata = self.make()
+		cachedata["x_1"] = self.model.CacheModel({ "a": 1 })
+
+		clone = copy.deepcopy(cachedata)
+		clone["x_1"].add({ "a": 1 }, datetime.timedelta())
+
+		assert cachedata["x_1"].get() == { "a": 1 }
+		assert clone["x_1"].get() == { "a": 2 }
+
+	def test_backup(self):
+		cachedata = self.make()
+		cachedata["x_1"] = self.model.CacheModel({ "a": 1, "b": 2 })
+
+		data = backup.NewBackup({ "cachedata": cachedata }).dumps()
+		loaded = backup.BackupData(data, 0).load()["cachedata"]
+
+		assert loaded["x_1"].get() == { "a": 1, "b": 2 }
+
+	def test_open(self):
+		dirname = tempfile.mkdtemp()
+		try:
+			path = os.path.join(dirname, "arena")
+
+			cachedata = self.make(path=path)
+			cachedata["x_1"] = self.model.CacheModel({ "a": 1 })
+			cachedata.sync()
+
+			reader = impl.ArenaCacheData.open(path)
+
+			assert len(reader) == 1
+			assert reader["x_1"].get() == { "a": 1 }
+		finally:
+			shutil.rmtree(dirname)
@@ -0,0 +1,158 @@
+import copy
+import cPickle as pickle
+import datetime
+import marshal
+import os
+import struct
+import tempfile
+import unittest
+
+import impress.backup as impl
+import impress.model as model
+import impress.models.counters as counters
+
+def make_values(count=100):
+	cachedata = {}
+	for i in xrange(count):
+		cachedata["a_%d" % i] = counters.CacheModel({"x": i, "y": 1})
+
+	return {
+		"version": 5,
+		"interval_start": datetime.datetime(2014, 3, 9),
+		"cachedata": cachedata,
+		"downtime": datetime.timedelta(),
+		"snapshot_end": datetime.datetime(2014, 3, 9, 12),
+	}
+
+class PickledModel(object):
+
+	def upgrade(self):
+		pass
+
+	def get(self):
+		return {}
+
+class UnserializedModel(model.CacheModel):
+
+	def get(self):
+		return {}
+
+def items(cachedata):
+	return { objkey: modeldata.get() for objkey, modeldata in cachedata.iteritems() }
+
+class Indexed(unittest.TestCase):
+
+	def test_data(self):
+		values = make_values()
+		data = impl.NewBackup(values).dumps()
+
+		assert data.startswith(impl.MAGIC_5)
+
+		loaded = impl.BackupData(data, 0).load()
+
+		assert loaded["interval_start"] == values["interval_start"]
+		assert loaded["snapshot_end"] == values["snapshot_end"]
+		assert len(loaded["cachedata"]) == 100
+		assert items(loaded["cachedata"]) == items(values["cachedata"])
+
+	def test_file(self):
+		values = make_values()
+
+		fd, filename = tempfile.mkstemp()
+		try:
+			with os.fdopen(fd, "wb") as file:
+				impl.NewBackup(values).dump(file)
+
+			loaded = impl.BackupFile(filename).load()
+			assert items(loaded["cachedata"]) == items(values["cachedata"])
+		finally:
+			os.unlink(filename)
+
+	def test_lazy(self):
+		cachedata = impl.BackupData(impl.NewBackup(make_values()).dumps(), 0).load()["cachedata"]
+
+		assert "a_5" in cachedata
+		assert "b_5" not in cachedata
+		assert cachedata.get("b_5") is None
+
+		modeldata = cachedata.get("a_5")
+		modeldata.add({"x": 1}, None)
+		cachedata["b_0"] = counters.CacheModel({"z": 1})
+
+		assert cachedata.get("a_5") is modeldata
+		assert len(cachedata) == 101
+
+		records = dict((objkey, record) for objkey, record, _ in cachedata.iterrecords())
+		assert records["a_5"] is None
+		assert records["a_6"] is not None
+
+		clone = copy.deepcopy(cachedata)
+		assert clone.get("a_5") is not modeldata
+		assert clone.get("a_5").get() == {"x": 6, "y": 1}
+
+		# dumping again copies the pending records as they are
+		reloaded = impl.BackupData(impl.NewBackup({"cachedata": cachedata}).dumps(), 0).load()["cachedata"]
+		assert reloaded.get("a_5").get() == {"x": 6, "y": 1}
+		assert reloaded.get("a_6").get() == {"x": 6, "y": 1}
+		assert reloaded.get("b_0").get() == {"z": 1}
+
+	def test_compression(self):
+		values = make_values(1000)
+		for modeldata in values["cachedata"].itervalues():
+			modeldata.items.update(("item%d" % i, i) for i in xrange(20))
+
+		plain = impl.NewBackup(values).dumps()
+		compressed = impl.NewBackup(values, "zlib").dumps()
+
+		assert len(compressed) < len(plain)
+
+		loaded = impl.BackupData(compressed, 0).load()
+		assert items(loaded["cachedata"]) == items(values["cachedata"])
+
+	def test_pickle_model(self):
+		values = make_values(10)
+		values["cachedata"]["b_0"] = PickledModel()
+
+		loaded = impl.BackupData(impl.NewBackup(values).dumps(), 0).load()
+		assert isinstance(loaded["cachedata"].get("b_0"), PickledModel)
+		assert loaded["cachedata"].get("a_1").get() == {"x": 1, "y": 1}
+
+	def test_unserialized_model(self):
+		values = make_values(10)
+		values["cachedata"]["b_0"] = UnserializedModel()
+
+		loaded = impl.BackupData(impl.NewBackup(values, "zlib").dumps(), 0).load()
+		assert isinstance(loaded["cachedata"].get("b_0"), UnserializedModel)
+		assert loaded["cachedata"].get("a_1").get() == {"x": 1, "y": 1}
+
+	def test_version_4(self):
+		values = make_values()
+
+		header = dict(values)
+		del header["cachedata"]
+		data = pickle.dumps(header, 2)
+		chunks = [impl.MAGIC_4, struct.pack(">I", len(data)), data]
+		offset = sum(len(x) for x in chunks)
+		index = {}
+
+		for objkey, modeldata in values["cachedata"].iteritems():
+			data = pickle.dumps(modeldata, 2)
+			chunks += [struct.pack(">I", len(data)), data]
+			index[objkey] = offset
+			offset += 4 + len(data)
+
+		chunks += [marshal.dumps(index), struct.pack(">Q", offset)]
+
+		loaded = impl.BackupData("".join(chunks), 0).load()
+		assert items(loaded["cachedata"]) == items(values["cachedata"])
+
+		# converted to the current version
+		reloaded = impl.BackupData(impl.NewBackup(loaded).dumps(), 0).load()
+		assert items(reloaded["cachedata"]) == items(values["cachedata"])
+
+	def test_pickle(self):
+		values = make_values()
+		values["version"] = 3
+
+		loaded = impl.BackupData(pickle.dumps(values), 0).load()
+		assert items(loaded["cachedata"]) == items(values["cachedata"])
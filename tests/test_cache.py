@@ -0,0 +1,525 @@
+import ConfigParser as configparser
+import datetime
+import json
+import logging
+import marshal
+import os
+import shutil
+import tempfile
+import threading
+import time
+import unittest
+import zlib
+
+import impress.aggregate as aggregate
+import impress.backup as backup
+import impress.cache as impl
+import impress.config as config
+import impress.metrics as metrics
+import impress.models.counters as counters
+import impress.timeline as timeline
+import impress.wal as wal
+from impress.site import Site
+
+class Storage(object):
+	""" Records what the cache stores.
+	"""
+	raw_size = 0
+	stored_size = 0
+
+	def __init__(self):
+		self.slots = {}
+		self.backups = []
+		self.on_insert = None
+		self.on_backup = None
+
+	def reset(self):
+		pass
+
+	def get_cache_backup(self):
+		if self.backups:
+			return backup.BackupData(self.backups[-1], 0)
+		else:
+			return None
+
+	def insert_cache_backup(self, backup):
+		if self.on_backup:
+			self.on_backup(backup)
+
+		self.backups.append(backup.dumps())
+
+	def insert_many(self, slotkey, records):
+		for objkey, values in records:
+			if self.on_insert:
+				self.on_insert(objkey)
+
+			self.slots.setdefault(objkey, {})[slotkey] = values
+
+		return 0
+
+	def insert_avail_marker(self, slotkey, count, errors, downtime):
+		self.slots.setdefault(impl.AVAIL_MARKER_OBJKEY, {})[slotkey] = { "count": count, "errors": errors }
+
+	def get_slot(self, objkey, slotkey):
+		return self.slots.get(objkey, {}).get(slotkey)
+
+	def _get(self, objkey):
+		return sorted(self.slots.get(objkey, {}).items(), reverse=True)
+
+class LazyCacheData(backup.LazyCacheData):
+	""" Records the threads which decode the pending objects.
+	"""
+	threads = []
+
+	def materialize(self):
+		self.threads.append(threading.current_thread())
+		super(LazyCacheData, self).materialize()
+
+def configure(dirname, **sections):
+	parser = configparser.SafeConfigParser()
+	parser.add_section("site")
+	parser.set("site", "test", "test")
+	parser.add_section("interval")
+	parser.set("interval", "module", "impress.intervals.day")
+	parser.add_section("backup")
+	parser.set("backup", "local_cache_format", os.path.join(dirname, "cache.{site}"))
+	parser.set("backup", "local_history_format", os.path.join(dirname, "history.{site}.{slot}"))
+
+	for section, options in sections.iteritems():
+		if not parser.has_section(section):
+			parser.add_section(section)
+		for name, value in options.iteritems():
+			parser.set(section, name, value)
+
+	config.conf._impl = parser
+	config.log._impl = logging.getLogger("test")
+
+	# forget the interval class of a previous test
+	timeline.interval_type._IntervalProxy__class = None
+
+def make_sitecache(storage):
+	""" SiteCache with a fake storage.
+	"""
+	site = Site("test")
+
+	sitecache = impl.SiteCache.__new__(impl.SiteCache)
+	sitecache.storage = storage
+	sitecache.active = impl.Active(threading.Lock, site, storage)
+	sitecache.history = impl.History(threading.Lock, site)
+	sitecache.stored = impl.Stored(threading.Lock, site)
+	sitecache.stored.local.storage = storage
+	sitecache.limits = impl.Limits(site)
+	sitecache.bytes_per_key = 0
+	sitecache.spill_pending = False
+
+	return sitecache
+
+def load_slot(slot):
+	""" Round-trip through a backup, so that the objects are decoded lazily.
+	"""
+	data = slot.make_backup(datetime.datetime.today()).dumps()
+	return impl.Slot.load_backup(backup.BackupData(data, 0))
+
+class ThreadEngine(unittest.TestCase):
+
+	def setUp(self):
+		self.dirname = tempfile.mkdtemp()
+		configure(self.dirname, backup={ "engine": "thread" })
+
+	def tearDown(self):
+		shutil.rmtree(self.dirname)
+
+	def test_history_store(self):
+		site = Site("test")
+		now = site.current_datetime()
+
+		slot = impl.Slot(impl.interval_type(now), datetime.timedelta())
+		for i in xrange(10):
+			slot.add(["x_%d" % i], { "a": i }, counters, now)
+
+		slot = load_slot(slot)
+		slot.cachedata.__class__ = LazyCacheData
+		del LazyCacheData.threads[:]
+
+		history = impl.History(threading.Lock, site)
+		history.append(slot)
+
+		storage = Storage()
+		decoded = []
+
+		def on_insert(objkey):
+			# gets may run while storing
+			history.get(["x_0", "x_9"], lambda *args: None)
+			decoded.append(all(modeldata is not None for _, _, modeldata in slot.cachedata.iterrecords()))
+
+		storage.on_insert = on_insert
+
+		stored = history.store(storage)
+
+		assert stored == [slot]
+		assert history.slots == []
+		assert all(decoded) and len(decoded) == 10
+		assert LazyCacheData.threads[0] is threading.current_thread()
+		assert storage.slots["x_9"] == { slot.key: { "a": 9 } }
+		assert storage.slots[impl.AVAIL_MARKER_OBJKEY] == { slot.key: { "count": 10, "errors": 0 } }
+
+	def test_active_dump_backup(self):
+		storage = Storage()
+
+		active = impl.Active(threading.Lock, Site("test"), storage)
+		active.add(["x_1"], { "a": 1 }, counters)
+		active.dump_backup(storage, False)
+
+		assert len(storage.backups) == 1
+		assert not active.modified
+
+		slot = impl.Slot.load_backup(backup.BackupData(storage.backups[0], 0))
+		assert slot.cachedata["x_1"].get() == { "a": 1 }
+
+		# not modified since
+		active.dump_backup(storage, False)
+		assert len(storage.backups) == 1
+
+	def test_adds_while_dumping(self):
+		storage = Storage()
+
+		active = impl.Active(threading.Lock, Site("test"), storage)
+		active.add(["x_1", "x_2"], { "a": 1 }, counters)
+
+		def on_backup(new_backup):
+			# serialized after unlocking
+			assert new_backup.data is None
+			active.add(["x_1", "x_3"], { "a": 5 }, counters)
+
+		for i in xrange(2):
+			storage.on_backup = on_backup
+			active.dump_backup(storage, True)
+			assert len(storage.backups) == i + 1
+
+			slot = impl.Slot.load_backup(backup.BackupData(storage.backups[-1], 0))
+			assert slot.cachedata["x_1"].get() == { "a": 1 }
+			assert slot.cachedata["x_2"].get() == { "a": 1 }
+			assert "x_3" not in slot.cachedata
+
+			assert active.slot.cachedata["x_1"].get() == { "a": 6 }
+			assert active.slot.copied is None
+			assert active.modified
+
+			# the objects of a loaded backup are shared too
+			storage.on_backup = None
+			storage.backups = [storage.backups[0]]
+			active = impl.Active(threading.Lock, Site("test"), storage)
+			active.slot.cachedata.get("x_1")
+
+class EstimateSize(unittest.TestCase):
+
+	def setUp(self):
+		self.dirname = tempfile.mkdtemp()
+		configure(self.dirname)
+
+	def tearDown(self):
+		shutil.rmtree(self.dirname)
+
+	def test_slot(self):
+		now = datetime.datetime.today()
+
+		slot = impl.Slot(impl.interval_type(now), datetime.timedelta())
+		assert impl.estimate_slot_size(slot) == 0
+
+		for i in xrange(1000):
+			slot.add(["x_%d" % i], { "a": i }, counters, now)
+
+		size = impl.estimate_slot_size(slot, samples=10)
+		assert size > 1000 * 100
+
+		# undecoded objects are counted by their encoded size
+		lazy = load_slot(slot)
+		assert 0 < impl.estimate_slot_size(lazy, samples=10) < size
+		assert len(lazy.cachedata) == 1000
+
+class Index(unittest.TestCase):
+
+	def setUp(self):
+		self.dirname = tempfile.mkdtemp()
+		configure(self.dirname)
+
+	def tearDown(self):
+		shutil.rmtree(self.dirname)
+
+	def test_maintained(self):
+		now = datetime.datetime.today()
+
+		slot = impl.Slot(impl.interval_type(now), datetime.timedelta())
+		slot.add(["x_2", "y_1"], { "a": 1 }, counters, now)
+		slot.add(["x_1", "x_2"], { "a": 1 }, counters, now)
+
+		assert slot.index.count("x") == 2
+		assert slot.scan("x", "", None, 10) == ["x_1", "x_2"]
+
+		# the keys of a loaded backup are indexed without decoding the objects
+		lazy = load_slot(slot)
+		assert lazy.index.count("x") == 2
+		assert lazy.find_keys("y") == ["y_1"]
+		assert all(modeldata is None for _, _, modeldata in lazy.cachedata.iterrecords())
+
+		clone = slot.clone()
+		slot.add(["x_3"], { "a": 1 }, counters, now)
+		assert clone.scan("x", "", None, 10) == ["x_1", "x_2"]
+
+class Stored(unittest.TestCase):
+
+	def setUp(self):
+		self.dirname = tempfile.mkdtemp()
+		configure(self.dirname)
+
+		self.stored = impl.Stored(threading.Lock, Site("test"))
+		self.stored.local.storage = self
+		self.fetching = None
+
+	def tearDown(self):
+		shutil.rmtree(self.dirname)
+
+	def _get(self, objkey):
+		if self.fetching:
+			self.fetching()
+
+		return [("20140101", { "a": 1 })]
+
+	def test_get(self):
+		assert self.stored.get(["x_1"]) == [("x_1", [("20140101", '{"a":1}')])]
+		assert len(self.stored.rows) == 1
+
+	def test_invalidated_while_fetching(self):
+		slot = impl.Slot(impl.interval_type(datetime.datetime(2014, 1, 1)), cachedata={ "x_1": None })
+		self.fetching = lambda: self.stored.invalidate([slot])
+
+		assert self.stored.get(["x_1"]) == [("x_1", [("20140101", '{"a":1}')])]
+		assert len(self.stored.rows) == 0
+
+class ReplayLog(unittest.TestCase):
+
+	def setUp(self):
+		self.dirname = tempfile.mkdtemp()
+		self.path = os.path.join(self.dirname, "wal.test")
+		configure(self.dirname, backup={ "engine": "thread" }, wal={ "path": os.path.join(self.dirname, "wal.{site}"), "sync": "never" })
+
+		self.storage = Storage()
+
+	def tearDown(self):
+		shutil.rmtree(self.dirname)
+
+	def open(self):
+		return impl.Active(threading.Lock, Site("test"), self.storage)
+
+	def write_segment(self, sequence, records):
+		""" Log adds with the given times.
+		"""
+		log = wal.WriteAheadLog(self.path)
+
+		with open(log.segment_name(sequence), "ab") as file:
+			for timestamp, objkeys in records:
+				data = marshal.dumps((timestamp, objkeys, { "a": 1 }, "impress.models.counters"))
+				file.write(wal._header.pack(len(data), zlib.crc32(data) & 0xffffffff) + data)
+
+	def test_without_backup(self):
+		active = self.open()
+		active.add(["x_1"], { "a": 1 }, counters)
+		active.add(["x_1", "x_2"], { "a": 2 }, counters)
+		active.close()
+
+		active = self.open()
+		active.close()
+
+		assert active.replayed_slots == []
+		assert active.slot.cachedata["x_1"].get() == { "a": 3 }
+		assert active.slot.cachedata["x_2"].get() == { "a": 2 }
+
+	def test_sequence(self):
+		active = self.open()
+		active.add(["x_1"], { "a": 1 }, counters)
+		active.dump_backup(self.storage, True)
+		active.add(["x_1"], { "a": 2 }, counters)
+		active.close()
+
+		# the segment of the backed up add has been deleted
+		assert len(active.wal.segments()) == 1
+
+		active = self.open()
+		active.close()
+
+		assert active.slot.wal_sequence is not None
+		assert active.slot.cachedata["x_1"].get() == { "a": 3 }
+
+	def test_snapshot_end(self):
+		now = time.time()
+
+		slot = impl.Slot(impl.interval_type(datetime.datetime.fromtimestamp(now)), datetime.timedelta())
+		slot.add(["x_1"], { "a": 1 }, counters, datetime.datetime.fromtimestamp(now - 2))
+		self.storage.backups.append(slot.make_backup(datetime.datetime.fromtimestamp(now - 1)).dumps())
+
+		# the first add is in the backup
+		self.write_segment(1, [(now - 2, ["x_1"]), (now, ["x_1", "x_2"])])
+
+		active = self.open()
+		active.close()
+
+		assert active.slot.cachedata["x_1"].get() == { "a": 2 }
+		assert active.slot.cachedata["x_2"].get() == { "a": 1 }
+
+	def test_rotation(self):
+		now = time.time()
+		yesterday = now - 86400
+
+		self.write_segment(1, [(yesterday, ["x_1"]), (yesterday, ["x_2"]), (now, ["x_1"])])
+
+		active = self.open()
+		active.close()
+
+		rotated, = active.replayed_slots
+		assert rotated.key == impl.interval_type(datetime.datetime.fromtimestamp(yesterday)).key
+		assert sorted(rotated.cachedata) == ["x_1", "x_2"]
+
+		assert active.slot.is_active(datetime.datetime.fromtimestamp(now))
+		assert active.slot.cachedata.keys() == ["x_1"]
+		assert active.modified
+
+class Spill(unittest.TestCase):
+
+	def setUp(self):
+		self.dirname = tempfile.mkdtemp()
+		configure(self.dirname, backup={ "engine": "thread" }, limits={ "max_keys": "2" })
+
+		self.storage = Storage()
+		self.sitecache = make_sitecache(self.storage)
+
+	def tearDown(self):
+		shutil.rmtree(self.dirname)
+
+	def get(self, stored=False):
+		return json.loads(self.sitecache.get(["x_1", "x_2"], stored))
+
+	def test_spill(self):
+		sitecache = self.sitecache
+		slotkey = sitecache.active.slot.key
+
+		sitecache.add(["x_1"], '{"a":1}', counters)
+		sitecache.add(["x_2"], '{"a":1}', counters)
+		sitecache.add(["x_1"], '{"a":2}', counters)
+
+		spilled, = sitecache.history.slots
+		assert sitecache.active.slot.spilled
+		assert sorted(spilled.cachedata) == ["x_1", "x_2"]
+		assert sitecache.active.slot.cachedata.keys() == ["x_1"]
+
+		# the parts of the interval are merged
+		assert self.get() == { slotkey: { "x_1": { "a": 3 }, "x_2": { "a": 1 } } }
+
+		make_aggregator = lambda: aggregate.Sum("", 0)
+		assert json.loads(sitecache.aggregate(None, "x", make_aggregator)) == { slotkey: { "a": 4 } }
+
+		sitecache.flush()
+		assert sitecache.history.slots == []
+		assert self.storage.slots["x_1"] == { slotkey: { "a": 1 } }
+
+		# the stored part is included only if requested
+		assert self.get() == { slotkey: { "x_1": { "a": 2 } } }
+		assert self.get(stored=True) == { slotkey: { "x_1": { "a": 3 }, "x_2": { "a": 1 } } }
+
+		# the continuation is merged with the stored part
+		sitecache.history.append(sitecache.active.rotate(force=True))
+		sitecache.history.store(self.storage)
+
+		assert self.storage.slots["x_1"] == { slotkey: { "a": 3 } }
+		assert self.storage.slots["x_2"] == { slotkey: { "a": 1 } }
+		assert self.storage.slots[impl.AVAIL_MARKER_OBJKEY][slotkey] == { "count": 2, "errors": 0 }
+
+	def test_existing_keys(self):
+		sitecache = self.sitecache
+		slotkey = sitecache.active.slot.key
+		rejected = metrics.registry.counter("limits.rejected.keys", "test")
+		count = rejected.value
+
+		sitecache.add(["x_1"], '{"a":1}', counters)
+		sitecache.add(["x_2"], '{"a":1}', counters)
+		sitecache.add(["x_1"], '{"a":1}', counters)
+
+		# the spilled keys are still accepted while the store is pending
+		sitecache.add(["x_2"], '{"a":5}', counters)
+		sitecache.add(["x_2", "x_3"], '{"a":1}', counters)
+
+		assert sitecache.spill_pending
+		assert rejected.value == count + 1
+		assert self.get() == { slotkey: { "x_1": { "a": 2 }, "x_2": { "a": 7 } } }
+
+class Limits(unittest.TestCase):
+
+	def setUp(self):
+		self.dirname = tempfile.mkdtemp()
+
+	def tearDown(self):
+		shutil.rmtree(self.dirname)
+
+	def test_overrides(self):
+		configure(self.dirname, limits={ "max_keys": "10", "test.max_bytes": "1000", "test.action": "reject" })
+
+		limits = impl.Limits(Site("test"))
+		assert limits.max_keys == 10
+		assert limits.max_bytes == 1000
+		assert limits.action == "reject"
+
+		assert not limits.exceeded(9, 999)
+		assert limits.exceeded(10, 0)
+		assert limits.exceeded(0, 1000)
+
+	def test_unlimited(self):
+		configure(self.dirname)
+
+		limits = impl.Limits(Site("test"))
+		assert limits.action == "spill"
+		assert not limits.exceeded(1000000, 1 << 40)
+
+	def test_bad_action(self):
+		configure(self.dirname, limits={ "action": "drop" })
+		self.assertRaises(ValueError, impl.Limits, Site("test"))
+
+	def test_reject(self):
+		configure(self.dirname, limits={ "max_keys": "2", "action": "reject" })
+
+		sitecache = make_sitecache(Storage())
+		rejected = metrics.registry.counter("limits.rejected.keys", "test")
+		count = rejected.value
+
+		sitecache.add(["x_1"], '{"a":1}', counters)
+		sitecache.add(["x_2"], '{"a":1}', counters)
+		sitecache.add(["x_1", "x_3"], '{"a":1}', counters)
+		sitecache.add(["x_4"], '{"a":1}', counters)
+
+		cachedata = sitecache.active.slot.cachedata
+		assert sorted(cachedata) == ["x_1", "x_2"]
+		assert cachedata["x_1"].get() == { "a": 2 }
+		assert rejected.value == count + 2
+		assert sitecache.limits.warned
+		assert sitecache.history.slots == []
+
+class Migrate(unittest.TestCase):
+
+	def setUp(self):
+		self.dirname = tempfile.mkdtemp()
+		configure(self.dirname, registry={ "migration_batch": "2" })
+
+	def tearDown(self):
+		shutil.rmtree(self.dirname)
+
+	def test_migrate(self):
+		sitecache = make_sitecache(Storage())
+
+		for i in xrange(5):
+			sitecache.add(["x_%d" % i, "y_%d" % i], '{"a":%d}' % i, counters)
+
+		model = impl.load_model("impress.models.gauges:*=max")
+		sitecache.migrate("x", model)
+
+		cachedata = sitecache.active.slot.cachedata
+		assert all(isinstance(cachedata["x_%d" % i], model.CacheModel) for i in xrange(5))
+		assert all(isinstance(cachedata["y_%d" % i], counters.CacheModel) for i in xrange(5))
+		assert cachedata["x_3"].get() == { "a": 3 }
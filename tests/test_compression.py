@@ -0,0 +1,30 @@
+import unittest
+
+import impress.compression as impl
+
+class compress(unittest.TestCase):
+
+	def test_zlib(self):
+		codec = impl.get_codec("zlib")
+		data = "abc" * 1000
+
+		compressed = impl.compress(data, codec)
+		assert compressed.startswith(codec.prefix)
+		assert len(compressed) < len(data)
+		assert impl.decompress(compressed) == data
+
+	def test_uncompressed(self):
+		codec = impl.get_codec("zlib")
+
+		for data in ["abc" * 10, "x"]:
+			compressed = impl.compress(data, codec, 64)
+			assert compressed == impl.NONE.prefix + data
+			assert impl.decompress(compressed) == data
+
+	def test_bad(self):
+		self.assertRaises(ValueError, impl.get_codec, "bogus")
+		self.assertRaises(ValueError, impl.decompress, "\xffdata")
+
+	def test_ratio(self):
+		assert impl.ratio(300, 100) == "3.00"
+		assert impl.ratio(0, 0) == "n/a"
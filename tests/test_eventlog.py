@@ -0,0 +1,107 @@
+import json
+import os
+import socket
+import tempfile
+import time
+import unittest
+
+import impress.eventlog as impl
+
+class ListSink(object):
+
+	def __init__(self):
+		self.records = []
+
+	def write(self, records):
+		self.records.extend(records)
+
+class EventLog(unittest.TestCase):
+
+	def test_aggregate(self):
+		sink = ListSink()
+		logger = impl.BufferedLogger(sink)
+
+		logger.add("s", 0, 100, 2)
+		logger.add("s", 0, 300, 1)
+		logger.add("s", 1, 0, 0)
+		logger.store("s", 0, 10, ord("a"))
+		logger.service_error(impl.ERROR_NETWORK)
+		logger.close()
+
+		records = { (r["event"], r["error"]): r for r in sink.records }
+		assert len(records) == len(sink.records) == 4, sink.records
+
+		add = records[("add", 0)]
+		assert (add["site"], add["events"], add["count"], add["size"], add["sizes"]) == ("s", 2, 3, 400, { "128": 1, "512": 1 })
+		assert records[("add", 1)]["sizes"] == { "0": 1 }
+		assert records[("store", 0)]["tag"] == "a"
+		assert "site" not in records[("service_error", impl.ERROR_NETWORK)]
+
+	def test_ring(self):
+		sink = ListSink()
+		logger = impl.BufferedLogger(sink, size=2)
+
+		for i in xrange(5):
+			logger.get("s", 0, i, 1)
+
+		logger.forked()
+		logger.get("s", 0, 1, 1)
+		logger.flush()
+
+		assert sum(r["events"] for r in sink.records) == 1
+
+	def test_forked_thread(self):
+		sink = ListSink()
+		logger = impl.BufferedLogger(sink, size=2, interval=0.01)
+		logger.start()
+
+		thread = logger.thread
+		logger.forked()
+
+		# flushed by a new thread, before the buffer overflows
+		for i in xrange(10):
+			logger.get("s", 0, i, 1)
+			time.sleep(0.05)
+
+		logger.close()
+
+		assert logger.thread is not thread
+		assert sum(r["events"] for r in sink.records) == 10
+
+	def test_file(self):
+		fd, path = tempfile.mkstemp()
+		os.close(fd)
+
+		try:
+			sink = impl.make_sink("file:" + path)
+			sink.write([{ "a": 1 }])
+			sink.write([{ "b": 2 }])
+
+			with open(path) as file:
+				assert [json.loads(line) for line in file] == [{ "a": 1 }, { "b": 2 }]
+		finally:
+			os.unlink(path)
+
+	def test_udp(self):
+		receiver = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+		receiver.bind(("127.0.0.1", 0))
+		receiver.settimeout(5)
+
+		try:
+			sink = impl.make_sink("udp:127.0.0.1:%d" % receiver.getsockname()[1])
+			sink.max_datagram = 20
+			sink.write([{ "a": 1 }, { "b": 2 }, { "c": 3 }])
+
+			assert receiver.recv(100) == '{"a":1}\n{"b":2}\n'
+			assert receiver.recv(100) == '{"c":3}\n'
+		finally:
+			receiver.close()
+
+	def test_bad_sink(self):
+		for spec in ["file:", "udp:host", "udp:host:x", "tcp:host:1"]:
+			try:
+				impl.make_sink(spec)
+			except ValueError:
+				pass
+			else:
+				assert False, spec
@@ -0,0 +1,76 @@
+import datetime
+import json
+import unittest
+
+import impress.backup as backup
+import impress.models.gauges as impl
+import impress.registry as registry
+
+class Slot(object):
+
+	def __init__(self, start, modeldata):
+		self.interval = Interval(start)
+		self.modeldata = modeldata
+
+class Interval(object):
+
+	def __init__(self, start):
+		self.start = start
+
+class Gauges(unittest.TestCase):
+
+	def setUp(self):
+		self.model = registry.load_model("impress.models.gauges:a=sum,b=min,c=max,d=mean,*=last")
+
+	def test_add(self):
+		modeldata = self.model.CacheModel()
+		modeldata.add({ "a": 1, "b": 5, "c": 5, "d": 1, "e": 1, "f": "x" }, None)
+		modeldata.add({ "a": 2, "b": 3, "c": 3, "d": 2, "e": 7 }, None)
+
+		assert modeldata.get() == { "a": 3, "b": 3, "c": 5, "d": 1.5, "e": 7, "_counts": { "d": 2 } }
+		assert self.model.CacheModel.loads(modeldata.dumps()).get() == modeldata.get()
+
+	def test_merge(self):
+		start = datetime.datetime(2014, 2, 1)
+		days = []
+
+		for values in [{ "a": 1, "b": 5, "c": 1, "d": 4, "e": 1 }, { "a": 2, "b": 3, "c": 3, "d": 1 }]:
+			modeldata = self.model.CacheModel()
+			modeldata.add(values, None)
+			modeldata.add({ "d": 1 }, None)
+			days.append(self.model.TimelineModel(json.loads(json.dumps(modeldata.get()))))
+
+		month = self.model.TimelineModel()
+		slot = Slot(start, month)
+
+		month.merge(slot, Slot(start + datetime.timedelta(2), days[1]))
+		month.merge(slot, Slot(start + datetime.timedelta(1), days[0]))
+
+		assert month.get() == { "a": 3, "b": 3, "c": 3, "d": 1.75, "e": 1, "_counts": { "d": 4 } }
+
+		days[0].items["e"] = 2
+		month.merge(slot, Slot(start + datetime.timedelta(3), days[0]))
+		assert month.get()["e"] == 2
+
+	def test_configure(self):
+		assert registry.load_model("impress.models.gauges:a=sum,b=min,c=max,d=mean,*=last") is self.model
+		assert registry.load_model("impress.models.gauges") is impl
+		assert impl.parse_rules("*=max").get("x") == "max"
+
+		for options in ["a", "a=avg", "=sum"]:
+			try:
+				impl.parse_rules(options)
+			except ValueError:
+				pass
+			else:
+				assert False, options
+
+	def test_backup(self):
+		modeldata = self.model.CacheModel()
+		modeldata.add({ "d": 3 }, None)
+
+		data = backup.NewBackup({ "version": 5, "cachedata": { "g_1": modeldata } }).dumps()
+		loaded = backup.BackupData(data, 0).load()["cachedata"]["g_1"]
+
+		assert isinstance(loaded, self.model.CacheModel)
+		assert loaded.get() == modeldata.get()
@@ -0,0 +1,65 @@
+import ConfigParser as configparser
+import gc
+import logging
+import unittest
+
+import impress.config as config
+import impress.gctuning as impl
+import impress.metrics as metrics
+
+class GCTuning(unittest.TestCase):
+
+	def setUp(self):
+		config.conf._impl = configparser.SafeConfigParser()
+		config.log._impl = logging.getLogger("test")
+		self.thresholds = gc.get_threshold()
+
+	def tearDown(self):
+		gc.set_threshold(*self.thresholds)
+
+	def configure(self, **options):
+		for name, value in options.iteritems():
+			config.conf.set("gc", name, value)
+
+		manager = impl.Manager()
+		manager.configure()
+		return manager
+
+	def test_default(self):
+		manager = self.configure()
+
+		assert not manager.enabled
+		assert gc.get_threshold() == self.thresholds
+
+		manager.flushed(True)
+		assert gc.get_threshold() == self.thresholds
+
+	def test_managed(self):
+		manager = self.configure(mode="managed", threshold0_min="1000", threshold0_max="5000")
+
+		assert manager.enabled
+		assert gc.get_threshold()[2] == impl.SUPPRESSED_THRESHOLD
+
+		# rotation collects only if the objects can be frozen
+		pauses = metrics.registry.histogram("gc.pause.seconds").count
+		manager.flushed(True)
+		assert metrics.registry.histogram("gc.pause.seconds").count == pauses + hasattr(gc, "freeze")
+
+		# idle: minimum threshold
+		assert gc.get_threshold()[0] == 1000
+
+		# burst: maximum threshold
+		metrics.registry.counter("cache.new.keys").inc(1000000)
+		manager.flushed(False)
+		assert gc.get_threshold()[0] == 5000
+
+		config.conf.set("gc", "mode", "default")
+		manager.configure()
+		assert gc.get_threshold() == self.thresholds
+
+	def test_scheduled(self):
+		manager = self.configure(mode="managed", full_interval="0")
+
+		collections = metrics.registry.counter("gc.collections").value
+		manager.flushed(False)
+		assert metrics.registry.counter("gc.collections").value == collections + 1
@@ -0,0 +1,62 @@
+import unittest
+
+import impress.models.hyperloglog as impl
+
+class Slot(object):
+
+	def __init__(self, modeldata):
+		self.modeldata = modeldata
+
+class HyperLogLog(unittest.TestCase):
+
+	def check(self, count, expected, error=0.05):
+		assert abs(count - expected) <= expected * error, (count, expected)
+
+	def test_count(self):
+		modeldata = impl.CacheModel()
+		assert modeldata.get()["count"] == 0
+
+		modeldata.add(["a", u"b", 1, "a"], None)
+		assert modeldata.get()["count"] == 3
+		assert isinstance(modeldata.registers, dict)
+
+		for n in xrange(10):
+			modeldata.add(["id%d" % i for i in xrange(n * 10000, (n + 1) * 10000)], None)
+
+		assert not isinstance(modeldata.registers, dict)
+		self.check(modeldata.get()["count"], 100003)
+		assert modeldata.aggregate() == { "count": modeldata.get()["count"] }
+
+	def test_merge(self):
+		day1 = impl.CacheModel()
+		day1.add(["id%d" % i for i in xrange(0, 3000)], None)
+
+		day2 = impl.CacheModel()
+		day2.add(["id%d" % i for i in xrange(2000, 5000)], None)
+
+		month = impl.TimelineModel()
+		month.merge(None, Slot(impl.TimelineModel(day1.get())))
+		month.merge(None, Slot(impl.TimelineModel(day2.get())))
+		self.check(month.get()["count"], 5000)
+
+		day2.add(["id%d" % i for i in xrange(0, 3000)], None)
+		assert month.get() == day2.get()
+
+	def test_dumps(self):
+		for ids in [["a", "b"], range(5000)]:
+			modeldata = impl.CacheModel()
+			modeldata.add(ids, None)
+
+			loaded = impl.CacheModel.loads(modeldata.dumps())
+			assert loaded.get() == modeldata.get()
+
+			loaded.add(["c"], None)
+			assert loaded.get()["count"] >= modeldata.get()["count"]
+
+	def test_bad_sketch(self):
+		try:
+			impl.TimelineModel({ "sketch": "AAAA" })
+		except ValueError:
+			pass
+		else:
+			assert False
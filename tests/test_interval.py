@@ -0,0 +1,58 @@
+import bisect
+import datetime
+import unittest
+
+import impress.intervals.day as day
+import impress.intervals.hour as hour
+
+class Day(unittest.TestCase):
+
+	def test_key(self):
+		start = datetime.datetime(2014, 3, 9, 15, 30)
+
+		assert day.Interval(start).key == "20140309"
+		assert day.Interval(start, datetime.timedelta(days=31)).key == "20140309_31"
+
+	def test_parse(self):
+		interval = day.Interval.parse("20140301_31")
+
+		assert interval.start == datetime.datetime(2014, 3, 1)
+		assert interval.end == datetime.datetime(2014, 4, 1)
+		assert interval == day.Interval(datetime.datetime(2014, 3, 1), datetime.timedelta(days=31))
+		assert day.Interval.parse("20140301_31") is interval
+
+	def test_floor(self):
+		interval = day.Interval(datetime.datetime(2014, 3, 9, 15, 30))
+
+		assert interval.start == datetime.datetime(2014, 3, 9)
+		assert interval.end == datetime.datetime(2014, 3, 10)
+
+	def test_order(self):
+		month = day.Interval.parse("20140301_31")
+		first = day.Interval.parse("20140301")
+		second = day.Interval.parse("20140302")
+
+		assert month < first < second
+		assert second > first > month
+		assert month <= first and first <= first and first >= first
+		assert first != second
+
+		intervals = [month, second]
+		assert bisect.bisect_left(intervals, first) == 1
+
+class Hour(unittest.TestCase):
+
+	def test_key(self):
+		start = datetime.datetime(2014, 3, 9, 15, 30)
+
+		assert hour.Interval(start).key == "2014030915"
+		assert hour.Interval(start, datetime.timedelta(hours=6)).key == "2014030915_6"
+		assert hour.Interval(start, datetime.timedelta(days=2)).key == "2014030915_48"
+
+	def test_parse(self):
+		for key in ["2014030915", "2014030900_24", "2014030100_744"]:
+			assert hour.Interval.parse(key).key == key
+
+		interval = hour.Interval.parse("2014030900_24")
+		assert interval.delta == datetime.timedelta(days=1)
+		assert interval.end == datetime.datetime(2014, 3, 10)
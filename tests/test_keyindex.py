@@ -0,0 +1,30 @@
+import copy
+import unittest
+
+import impress.keyindex as impl
+
+class KeyIndex(unittest.TestCase):
+
+	def test_iterate(self):
+		index = impl.KeyIndex(["b_2", "a_3", "a_1", "b_1"])
+		index.add("a_2")
+		index.add("a_10")
+
+		assert list(index.iterate("a")) == ["a_1", "a_10", "a_2", "a_3"]
+		assert list(index.iterate("a", "a_1")) == ["a_1", "a_10"]
+		assert list(index.iterate("a", after="a_10")) == ["a_2", "a_3"]
+		assert list(index.iterate("a", "a_1", after="a_1")) == ["a_10"]
+		assert list(index.iterate("c")) == []
+		assert index.count("b") == 2
+
+	def test_copy(self):
+		index = impl.KeyIndex(["a_1"])
+		clone = copy.deepcopy(index)
+		clone.add("a_2")
+
+		assert list(index.iterate("a")) == ["a_1"]
+		assert list(clone.iterate("a")) == ["a_1", "a_2"]
+
+	def test_merge(self):
+		assert impl.merge_keys([iter(["a_1", "a_3"]), iter(["a_1", "a_2", "a_4"])], 3) == ["a_1", "a_2", "a_3"]
+		assert impl.merge_keys([iter(["a_1"]), iter([])], 10) == ["a_1"]
@@ -0,0 +1,53 @@
+import threading
+import time
+import unittest
+
+import impress.lru as impl
+
+class LRUCache(unittest.TestCase):
+
+	def test_entries(self):
+		cache = impl.LRUCache(threading.Lock, 2, 1000, 60)
+
+		cache.put("a", 1, 1)
+		cache.put("b", 2, 1)
+		assert cache.get("a") == 1
+
+		cache.put("c", 3, 1)
+		assert cache.get("b") is None
+		assert cache.get("a") == 1
+		assert cache.get("c") == 3
+		assert len(cache) == 2
+
+	def test_size(self):
+		cache = impl.LRUCache(threading.Lock, 100, 10, 60)
+
+		cache.put("a", 1, 4)
+		cache.put("b", 2, 4)
+		cache.put("c", 3, 4)
+		assert cache.get("a") is None
+		assert cache.size == 8
+
+		cache.put("d", 4, 11)
+		assert cache.get("d") is None
+
+	def test_ttl(self):
+		cache = impl.LRUCache(threading.Lock, 100, 100, 0.01)
+
+		cache.put("a", 1, 1)
+		assert cache.get("a") == 1
+
+		time.sleep(0.02)
+		assert cache.get("a") is None
+		assert cache.size == 0
+
+	def test_invalidate(self):
+		cache = impl.LRUCache(threading.Lock, 100, 100, 60)
+
+		cache.put("a_1", 1, 1)
+		cache.put("b_1", 2, 1)
+		cache.invalidate(lambda key: key.startswith("a"))
+
+		assert cache.get("a_1") is None
+		assert cache.get("b_1") == 2
+		assert cache.size == 1
@@ -0,0 +1,64 @@
+import unittest
+
+import impress.metrics as impl
+import impress.util as util
+
+class Metrics(unittest.TestCase):
+
+	def test_counters(self):
+		metrics = impl.Metrics()
+		metrics.counter("a").inc()
+		metrics.counter("a").inc(2)
+		metrics.counter("b", "s").inc()
+		metrics.gauge("c", lambda: 1.5)
+
+		histogram = metrics.histogram("d")
+		for value in [0.0001, 0.001, 0.002, 0.003]:
+			histogram.observe(value)
+
+		counters = metrics.counters()
+
+		assert counters["a"] == 3
+		assert counters["b.s"] == 1
+		assert counters["c"] == 1
+		assert counters["d.count"] == 4
+		assert counters["d.sum_us"] == 6100
+		assert counters["d.p50_us"] == 1600
+		assert counters["d.p99_us"] == 3200
+
+	def test_prometheus(self):
+		metrics = impl.Metrics()
+		metrics.counter("a.b", "s").inc(2)
+		metrics.histogram("c").observe(1)
+
+		lines = metrics.prometheus().splitlines()
+
+		assert "# TYPE impress_a_b counter" in lines
+		assert 'impress_a_b{site="s"} 2' in lines
+		assert 'impress_c_bucket{le="0.0001"} 0' in lines
+		assert 'impress_c_bucket{le="+Inf"} 1' in lines
+		assert "impress_c_count 1" in lines
+
+	def test_merge(self):
+		metrics = impl.Metrics()
+		metrics.counter("a").inc()
+		metrics.histogram("b", "s").observe(1)
+
+		other = impl.Metrics()
+		other.merge(metrics.dumps())
+		other.merge(metrics.dumps())
+
+		assert other.counters()["a"] == 2
+		assert other.counters()["b.s.count"] == 2
+
+	def test_fork(self):
+		counter = impl.registry.counter("test.fork")
+		counter.inc()
+
+		with util.Fork() as child:
+			if child:
+				counter.inc(2)
+
+		child.join()
+
+		assert counter.value == 3
@@ -0,0 +1,85 @@
+import ConfigParser as configparser
+import logging
+import os
+import tempfile
+import threading
+import time
+import unittest
+
+import impress.config as config
+import impress.profiling as impl
+
+class Target(object):
+
+	def add(self, x):
+		return x + 1
+
+class Profiling(unittest.TestCase):
+
+	def test_sampler(self):
+		stopped = threading.Event()
+
+		def busy_loop():
+			while not stopped.is_set():
+				sum(xrange(100))
+
+		thread = threading.Thread(target=busy_loop, name="busy")
+		thread.start()
+
+		sampler = impl.Sampler(0.001)
+		sampler.start()
+		time.sleep(0.05)
+		sampler.stop()
+
+		stopped.set()
+		thread.join()
+
+		assert sampler.samples > 0
+		assert any(stack.startswith("busy;") and "busy_loop (test_profiling.py:" in stack for stack in sampler.stacks)
+
+	def test_tracer(self):
+		tracer = impl.Tracer()
+		tracer.targets = [(__name__, "Target", "add")]
+		tracer.install()
+
+		assert Target().add(1) == 2
+		Target().add(2)
+		tracer.uninstall()
+		Target().add(3)
+
+		assert tracer.stats["Target.add"][0] == 2
+		assert "wrapper" not in repr(Target.__dict__["add"])
+
+	def test_profiler(self):
+		fd, path = tempfile.mkstemp()
+		os.close(fd)
+
+		parser = configparser.SafeConfigParser()
+		parser.add_section("profile")
+		parser.set("profile", "output", path)
+
+		config.conf._impl = parser
+		config.log._impl = logging.getLogger("test")
+
+		profiler = impl.Profiler()
+		profiler.set_interval("0.001")
+		assert profiler.get_output() == path
+
+		try:
+			profiler.set_sampler("start")
+			assert profiler.get_sampler().startswith("running")
+			time.sleep(0.02)
+			profiler.set_sampler("stop")
+			assert profiler.get_sampler() == "stopped"
+
+			with open(path) as file:
+				lines = file.read().splitlines()
+
+			assert lines and all(line.rsplit(" ", 1)[1].isdigit() for line in lines)
+		finally:
+			os.unlink(path)
+
+		for value in ["0", "x"]:
+			self.assertRaises(ValueError, profiler.set_interval, value)
+
+		self.assertRaises(ValueError, profiler.set_sampler, "pause")
@@ -0,0 +1,77 @@
+import json
+import random
+import unittest
+
+import impress.models.quantiles as impl
+
+class Slot(object):
+
+	def __init__(self, modeldata):
+		self.modeldata = modeldata
+
+class Quantiles(unittest.TestCase):
+
+	def check(self, value, expected):
+		assert abs(value - expected) <= expected * impl.relative_accuracy, (value, expected)
+
+	def test_get(self):
+		modeldata = impl.CacheModel()
+		assert modeldata.get() == { "count": 0 }
+
+		values = [random.Random(1).expovariate(0.01) for _ in xrange(10000)]
+		modeldata.add(values + ["x", None], None)
+
+		values.sort()
+		result = modeldata.get()
+
+		assert result["count"] == 10000
+		assert result["min"] == values[0]
+		assert result["max"] == values[-1]
+		self.check(result["p50"], values[4999])
+		self.check(result["p99"], values[9899])
+		assert "buckets" not in modeldata.aggregate()
+
+	def test_zero(self):
+		modeldata = impl.CacheModel()
+		modeldata.add([0, -1, 5, 5], None)
+
+		assert modeldata.get()["p50"] == 0
+		self.check(modeldata.get()["p99"], 5)
+
+	def test_ignored(self):
+		modeldata = impl.CacheModel()
+		modeldata.add(json.loads("[1, Infinity, -Infinity, NaN, true, false, 2]"), None)
+
+		result = modeldata.get()
+		assert result["count"] == 2
+		assert result["sum"] == 3
+		assert result["min"] == 1
+
+	def test_merge(self):
+		day1 = impl.CacheModel()
+		day1.add(range(1, 1001), None)
+
+		day2 = impl.CacheModel()
+		day2.add(range(1001, 3001), None)
+
+		month = impl.TimelineModel()
+		for day in [day1, day2]:
+			month.merge(None, Slot(impl.TimelineModel(json.loads(json.dumps(day.get())))))
+
+		day1.add(range(1001, 3001), None)
+		assert month.get() == day1.get()
+		self.check(month.get()["p90"], 2700)
+
+	def test_collapse(self):
+		modeldata = impl.CacheModel()
+		modeldata.add([1.1 ** i for i in xrange(3000)], None)
+
+		assert len(modeldata.buckets) == impl.max_buckets
+		assert modeldata.get()["count"] == 3000
+		self.check(modeldata.get()["p99"], 1.1 ** 2969)
+
+	def test_dumps(self):
+		modeldata = impl.CacheModel()
+		modeldata.add([1, 2.5, 0], None)
+
+		assert impl.CacheModel.loads(modeldata.dumps()).get() == modeldata.get()
@@ -0,0 +1,33 @@
+import datetime
+import unittest
+
+import impress.intervals.day as day
+import impress.query as impl
+
+def intervals(*keys):
+	return [day.Interval.parse(key) for key in keys]
+
+class Range(unittest.TestCase):
+
+	def test_time(self):
+		r = impl.Range(datetime.datetime(2014, 3, 2), datetime.datetime(2014, 3, 4))
+		select = r.selector([])
+
+		assert [select(i) for i in intervals("20140301", "20140302", "20140303", "20140304")] == [False, True, True, False]
+		assert select(day.Interval.parse("20140201_30"))
+
+	def test_count(self):
+		candidates = intervals("20140201_28", "20140301", "20140302", "20140303")
+		select = impl.Range(count=2).selector(candidates)
+
+		assert [select(i) for i in candidates] == [False, False, True, True]
+
+	def test_needs_stored(self):
+		cached = intervals("20140308", "20140309")
+
+		assert not impl.Range(count=2).needs_stored(cached)
+		assert impl.Range(count=3).needs_stored(cached)
+		assert not impl.Range(start=datetime.datetime(2014, 3, 9)).needs_stored(cached)
+		assert impl.Range(start=datetime.datetime(2014, 3, 1)).needs_stored(cached)
+		assert impl.Range(end=datetime.datetime(2014, 3, 9)).needs_stored(cached)
+		assert impl.Range(count=1).needs_stored([])
@@ -0,0 +1,103 @@
+import ConfigParser as configparser
+import datetime
+import logging
+import unittest
+
+import impress.config as config
+import impress.models.counters as counters
+import impress.models.gauges as gauges
+import impress.models.hyperloglog as hyperloglog
+import impress.models.timeseries as timeseries
+import impress.registry as impl
+
+def configure(**types):
+	parser = configparser.SafeConfigParser()
+	parser.add_section("type")
+	for name, value in types.iteritems():
+		parser.set("type", name, value)
+
+	config.conf._impl = parser
+	config.log._impl = logging.getLogger("test")
+
+class Registry(unittest.TestCase):
+
+	def test_reconfigure(self):
+		configure(x="ab impress.models.counters", y="c impress.models.gauges:*=max")
+		registry = impl.Registry()
+
+		assert registry.version == 0
+		assert registry.get_common_model(["a_1", "b_2"]) is counters
+
+		configure(x="a impress.models.counters", y="bc impress.models.gauges:*=max")
+		changed = registry.reconfigure()
+
+		assert registry.version == 1
+		assert changed.keys() == ["b"]
+		assert changed["b"] is registry.get_common_model(["b_1", "c_1"])
+
+		assert registry.reconfigure() == {}
+		assert registry.version == 1
+
+	def test_reconfigure_reload(self):
+		configure(x="a impress.models.counters")
+		registry = impl.Registry()
+
+		# a reloaded module is the same object
+		config.conf._impl.add_section("registry")
+		config.conf._impl.set("registry", "reload", "true")
+		changed = registry.reconfigure()
+
+		assert changed.keys() == ["a"]
+		assert changed["a"] is counters
+		assert registry.version == 1
+
+	def test_convert(self):
+		configure()
+
+		name = "impress.models.gauges:*=min"
+		old = impl.load_model(name).CacheModel()
+		old.add({ "x": 2 }, None)
+
+		# a configured model class is recreated when its module is reloaded
+		del impl._configured_models[name]
+		model = impl.load_model(name)
+		new = impl.convert_model(old, model)
+
+		assert isinstance(new, model.CacheModel)
+		new.add({ "x": 4 }, None)
+		assert new.get() == { "x": 2 }
+
+	def test_convert_items(self):
+		configure()
+
+		old = counters.CacheModel()
+		old.add({ "x": 2, "y": 3 }, None)
+
+		new = impl.convert_model(old, impl.load_model("impress.models.gauges:*=max"))
+		new.add({ "x": 1, "y": 4 }, None)
+		assert new.get() == { "x": 2, "y": 4 }
+
+		new = impl.convert_model(new, counters)
+		assert isinstance(new, counters.CacheModel)
+		assert new.get() == { "x": 2, "y": 4 }
+
+		old = timeseries.CacheModel()
+		old.add({ "x": 2, "y": 0.5 }, datetime.timedelta(hours=1))
+		old.add({ "x": 3 }, datetime.timedelta(hours=2))
+
+		# non-integral values aren't packed
+		model = impl.load_model("impress.models.packed:x,y")
+		new = impl.convert_model(old, model)
+		assert isinstance(new, model.CacheModel)
+		assert new.get() == { "x": 5 }
+
+	def test_convert_unsupported(self):
+		configure()
+
+		old = counters.CacheModel()
+		old.add({ "x": 2 }, None)
+
+		# the data isn't lost
+		assert impl.convert_model(old, hyperloglog) is old
+		assert impl.convert_model(old, timeseries) is old
+		assert old.get() == { "x": 2 }
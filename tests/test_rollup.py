@@ -0,0 +1,141 @@
+import ConfigParser as configparser
+import datetime
+import logging
+import unittest
+
+import impress.config as config
+import impress.models.counters as counters
+import impress.patterns.days_months as days_months
+import impress.patterns.rollup as impl
+import impress.timeline as timeline
+
+class Site(object):
+
+	def __init__(self, now):
+		self.now = now
+
+	def __str__(self):
+		return "test"
+
+	def current_datetime(self):
+		return self.now
+
+class Warnings(logging.Handler):
+
+	def __init__(self):
+		logging.Handler.__init__(self, logging.WARNING)
+		self.records = []
+
+	def emit(self, record):
+		self.records.append(record)
+
+def configure(interval_module, **rules):
+	parser = configparser.SafeConfigParser()
+	parser.add_section("interval")
+	parser.set("interval", "module", interval_module)
+	parser.add_section("rollup")
+	for objtype, value in rules.iteritems():
+		parser.set("rollup", objtype, value)
+
+	config.conf._impl = parser
+	config.log._impl = logging.getLogger("test")
+
+	# forget the interval class of a previous test
+	timeline.interval_type._IntervalProxy__class = None
+
+class parse_rules(unittest.TestCase):
+
+	def test_ok(self):
+		rules = impl.parse_rules("hour 48, day 60, month")
+		assert [(str(unit), keep) for unit, keep in rules] == [("hour", 48), ("day", 60), ("month", None)]
+
+	def test_bad(self):
+		for value in ["hour 48", "hour 48, day 60", "day 60, hour", "week 4, month", "day 0, month", "fortnight 2, month"]:
+			self.assertRaises(ValueError, impl.parse_rules, value)
+
+class merge(unittest.TestCase):
+
+	def test_hours(self):
+		configure("impress.intervals.hour", c="hour 48, day 2, month")
+
+		now = datetime.datetime(2014, 3, 10, 12, 30)
+		tl = timeline.Timeline(Site(now), "c_x", counters)
+
+		start = datetime.datetime(2014, 2, 25)
+		hour = datetime.timedelta(hours=1)
+		for i in xrange(int((now - start).total_seconds()) // 3600):
+			tl.add((start + hour * i).strftime("%Y%m%d%H"), {"n": 1})
+
+		impl.TimelinePattern.merge(tl)
+
+		keys = [slot.key for slot in tl.slots]
+
+		# February is merged into a month, early March into days
+		assert keys[0] == "2014020100_672"
+		assert keys[1:8] == ["201403%02d00_24" % d for d in xrange(1, 8)]
+		assert keys[8] == "2014030800"
+		assert keys[-1] == "2014031011"
+
+		assert tl.slots[0].get() == {"n": 96}
+		assert tl.slots[1].get() == {"n": 24}
+
+		inserted = set(slot.key for slot in tl.updated)
+		assert "2014020100_672" in inserted
+		assert "2014022600_24" not in inserted
+
+		# the next run doesn't try to merge the rolled up days again
+		again = timeline.Timeline(Site(now), "c_x", counters)
+		for slot in tl.slots:
+			again.add(slot.key, slot.get())
+
+		warnings = Warnings()
+		config.log._impl.addHandler(warnings)
+		try:
+			impl.TimelinePattern.merge(again)
+		finally:
+			config.log._impl.removeHandler(warnings)
+
+		assert warnings.records == []
+		assert [slot.key for slot in again.slots] == keys
+		assert not again.modified()
+
+	def test_days(self):
+		configure("impress.intervals.day", default="day 30, month 12, year")
+
+		now = datetime.datetime(2014, 3, 10)
+		tl = timeline.Timeline(Site(now), "a_x", counters)
+
+		start = datetime.datetime(2012, 11, 1)
+		for i in xrange((now - start).days):
+			tl.add((start + datetime.timedelta(days=i)).strftime("%Y%m%d"), {"n": 1})
+
+		impl.TimelinePattern.merge(tl)
+
+		keys = [slot.key for slot in tl.slots]
+
+		assert keys[:3] == ["20120101_366", "20130101_31", "20130201_28"]
+		assert tl.slots[0].get() == {"n": 61}
+		assert "20140101_31" in keys
+		assert "20140201" in keys
+		assert keys[-1] == "20140309"
+
+class DaysMonths(unittest.TestCase):
+
+	def test_merge(self):
+		configure("impress.intervals.day")
+
+		now = datetime.datetime(2014, 3, 10)
+		tl = timeline.Timeline(Site(now), "a_x", counters)
+
+		start = datetime.datetime(2013, 12, 20)
+		for i in xrange((now - start).days):
+			tl.add((start + datetime.timedelta(days=i)).strftime("%Y%m%d"), {"n": 1})
+
+		days_months.TimelinePattern.merge(tl)
+
+		keys = [slot.key for slot in tl.slots]
+
+		# the last month is skipped
+		assert keys[:2] == ["20131201_31", "20140101_31"]
+		assert keys[2] == "20140201"
+		assert tl.slots[0].get() == {"n": 12}
@@ -0,0 +1,107 @@
+import ConfigParser as configparser
+import datetime
+import json
+import unittest
+
+import impress.config as config
+import impress.models.timeseries as impl
+
+class Slot(object):
+
+	def __init__(self, start, modeldata, delta=datetime.timedelta(1)):
+		self.interval = Interval(start, delta)
+		self.modeldata = modeldata
+
+class Interval(object):
+
+	def __init__(self, start, delta):
+		self.start = start
+		self.delta = delta
+
+class TimeSeries(unittest.TestCase):
+
+	def setUp(self):
+		config.conf._impl = configparser.SafeConfigParser()
+
+	def test_add(self):
+		modeldata = impl.CacheModel()
+		modeldata.add({ "a": 1, "b": "x" }, datetime.timedelta(seconds=10))
+		modeldata.add({ "a": 2 }, datetime.timedelta(seconds=299))
+		modeldata.add({ "a": 1.5, "c": 1 }, datetime.timedelta(hours=1))
+
+		assert modeldata.get() == { "bin": 300, "items": { "a": [[0, 3], [12, 1.5]], "c": [[12, 1]] } }
+		assert modeldata.aggregate() == { "a": 4.5, "c": 1 }
+		assert impl.CacheModel.loads(modeldata.dumps()).get() == modeldata.get()
+
+	def test_merge(self):
+		day1 = impl.CacheModel()
+		day1.add({ "a": 1 }, datetime.timedelta(minutes=5))
+
+		day2 = impl.CacheModel()
+		day2.add({ "a": 2 }, datetime.timedelta(minutes=5))
+		day2.add({ "b": 3 }, datetime.timedelta(hours=1))
+
+		start = datetime.datetime(2014, 2, 1)
+
+		month = impl.TimelineModel()
+		month_slot = Slot(start, month)
+
+		for day, n in [(day1, 0), (day2, 1)]:
+			month.merge(month_slot, Slot(start + datetime.timedelta(n), impl.TimelineModel(json.loads(json.dumps(day.get())))))
+
+		assert month.get() == { "bin": 300, "items": { "a": [[1, 1], [289, 2]], "b": [[300, 3]] } }
+
+	def test_rebin(self):
+		day = impl.CacheModel()
+		day.add({ "a": 1 }, datetime.timedelta(minutes=5))
+		day.add({ "a": 2 }, datetime.timedelta(minutes=55))
+
+		start = datetime.datetime(2014, 2, 1)
+		other = impl.TimelineModel(day.get())
+
+		config.conf.set("timeseries", "bin_seconds", "3600")
+		month = impl.TimelineModel()
+
+		month.merge(Slot(start, month), Slot(start, other))
+
+		assert month.get() == { "bin": 3600, "items": { "a": [[0, 3]] } }
+
+	def test_long_slot(self):
+		start = datetime.datetime(2014, 1, 1)
+		month = impl.TimelineModel()
+		month_slot = Slot(start, month, datetime.timedelta(31))
+
+		for n in xrange(31):
+			day = impl.CacheModel()
+			day.add({ "a": 1 }, datetime.timedelta(minutes=5))
+			day.add({ "a": 2 }, datetime.timedelta(minutes=55))
+			day.add({ "a": 4 }, datetime.timedelta(hours=23))
+			month.merge(month_slot, Slot(start + datetime.timedelta(n), impl.TimelineModel(day.get())))
+
+		values = month.get()
+		assert values["bin"] == 3600
+		assert len(values["items"]["a"]) == 62
+		assert values["items"]["a"][:3] == [[0, 3], [23, 4], [24, 3]]
+
+		# a stored month is rebinned when merged into a year
+		year = impl.TimelineModel()
+		year.merge(Slot(start, year, datetime.timedelta(365)), Slot(start, impl.TimelineModel(values), datetime.timedelta(31)))
+
+		assert year.get() == { "bin": 43200, "items": { "a": [[i, 3 if i % 2 == 0 else 4] for i in xrange(62)] } }
+
+	def test_merged_bin_seconds(self):
+		assert impl.merged_bin_seconds(datetime.timedelta(1), 300) == 300
+		assert impl.merged_bin_seconds(datetime.timedelta(7), 300) == 900
+		assert impl.merged_bin_seconds(datetime.timedelta(31), 300) == 3600
+		assert impl.merged_bin_seconds(datetime.timedelta(3000), 300) == 86400 * 3
+
+	def test_convert(self):
+		modeldata = impl.CacheModel()
+		modeldata.add({ "a": 1 }, datetime.timedelta(minutes=5))
+		modeldata.add({ "a": 2, "b": 0.5 }, datetime.timedelta(hours=1))
+
+		config.conf.set("timeseries", "bin_seconds", "60")
+		converted = impl.CacheModel(json.loads(json.dumps(modeldata.get())))
+
+		assert converted.get() == modeldata.get()
+		assert converted.aggregate() == { "a": 3, "b": 0.5 }
@@ -0,0 +1,79 @@
+import cPickle as pickle
+import collections
+import random
+import unittest
+
+import impress.topk as impl
+
+class SpaceSaving(unittest.TestCase):
+
+	def test_exact(self):
+		tracker = impl.SpaceSaving(10)
+		for key, value in [("a", 1), ("b", 5), ("a", 3), ("c", 2)]:
+			tracker.add(key, value)
+
+		assert tracker.top(2) == [("b", 5, 0), ("a", 4, 0)]
+
+	def test_heavy_hitters(self):
+		rand = random.Random(1)
+		totals = collections.defaultdict(int)
+		tracker = impl.SpaceSaving(50)
+
+		for i in xrange(20000):
+			if rand.random() < 0.5:
+				key = "x_%d" % rand.randint(0, 4)
+			else:
+				key = "y_%d" % rand.randint(0, 5000)
+
+			totals[key] += 1
+			tracker.add(key, 1)
+
+		assert len(tracker) == 50
+		assert sorted(key for key, _, _ in tracker.top(5)) == ["x_%d" % i for i in xrange(5)]
+
+		for key, total, error in tracker.top(50):
+			assert total - error <= totals[key] <= total
+
+	def test_pickle(self):
+		tracker = impl.SpaceSaving(2)
+		tracker.add("a", 3)
+		tracker.add("b", 1)
+
+		tracker = pickle.loads(pickle.dumps(tracker, pickle.HIGHEST_PROTOCOL))
+		tracker.add("c", 2)
+
+		assert tracker.top(2) == [("a", 3, 0), ("c", 3, 1)]
+
+class Trackers(unittest.TestCase):
+
+	def test_add(self):
+		trackers = impl.Trackers(impl.parse_spec("a:clicks, a:views 5"))
+		trackers.add(["a_1", "b_1"], { "clicks": 2, "views": -1 })
+		trackers.add(["a_2"], { "clicks": 1, "views": 4 })
+		trackers.add(["a_3"], [1, 2])
+
+		assert trackers.top("a", "clicks", 10) == [("a_1", 2, 0), ("a_2", 1, 0)]
+		assert trackers.top("a", "views", 10) == [("a_2", 4, 0)]
+		assert trackers.top("b", "clicks", 10) is None
+
+	def test_reconfigure(self):
+		old = impl.Trackers(impl.parse_spec("a:clicks, a:views"))
+		old.add(["a_1"], { "clicks": 1, "views": 1 })
+
+		new = impl.Trackers(impl.parse_spec("a:clicks, a:views 5, b:clicks"), old)
+
+		assert new.top("a", "clicks", 10) == [("a_1", 1, 0)]
+		assert new.top("a", "views", 10) == []
+		assert new.top("b", "clicks", 10) == []
+
+	def test_parse_spec(self):
+		assert impl.parse_spec("") == []
+		assert impl.parse_spec("a:x, b:y 10") == [("a", "x", impl.default_capacity), ("b", "y", 10)]
+
+		for spec in ["a", "a:", ":x", "a:x:y", "a:x 0", "a:x 10 20"]:
+			try:
+				impl.parse_spec(spec)
+			except ValueError:
+				pass
+			else:
+				assert False, spec
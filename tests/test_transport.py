@@ -0,0 +1,117 @@
+import logging
+import threading
+import time
+import unittest
+
+import impress.config as config
+import impress.transport as impl
+
+class Throttled(Exception):
+	pass
+
+class Transport(unittest.TestCase):
+
+	def setUp(self):
+		config.log._impl = logging.getLogger("test")
+
+	def test_limiter(self):
+		limiter = impl.Limiter(4, 8)
+
+		# about one more per window of successes
+		for _ in xrange(4):
+			limiter.succeeded()
+		assert 4.9 <= limiter.limit <= 5
+
+		for _ in xrange(100):
+			limiter.succeeded()
+		assert limiter.limit == 8
+
+		limiter.throttled()
+		assert limiter.limit == 4
+
+		for _ in xrange(10):
+			limiter.throttled()
+		assert limiter.limit == 1
+
+	def test_pool(self):
+		lock = threading.Lock()
+		connections = []
+		results = []
+
+		def connect():
+			with lock:
+				connections.append(object())
+				return connections[-1]
+
+		attempts = {}
+
+		def request(connection, n):
+			assert connection in connections
+
+			with lock:
+				attempts[n] = attempts.get(n, 0) + 1
+				if n % 10 == 0 and attempts[n] == 1:
+					raise Throttled()
+				if n == 7:
+					raise Exception("failed")
+
+				results.append(n)
+
+		limiter = impl.Limiter(2, 4)
+		pool = impl.Pool(4, limiter, connect, lambda e: isinstance(e, Throttled), "test")
+		batch = impl.Batch()
+
+		for n in xrange(50):
+			pool.submit(batch, request, (n,))
+
+		assert batch.wait() == 1
+		assert sorted(results) == [n for n in xrange(50) if n != 7]
+		assert len(connections) <= 4
+		assert limiter.inflight == 0
+
+	def test_token_bucket(self):
+		bucket = impl.TokenBucket(100)
+
+		start = time.time()
+		for _ in xrange(150):
+			bucket.acquire()
+		elapsed = time.time() - start
+		assert 0.4 <= elapsed <= 1.0
+
+		bucket.throttled()
+		assert bucket.rate == 50
+
+		for _ in xrange(1000):
+			bucket.throttled()
+		assert bucket.rate == 1
+
+		for _ in xrange(1000):
+			bucket.succeeded()
+		assert bucket.rate == 100
+
+	def test_unlimited_bucket(self):
+		bucket = impl.TokenBucket(0)
+
+		for _ in xrange(1000):
+			bucket.acquire()
+
+		bucket.throttled()
+		assert bucket.rate == 0
+
+	def test_backoff(self):
+		for attempt in xrange(20):
+			assert 0 <= impl.backoff(attempt) <= 5.0
+
+	def test_requeue(self):
+		def request(connection, n):
+			if n % 2:
+				raise Throttled()
+
+		pool = impl.Pool(2, impl.Limiter(2, 2), object, lambda e: isinstance(e, Throttled), "test", retries=1)
+		batch = impl.Batch()
+
+		for n in xrange(10):
+			pool.submit(batch, request, (n,))
+
+		assert batch.wait() == 0
+		assert sorted(batch.requeued) == [(n,) for n in xrange(1, 10, 2)]
@@ -87,3 +87,30 @@ class Fork(unittest.TestCase):
 			pass
 		else:
 			assert False
+
+class Worker(unittest.TestCase):
+
+	def test_ok(self):
+		result = []
+
+		worker = impl.Worker(result.append, ("x",))
+
+		try:
+			worker.join()
+		except worker.Error:
+			assert False
+
+		assert result == ["x"]
+
+	def test_exception(self):
+		def func():
+			raise Exception("message")
+
+		worker = impl.Worker(func)
+
+		try:
+			worker.join()
+		except worker.Error:
+			pass
+		else:
+			assert False
@@ -0,0 +1,62 @@
+import logging
+import os
+import shutil
+import tempfile
+import unittest
+
+import impress.config as config
+import impress.wal as impl
+
+class WriteAheadLog(unittest.TestCase):
+
+	def setUp(self):
+		config.log._impl = logging.getLogger("test")
+		self.dirname = tempfile.mkdtemp()
+		self.path = os.path.join(self.dirname, "wal")
+
+	def tearDown(self):
+		shutil.rmtree(self.dirname)
+
+	def test_replay(self):
+		wal = impl.WriteAheadLog(self.path, "always")
+		wal.start()
+
+		wal.append(["a_1"], { "x": 1 }, "impress.models.counters")
+		sequence = wal.rotate()
+		wal.append(["a_1", "a_2"], { "x": 2 }, "impress.models.counters")
+		wal.close()
+
+		records = list(impl.WriteAheadLog(self.path).replay())
+		assert [record[1:] for record in records] == [
+			(["a_1"], { "x": 1 }, "impress.models.counters"),
+			(["a_1", "a_2"], { "x": 2 }, "impress.models.counters"),
+		]
+
+		records = list(impl.WriteAheadLog(self.path).replay(sequence=sequence))
+		assert [record[1] for record in records] == [["a_1", "a_2"]]
+
+		records = list(impl.WriteAheadLog(self.path).replay(after=records[0][0]))
+		assert records == []
+
+		wal = impl.WriteAheadLog(self.path)
+		assert wal.sequence == sequence + 1
+
+		wal.truncate(sequence)
+		assert [number for number, _ in wal.segments()] == [sequence]
+
+	def test_torn_record(self):
+		wal = impl.WriteAheadLog(self.path, "never")
+		wal.start()
+		wal.append(["a_1"], { "x": 1 }, "m")
+		wal.append(["a_2"], { "x": 2 }, "m")
+		wal.close()
+
+		(_, filename), = wal.segments()
+		with open(filename, "r+b") as file:
+			file.truncate(os.path.getsize(filename) - 1)
+
+		records = list(impl.WriteAheadLog(self.path).replay())
+		assert [record[1] for record in records] == [["a_1"]]
+
+	def test_bad_policy(self):
+		self.assertRaises(ValueError, impl.WriteAheadLog, self.path, "sometimes")